@@ -8,9 +8,15 @@ from flask_cors import CORS
 from config import Config
 import logging
 import os
+import time
+
+from sqlalchemy import text
 
 from routes import memories, insights
 from models import db
+from commands import embeddings_cli, vectors_cli, insights_cli
+from services.embedding_jobs import start_embedding_worker
+from services import embedding_service, llm, metrics
 
 
 
@@ -44,16 +50,59 @@ def create_app(config_class=Config):
     # Initialize extensions with app
     db.init_app(app)
     migrate.init_app(app, db)
+    app.cli.add_command(embeddings_cli)
+    app.cli.add_command(vectors_cli)
+    app.cli.add_command(insights_cli)
     CORS(app, origins=["http://localhost:5173"])
+    metrics.init_app(app)
     
     # Register blueprints
     app.register_blueprint(memories.bp, url_prefix='/api/memories')
     app.register_blueprint(insights.bp, url_prefix='/api/insights')
+    
+    # Start the embedding worker with the first request rather than at import,
+    # so `flask db ...` and other CLI invocations don't spawn it
+    if app.config['EMBEDDING_WORKER_ENABLED']:
+        @app.before_request
+        def ensure_embedding_worker():
+            start_embedding_worker(app)
 
     
     return app
 
+
+def warm_up(app):
+    """Pre-open DB and provider connections so the first requests don't pay for them.
+
+    Called by the serving entry points rather than create_app(), so CLI commands skip it.
+    Failures are logged and never stop the server from starting.
+    """
+    started = time.perf_counter()
+    with app.app_context():
+        try:
+            # Check out several at once so the pool keeps that many open
+            connections = [db.engine.connect() for _ in range(app.config['WARMUP_DB_CONNECTIONS'])]
+            for conn in connections:
+                conn.execute(text('SELECT 1'))
+                conn.close()
+        except Exception as e:
+            app.logger.warning(f"Warm-up: database connections failed: {e}")
+
+        for name, step in (('embedding provider', embedding_service.warm_up), ('Anthropic', llm.warm_up)):
+            try:
+                step()
+            except Exception as e:
+                app.logger.warning(f"Warm-up: {name} failed: {e}")
+
+        if app.config['EMBEDDING_WORKER_ENABLED']:
+            start_embedding_worker(app)
+
+    app.logger.info(f"Warm-up finished in {time.perf_counter() - started:.2f}s")
+
+
 if __name__ == '__main__':
     app = create_app()
+    if app.config['WARMUP_ENABLED']:
+        warm_up(app)
     debug_mode = os.getenv('FLASK_ENV') == 'development'
     app.run(debug=debug_mode, port=5000)
\ No newline at end of file
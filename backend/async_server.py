@@ -0,0 +1,40 @@
+# async_server.py
+"""Serve the API on gevent for high request concurrency.
+
+Analysis and search requests spend nearly all their time waiting on Voyage, Anthropic
+and Postgres. Under gevent that waiting is cooperative: sockets (httpx in both SDKs) and
+psycopg2 (via psycogreen) yield to other requests, so one process holds up to
+SERVER_CONCURRENCY requests in flight instead of one per thread.
+
+    PORT=5001 python async_server.py
+
+Run one per core behind a load balancer for more than one CPU's worth of work.
+"""
+from gevent import monkey
+monkey.patch_all()  # must run before anything imports socket/ssl/threading
+
+from psycogreen.gevent import patch_psycopg
+patch_psycopg()  # make psycopg2 wait on the event loop instead of blocking the process
+
+import os
+
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+
+from app import create_app, warm_up
+from config import Config
+
+
+def serve(port=None):
+    app = create_app()
+    port = int(port or os.getenv('PORT', 5000))
+    if Config.WARMUP_ENABLED:
+        warm_up(app)
+
+    server = WSGIServer(('0.0.0.0', port), app, spawn=Pool(Config.SERVER_CONCURRENCY))
+    print(f"Serving on :{port} with gevent (up to {Config.SERVER_CONCURRENCY} concurrent requests)")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    serve()
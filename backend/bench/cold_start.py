@@ -0,0 +1,95 @@
+# bench/cold_start.py
+"""Cold-start budget check: how long a fresh interpreter takes to import the app and run create_app().
+
+Each run is a new process, so nothing is cached in sys.modules. Fails (exit 1) when the median
+is over --budget-ms, or when create_app() imported a provider SDK - those are supposed to load
+on the first embed / Claude call, not at boot. --top lists the slowest imports from -X importtime.
+
+    cd backend
+    python -m bench.cold_start --runs 5 --budget-ms 1500 --top 15
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+# Must stay out of sys.modules until a request needs them (see services/llm.py, embedding_service.get_provider)
+DEFERRED_MODULES = ('anthropic', 'voyageai', 'onnxruntime', 'sentence_transformers', 'httpx')
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+create_app()
+finished = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'create_app_ms': (finished - imported) * 1000,
+    'total_ms': (finished - started) * 1000,
+    'loaded': [m for m in %r if m in sys.modules]
+}))
+""" % (DEFERRED_MODULES,)
+
+
+def probe(env, importtime=False):
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', PROBE]
+    result = subprocess.run(command, capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.dirname(__file__)))
+    if result.returncode:
+        raise RuntimeError(f"create_app() failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def slowest_imports(importtime_output, top):
+    """(cumulative us, module) of the top-level imports that cost the most"""
+    rows = []
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):  # top-level imports only - nested ones are inside these
+            rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=1500.0, help='median import + create_app() time allowed')
+    parser.add_argument('--top', type=int, default=0, help='list the N slowest top-level imports')
+    args = parser.parse_args()
+
+    # create_app() only reads these; nothing connects during the probe
+    env = dict(os.environ)
+    env.setdefault('DATABASE_URL', 'postgresql://localhost/remember')
+    env.setdefault('SUPABASE_JWT_SECRET', 'cold-start')
+    env['EMBEDDING_WORKER_ENABLED'] = 'false'
+
+    runs = [probe(env)[0] for _ in range(args.runs)]
+    median = {key: statistics.median(run[key] for run in runs) for key in ('import_ms', 'create_app_ms', 'total_ms')}
+    loaded = sorted({module for run in runs for module in run['loaded']})
+
+    print(f"{args.runs} runs, median: import {median['import_ms']:.0f} ms + create_app {median['create_app_ms']:.0f} ms "
+          f"= {median['total_ms']:.0f} ms (budget {args.budget_ms:.0f} ms)")
+
+    if args.top:
+        print("\nslowest top-level imports (cumulative):")
+        for micros, module in slowest_imports(probe(env, importtime=True)[1], args.top):
+            print(f"  {micros / 1000:8.1f} ms  {module}")
+
+    failures = []
+    if median['total_ms'] > args.budget_ms:
+        failures.append(f"cold start {median['total_ms']:.0f} ms is over the {args.budget_ms:.0f} ms budget")
+    if loaded:
+        failures.append(f"create_app() imported {', '.join(loaded)}, which should load lazily")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
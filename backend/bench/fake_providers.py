@@ -0,0 +1,215 @@
+# bench/fake_providers.py
+"""Local stand-ins for the Voyage embeddings and Anthropic messages APIs.
+
+Vectors are a deterministic function of the input text (same text -> same unit vector, and
+texts sharing words land near each other), completions are canned, and every call sleeps for
+a configurable latency, so benchmarks run without API keys and repeat exactly.
+
+    python -m bench.fake_providers --port 8765 --embed-latency 0.08 --llm-latency 1.5
+    VOYAGE_BASE_URL=http://localhost:8765/v1 ANTHROPIC_BASE_URL=http://localhost:8765 flask run
+"""
+import argparse
+import base64
+import functools
+import hashlib
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+DIMENSIONS = 1024
+CHARS_PER_TOKEN = 4
+
+
+@functools.lru_cache(maxsize=50000)
+def _word_vector(word):
+    seed = int.from_bytes(hashlib.sha256(word.encode('utf-8')).digest()[:8], 'little')
+    return np.random.default_rng(seed).standard_normal(DIMENSIONS).astype(np.float32)
+
+
+def fake_embedding(text):
+    """Unit vector that is the normalized sum of per-word random vectors"""
+    vector = np.sum([_word_vector(word) for word in (text.lower().split() or ['<empty>'])[:256]], axis=0)
+    return (vector / (np.linalg.norm(vector) or 1.0)).tolist()
+
+
+def _tokens(text):
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def _text_of(content):
+    if isinstance(content, str):
+        return content
+    return ''.join(block.get('text', '') for block in content or [])
+
+
+class FakeProviderServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, embed_latency=0.05, llm_latency=1.0, tokens_per_second=0.0, answer_tokens=300):
+        super().__init__(address, FakeProviderHandler)
+        self.embed_latency = embed_latency
+        self.llm_latency = llm_latency
+        self.tokens_per_second = tokens_per_second  # 0 = whole answer after llm_latency
+        self.answer_tokens = answer_tokens
+        self.cached_prefixes = set()  # emulates prompt caching on the system prefix
+        self.lock = threading.Lock()
+        self.calls = {'embeddings': 0, 'messages': 0}
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name='fake-providers', daemon=True)
+        thread.start()
+        return self
+
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length) or b'{}')
+
+        if self.path.rstrip('/').endswith('/embeddings'):
+            return self._embeddings(payload)
+        if self.path.rstrip('/').endswith('/messages'):
+            return self._messages(payload)
+        self._json(404, {'error': {'type': 'not_found', 'message': self.path}})
+
+    def _embeddings(self, payload):
+        server = self.server
+        with server.lock:
+            server.calls['embeddings'] += 1
+        time.sleep(server.embed_latency)
+
+        texts = payload.get('input') or []
+        if isinstance(texts, str):
+            texts = [texts]
+
+        data = []
+        for i, text in enumerate(texts):
+            vector = fake_embedding(text)
+            if payload.get('encoding_format') == 'base64':
+                vector = base64.b64encode(np.asarray(vector, dtype='<f4').tobytes()).decode('ascii')
+            data.append({'object': 'embedding', 'embedding': vector, 'index': i})
+
+        self._json(200, {
+            'object': 'list',
+            'data': data,
+            'model': payload.get('model'),
+            'usage': {'total_tokens': sum(_tokens(t) for t in texts)}
+        })
+
+    def _usage(self, payload):
+        server = self.server
+        system = payload.get('system') or ''
+        system_text = _text_of(system) if not isinstance(system, str) else system
+        history = ''.join(_text_of(m.get('content')) for m in payload.get('messages', []))
+
+        prefix = hashlib.sha256(system_text.encode('utf-8')).hexdigest()
+        with server.lock:
+            server.calls['messages'] += 1
+            cache_hit = prefix in server.cached_prefixes
+            server.cached_prefixes.add(prefix)
+
+        system_tokens = _tokens(system_text)
+        return {
+            'input_tokens': _tokens(history),
+            'output_tokens': server.answer_tokens,
+            'cache_creation_input_tokens': 0 if cache_hit else system_tokens,
+            'cache_read_input_tokens': system_tokens if cache_hit else 0
+        }
+
+    def _answer(self, payload):
+        question = _text_of(payload['messages'][-1].get('content')) if payload.get('messages') else ''
+        words = ['Looking', 'across', 'these', 'memories,', 'a', 'recurring', 'theme', 'stands', 'out.']
+        answer = ' '.join(words[i % len(words)] for i in range(self.server.answer_tokens))
+        return f'(fake analysis of: {question[:80]}) {answer}'
+
+    def _messages(self, payload):
+        server = self.server
+        usage = self._usage(payload)
+        answer = self._answer(payload)
+        message_id = f'msg_{uuid.uuid4().hex[:24]}'
+
+        if not payload.get('stream'):
+            time.sleep(server.llm_latency)
+            return self._json(200, {
+                'id': message_id,
+                'type': 'message',
+                'role': 'assistant',
+                'model': payload.get('model'),
+                'content': [{'type': 'text', 'text': answer}],
+                'stop_reason': 'end_turn',
+                'stop_sequence': None,
+                'usage': usage
+            })
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def event(name, data):
+            self.wfile.write(f'event: {name}\ndata: {json.dumps(data)}\n\n'.encode('utf-8'))
+            self.wfile.flush()
+
+        # Time to first token, then (optionally) a steady token rate
+        time.sleep(server.llm_latency)
+        event('message_start', {'type': 'message_start', 'message': {
+            'id': message_id, 'type': 'message', 'role': 'assistant', 'model': payload.get('model'),
+            'content': [], 'stop_reason': None, 'stop_sequence': None,
+            'usage': dict(usage, output_tokens=1)
+        }})
+        event('content_block_start', {'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}})
+        for word in answer.split(' '):
+            event('content_block_delta', {'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': word + ' '}})
+            if server.tokens_per_second:
+                time.sleep(1 / server.tokens_per_second)
+        event('content_block_stop', {'type': 'content_block_stop', 'index': 0})
+        event('message_delta', {'type': 'message_delta', 'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+                                'usage': {'output_tokens': usage['output_tokens']}})
+        event('message_stop', {'type': 'message_stop'})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--embed-latency', type=float, default=0.05, help='seconds per embeddings call')
+    parser.add_argument('--llm-latency', type=float, default=1.0, help='seconds to the first token / full answer')
+    parser.add_argument('--tokens-per-second', type=float, default=0.0, help='streaming rate after the first token')
+    args = parser.parse_args()
+
+    server = FakeProviderServer(
+        (args.host, args.port),
+        embed_latency=args.embed_latency,
+        llm_latency=args.llm_latency,
+        tokens_per_second=args.tokens_per_second
+    )
+    print(f"Fake Voyage at {server.url}/v1, fake Anthropic at {server.url}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# bench/load_test.py
+"""Concurrency load test for the API.
+
+Fires --requests requests at each target with --concurrency of them in flight, then reports
+throughput, latency percentiles and the concurrency the server actually sustained
+(sum of request latencies / wall time - Little's law). Compare the threaded dev server
+with the gevent server:
+
+    flask run --port 5000 &
+    python async_server.py &   # PORT=5001
+    python bench/load_test.py --token $JWT --concurrency 200 \\
+        --target sync=http://localhost:5000 --target gevent=http://localhost:5001
+
+Every request hits POST /api/insights/analyze by default (refresh=true so the answer cache
+doesn't short-circuit it); point ANTHROPIC_BASE_URL at a slow fake to measure the server
+rather than the provider.
+"""
+import argparse
+import json
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)] if ordered else 0.0
+
+
+def _request(url, token, body, timeout):
+    req = urllib.request.Request(
+        url,
+        data=json.dumps(body).encode('utf-8'),
+        headers={'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'},
+        method='POST'
+    )
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, TimeoutError, ConnectionError):
+        status = None
+    return status, time.perf_counter() - started
+
+
+def run(base_url, token, path, body, requests, concurrency, timeout):
+    url = base_url.rstrip('/') + path
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: _request(url, token, body, timeout), range(requests)))
+    wall = time.perf_counter() - started
+
+    latencies = [elapsed for status, elapsed in results if status == 200]
+    return {
+        'ok': len(latencies),
+        'errors': len(results) - len(latencies),
+        'wall_s': round(wall, 2),
+        'rps': round(len(latencies) / wall, 1) if wall else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'sustained_concurrency': round(sum(latencies) / wall, 1) if wall else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', action='append', required=True, help='label=base_url, repeatable')
+    parser.add_argument('--token', required=True, help='Bearer token for a test user')
+    parser.add_argument('--path', default='/api/insights/analyze')
+    parser.add_argument('--question', default='What patterns show up in my memories?')
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--json', action='store_true', help='Print raw JSON results')
+    args = parser.parse_args()
+
+    body = {'question': args.question, 'query': args.question, 'refresh': True}
+    report = {}
+    for target in args.target:
+        label, _, base_url = target.partition('=')
+        report[label] = run(base_url, args.token, args.path, body, args.requests, args.concurrency, args.timeout)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    columns = ['ok', 'errors', 'wall_s', 'rps', 'p50_ms', 'p95_ms', 'p99_ms', 'sustained_concurrency']
+    print(f"{'target':<12}" + ''.join(f'{column:>{len(column) + 2}}' for column in columns))
+    for label, row in report.items():
+        print(f"{label:<12}" + ''.join(f'{row[column]:>{len(column) + 2}}' for column in columns))
+
+
+if __name__ == '__main__':
+    main()
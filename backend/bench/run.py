@@ -0,0 +1,230 @@
+# bench/run.py
+"""Offline benchmark: the real app against local Postgres/pgvector and fake providers.
+
+Starts the fake Voyage/Anthropic server, serves create_app() on a local port, seeds synthetic
+journals if there are none, then measures list / create / search / analyze with concurrent
+clients. Results (p50/p95/p99, throughput, errors, settings, git commit) are written to
+bench/results/ as JSON; pass --baseline to print the change against an earlier run.
+
+    cd backend
+    DATABASE_URL=postgresql://localhost/remember_bench python -m bench.run --setup
+    python -m bench.run --baseline bench/results/<earlier>.json
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from bench.fake_providers import FakeProviderServer
+from bench.load_test import percentile
+from bench.synthetic import memory_text
+
+
+SCENARIOS = ('list', 'create', 'search', 'analyze')
+
+QUESTIONS = [
+    'What patterns show up in how I remember my family?',
+    'When did I feel most proud of myself?',
+    'How have my fears changed as I got older?',
+    'What do my travel memories have in common?',
+    'Which friendships shaped me the most?',
+]
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _request(base_url, token, method, path, body):
+    req = urllib.request.Request(
+        base_url + path,
+        data=json.dumps(body).encode('utf-8') if body is not None else None,
+        headers={'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'},
+        method=method
+    )
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=120) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, TimeoutError, ConnectionError):
+        status = None
+    return status, time.perf_counter() - started
+
+
+def _scenario_request(name, rng):
+    """(method, path, body) for one request of the scenario"""
+    if name == 'list':
+        return 'GET', f'/api/memories/?per_page=20&page={rng.randint(1, 3)}', None
+    if name == 'create':
+        return 'POST', '/api/memories/', {
+            'encrypted_content': memory_text(rng),
+            'encryption_key_id': 'bench',
+            'year': rng.randint(1970, 2024),
+            'age': rng.randint(3, 60),
+            'confidence_level': rng.randint(3, 10),
+            'emotional_valence': rng.randint(-5, 5)
+        }
+    if name == 'search':
+        return 'POST', '/api/insights/search', {'query': memory_text(rng)[:120], 'limit': 10}
+    return 'POST', '/api/insights/analyze', {'question': rng.choice(QUESTIONS), 'refresh': True}
+
+
+def run_scenario(name, base_url, tokens, requests, concurrency, seed_value):
+    rng = random.Random(f'{seed_value}-{name}')
+    plan = [(rng.choice(tokens), *_scenario_request(name, rng)) for _ in range(requests)]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda item: _request(base_url, *item), plan))
+    wall = time.perf_counter() - started
+
+    latencies = [elapsed for status, elapsed in results if status and 200 <= status < 300]
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'ok': len(latencies),
+        'errors': len(results) - len(latencies),
+        'throughput_rps': round(len(latencies) / wall, 2) if wall else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0
+    }
+
+
+def _compare(report, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    print(f"\nvs {os.path.basename(baseline_path)} ({baseline.get('git_commit')})")
+    print(f"{'scenario':<10}{'p50':>12}{'p95':>12}{'p99':>12}{'rps':>12}")
+    for name, row in report['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if not before:
+            continue
+
+        def delta(key):
+            return f"{(row[key] - before[key]) / before[key]:+.1%}" if before[key] else 'n/a'
+
+        print(f"{name:<10}{delta('p50_ms'):>12}{delta('p95_ms'):>12}{delta('p99_ms'):>12}{delta('throughput_rps'):>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=200, help='per scenario')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--users', type=int, default=20, help='bench users to seed if none exist')
+    parser.add_argument('--median-memories', type=int, default=120)
+    parser.add_argument('--reseed', action='store_true', help='delete and recreate the bench users')
+    parser.add_argument('--setup', action='store_true', help='CREATE EXTENSION vector and create tables first')
+    parser.add_argument('--embed-latency', type=float, default=0.05)
+    parser.add_argument('--llm-latency', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', default=os.path.join(os.path.dirname(__file__), 'results'))
+    parser.add_argument('--baseline', help='earlier results JSON to compare against')
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    providers = FakeProviderServer(('127.0.0.1', 0), embed_latency=args.embed_latency, llm_latency=args.llm_latency).start()
+
+    # The provider clients and the auth check read these at import / request time
+    os.environ['VOYAGE_BASE_URL'] = providers.url + '/v1'
+    os.environ['ANTHROPIC_BASE_URL'] = providers.url
+    os.environ.setdefault('VOYAGE_API_KEY', 'bench')
+    os.environ.setdefault('ANTHROPIC_API_KEY', 'bench')
+    os.environ.setdefault('SUPABASE_JWT_SECRET', 'bench-secret')
+
+    import jwt
+    from sqlalchemy import text
+    from werkzeug.serving import make_server
+
+    from app import create_app
+    from bench import synthetic
+    from models import db
+
+    app = create_app()
+    with app.app_context():
+        if args.setup:
+            db.session.execute(text('CREATE EXTENSION IF NOT EXISTS vector'))
+            db.session.commit()
+            db.create_all()
+
+        if args.reseed:
+            print(f"Removed {synthetic.clear()} bench users")
+        users = synthetic.bench_users()
+        if not users:
+            print(f"Seeding {args.users} bench users...")
+            synthetic.seed(args.users, args.median_memories, args.seed)
+            users = synthetic.bench_users()
+        memories = sum(count for _, count in users)
+        print(f"{len(users)} bench users, {memories} memories")
+
+    secret = os.environ['SUPABASE_JWT_SECRET']
+    tokens = [
+        jwt.encode({'sub': str(user_id), 'aud': 'authenticated', 'exp': int(time.time()) + 24 * 3600}, secret, algorithm='HS256')
+        for user_id, _ in users
+    ]
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-app', daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    report = {
+        'timestamp': datetime.utcnow().isoformat(),
+        'git_commit': _git_commit(),
+        'dataset': {'users': len(users), 'memories': memories},
+        'settings': {
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'embed_latency_s': args.embed_latency,
+            'llm_latency_s': args.llm_latency,
+            **{key: app.config.get(key) for key in (
+                'SEARCH_BACKEND', 'VECTOR_INDEX_METHOD', 'VECTOR_STORAGE', 'HNSW_EF_SEARCH',
+                'EMBEDDING_ASYNC', 'SEARCH_PREPARED_STATEMENTS', 'CONTEXT_TOKEN_BUDGET'
+            )}
+        },
+        'scenarios': {}
+    }
+
+    print(f"{'scenario':<10}{'ok':>7}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name in scenarios:
+        # A few untimed requests first so connection pools and caches are warm
+        run_scenario(name, base_url, tokens, min(args.concurrency, 10), args.concurrency, args.seed + 1)
+        row = run_scenario(name, base_url, tokens, args.requests, args.concurrency, args.seed)
+        report['scenarios'][name] = row
+        print(f"{name:<10}{row['ok']:>7}{row['errors']:>6}{row['throughput_rps']:>9}"
+              f"{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}")
+
+    server.shutdown()
+    providers.shutdown()
+
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"{datetime.utcnow():%Y%m%dT%H%M%S}_{report['git_commit'] or 'nogit'}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved {path}")
+
+    if args.baseline:
+        _compare(report, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# bench/synthetic.py
+"""Synthetic journals for benchmarks: bench users with realistic memory counts.
+
+Memory counts per user follow a log-normal distribution (most people write a few dozen to a
+few hundred memories, a handful write thousands). Text is templated from a set of life themes
+so searches have real near/far structure, and embeddings come from the same deterministic
+function the fake Voyage server uses, so seeding never calls a provider.
+"""
+import random
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import insert
+
+from bench.fake_providers import fake_embedding
+from models import db, Memory, UserProfile
+from services.embedding_service import EMBEDDING_MODEL
+
+
+ACCOUNT_TYPE = 'bench'
+
+THEMES = {
+    'family': ['mom', 'dad', 'sister', 'brother', 'grandma', 'kitchen', 'dinner', 'holiday', 'argument', 'hug'],
+    'school': ['teacher', 'classroom', 'exam', 'recess', 'homework', 'principal', 'friend', 'bus', 'grade', 'locker'],
+    'travel': ['airport', 'beach', 'mountains', 'train', 'hotel', 'map', 'ocean', 'road', 'camping', 'passport'],
+    'work': ['boss', 'interview', 'office', 'deadline', 'promotion', 'meeting', 'colleague', 'project', 'shift', 'paycheck'],
+    'loss': ['funeral', 'hospital', 'goodbye', 'grief', 'empty', 'letter', 'rain', 'silence', 'photo', 'memory'],
+    'friendship': ['party', 'secret', 'laughing', 'sleepover', 'phone', 'music', 'bike', 'park', 'game', 'promise'],
+    'achievement': ['trophy', 'stage', 'applause', 'finish', 'diploma', 'race', 'recital', 'award', 'proud', 'medal'],
+    'fear': ['dark', 'storm', 'lost', 'dog', 'nightmare', 'shaking', 'alone', 'noise', 'basement', 'crying'],
+}
+
+TEMPLATES = [
+    "I remember the {a} and the {b}. It felt {feeling} because of the {c}.",
+    "There was a day with the {a} when everything changed. The {b} was {feeling}, and I kept thinking about the {c}.",
+    "My earliest memory of the {a} is the {b}. I was {feeling}. Later the {c} made it clearer.",
+    "We went to the {a} after the {b}. I still feel {feeling} when I think of the {c}.",
+]
+
+FEELINGS = ['happy', 'scared', 'calm', 'confused', 'angry', 'relieved', 'ashamed', 'excited', 'lonely', 'grateful']
+
+
+def memory_count(rng, median=120, sigma=1.0, low=5, high=3000):
+    return int(min(max(rng.lognormvariate(np.log(median), sigma), low), high))
+
+
+def memory_text(rng):
+    theme = rng.choice(list(THEMES))
+    words = rng.sample(THEMES[theme], 3)
+    sentences = [
+        rng.choice(TEMPLATES).format(a=words[0], b=words[1], c=words[2], feeling=rng.choice(FEELINGS))
+        for _ in range(rng.randint(1, 6))
+    ]
+    return ' '.join(sentences)
+
+
+def seed(users=20, median_memories=120, seed_value=42, echo=print):
+    """Create bench users and their memories. Returns (user ids, total memories)."""
+    rng = random.Random(seed_value)
+    user_ids, total = [], 0
+
+    for i in range(users):
+        profile = UserProfile(display_name=f'bench-user-{i}', account_type=ACCOUNT_TYPE)
+        db.session.add(profile)
+        db.session.flush()
+
+        birth_year = rng.randint(1960, 2005)
+        count = memory_count(rng, median_memories)
+        rows = []
+        for number in range(count):
+            age = rng.randint(3, min(datetime.utcnow().year - birth_year, 60))
+            content = memory_text(rng)
+            rows.append({
+                'user_id': profile.id,
+                'memory_number': number + 1,
+                'year': birth_year + age,
+                'age': age,
+                'grade': age - 5 if 6 <= age <= 17 else None,
+                'encrypted_content': content,
+                'encryption_key_id': 'bench',
+                'confidence_level': rng.randint(3, 10),
+                'emotional_valence': rng.randint(-5, 5),
+                'embedding': fake_embedding(content),
+                'embedding_status': 'ready',
+                'embedding_model': EMBEDDING_MODEL
+            })
+
+        for start in range(0, len(rows), 1000):
+            db.session.execute(insert(Memory), rows[start:start + 1000])
+        db.session.commit()
+
+        user_ids.append(profile.id)
+        total += count
+        echo(f"  user {i + 1}/{users}: {count} memories")
+
+    return user_ids, total
+
+
+def bench_users():
+    """(id, memory count) of existing bench users"""
+    return db.session.query(UserProfile.id, db.func.count(Memory.id)).outerjoin(
+        Memory, Memory.user_id == UserProfile.id
+    ).filter(UserProfile.account_type == ACCOUNT_TYPE).group_by(UserProfile.id).all()
+
+
+def clear():
+    """Delete every bench user (memories cascade)"""
+    deleted = UserProfile.query.filter_by(account_type=ACCOUNT_TYPE).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
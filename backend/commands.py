@@ -0,0 +1,155 @@
+# commands.py
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from services.embedding_service import EMBEDDING_MODEL, invalidate_embedding_cache
+from services.embedding_jobs import run_worker
+from services.embedding_backfill import MODES, run_backfill
+from services import ann_index, clustering, related_memories
+
+
+embeddings_cli = AppGroup('embeddings', help='Embedding maintenance commands.')
+vectors_cli = AppGroup('vectors', help='Vector index management and search diagnostics.')
+insights_cli = AppGroup('insights', help='Offline insight jobs.')
+
+
+@embeddings_cli.command('invalidate-cache')
+@click.option('--model', default=None, help='Drop entries for this model only (default: every model except the configured one).')
+def invalidate_cache_command(model):
+    """Remove cached embeddings left over from a previous model"""
+    removed = invalidate_embedding_cache(model)
+    click.echo(f"Removed {removed} cached embeddings (current model: {EMBEDDING_MODEL})")
+
+
+@embeddings_cli.command('worker')
+def worker_command():
+    """Run the embedding job worker in the foreground (use with EMBEDDING_WORKER_ENABLED=false on web workers)"""
+    click.echo("Embedding worker started, waiting for jobs...")
+    run_worker(current_app._get_current_object())
+
+
+@embeddings_cli.command('backfill')
+@click.option('--mode', type=click.Choice(MODES), default='missing', show_default=True,
+              help='missing: rows without a vector; stale: also rows embedded by another model; all: re-embed everything.')
+@click.option('--batch-size', default=64, show_default=True, help='Rows per embedding request.')
+@click.option('--concurrency', default=4, show_default=True, help='Embedding requests in flight at once.')
+@click.option('--limit', type=int, default=None, help='Stop after this many rows.')
+@click.option('--restart', is_flag=True, help='Ignore the saved checkpoint and start from the beginning.')
+def backfill_command(mode, batch_size, concurrency, limit, restart):
+    """Embed memories that are missing a vector, or re-embed after changing EMBEDDING_MODEL.
+
+    Safe to interrupt - rerunning the same mode resumes from the last checkpoint.
+    """
+    click.echo(f"Backfilling embeddings (mode={mode}, model={EMBEDDING_MODEL})")
+    run_backfill(
+        current_app._get_current_object(),
+        mode=mode,
+        batch_size=batch_size,
+        concurrency=concurrency,
+        restart=restart,
+        limit=limit,
+        echo=click.echo
+    )
+    click.echo("Run `flask vectors rebuild-neighbors` to recompute related memories from the new vectors.")
+
+
+@vectors_cli.command('build-index')
+@click.option('--method', type=click.Choice(ann_index.METHODS), default=None, help='Defaults to VECTOR_INDEX_METHOD.')
+@click.option('--m', type=int, default=None, help='HNSW: max connections per node (default HNSW_M).')
+@click.option('--ef-construction', type=int, default=None, help='HNSW: build-time candidate list size (default HNSW_EF_CONSTRUCTION).')
+@click.option('--lists', type=int, default=None, help='IVFFlat: number of lists (default IVFFLAT_LISTS).')
+@click.option('--maintenance-work-mem', default=None, help="e.g. '1GB' - more memory makes HNSW builds much faster.")
+def build_index_command(method, m, ef_construction, lists, maintenance_work_mem):
+    """Rebuild the ANN index on memories.embedding with new build parameters (CONCURRENTLY)"""
+    ann_index.build_index(
+        method or current_app.config['VECTOR_INDEX_METHOD'],
+        m=m,
+        ef_construction=ef_construction,
+        lists=lists,
+        maintenance_work_mem=maintenance_work_mem,
+        echo=click.echo
+    )
+
+
+@vectors_cli.command('recall-report')
+@click.option('--k', default=10, show_default=True, help='Results per query.')
+@click.option('--queries', default=50, show_default=True, help='Memories to sample as queries.')
+@click.option('--ef-search', default='10,20,40,80,160', show_default=True, help='HNSW ef_search values to try.')
+@click.option('--probes', default='1,5,10,20,50', show_default=True, help='IVFFlat probes values to try.')
+def recall_report_command(k, queries, ef_search, probes):
+    """Recall@k and latency of ANN search versus exact search on the live data"""
+    report = ann_index.recall_report(
+        k=k,
+        queries=queries,
+        ef_search_values=[int(v) for v in ef_search.split(',')],
+        probes_values=[int(v) for v in probes.split(',')]
+    )
+    if not report:
+        click.echo("No embedded memories to sample.")
+        return
+
+    click.echo(f"{'setting':<16}{'recall@' + str(k):>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for row in report:
+        click.echo(f"{row['setting']:<16}{row['recall']:>10.3f}{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}")
+
+
+@vectors_cli.command('check-index')
+@click.option('--k', default=10, show_default=True, help='Results per query.')
+@click.option('--queries', default=50, show_default=True, help='Memories to sample as queries.')
+def check_index_command(k, queries):
+    """Compare the in-process vector index (SEARCH_BACKEND=memory) with exact pgvector search"""
+    report = ann_index.memory_backend_report(k=k, queries=queries)
+    if not report:
+        click.echo("No embedded memories to sample.")
+        return
+
+    for key, value in report.items():
+        click.echo(f"{key:<22}{value}")
+
+
+@vectors_cli.command('quantization-report')
+@click.option('--k', default=10, show_default=True, help='Results per query.')
+@click.option('--queries', default=50, show_default=True, help='Memories to sample as queries.')
+@click.option('--rerank-factor', type=int, default=None, help='Candidates reranked per result (default VECTOR_RERANK_FACTOR).')
+def quantization_report_command(k, queries, rerank_factor):
+    """Memory savings and recall@k of halfvec / binary storage versus full float32 vectors"""
+    report = ann_index.quantization_report(k=k, queries=queries, rerank_factor=rerank_factor)
+
+    click.echo(f"{report['rows']} embedded memories, {report['queries']} queries, rerank {report['rerank_factor']}x")
+    click.echo(f"{'storage':<10}{'bytes/vec':>11}{'total MB':>10}{'saved':>8}{'recall@' + str(k):>11}{'reranked':>10}")
+    for row in report['modes']:
+        recall = f"{row['recall']:.3f}" if row['recall'] is not None else '-'
+        reranked = f"{row['recall_reranked']:.3f}" if row['recall_reranked'] is not None else '-'
+        click.echo(f"{row['storage']:<10}{row['bytes_per_vector']:>11.1f}{row['total_mb']:>10.2f}"
+                   f"{row['savings']:>8.0%}{recall:>11}{reranked:>10}")
+
+    for index in report['indexes']:
+        click.echo(f"index {index['name']}: {index['mb']:.2f} MB")
+
+
+@vectors_cli.command('rebuild-neighbors')
+@click.option('--user-id', default=None, help='Only this user\'s memories.')
+@click.option('--batch-size', default=200, show_default=True, help='Memories per transaction.')
+def rebuild_neighbors_command(user_id, batch_size):
+    """Recompute the related-memories graph (RELATED_MEMORIES_K nearest neighbours per memory) exactly"""
+    related_memories.rebuild(user_id=user_id, batch_size=batch_size, echo=click.echo)
+
+
+@insights_cli.command('cluster')
+@click.option('--user-id', type=click.UUID, default=None, help='Only this user (default: every user with enough embedded memories).')
+@click.option('--method', type=click.Choice(clustering.METHODS), default=None, help='Defaults to CLUSTER_METHOD.')
+@click.option('--clusters', type=int, default=None, help='k-means: exact number of clusters instead of CLUSTER_GRANULARITY.')
+@click.option('--granularity', type=float, default=None, help='k-means: scales the default cluster count (default CLUSTER_GRANULARITY).')
+@click.option('--force', is_flag=True, help='Recluster even if the memories are unchanged since the last run.')
+def cluster_command(user_id, method, clusters, granularity, force):
+    """Group memories into themes and save them as AIInsight rows (one Claude call per new theme)"""
+    options = {'method': method, 'clusters': clusters, 'granularity': granularity, 'force': force}
+    if not user_id:
+        users = clustering.cluster_all(echo=click.echo, **options)
+        click.echo(f"Clustered {users} users")
+        return
+
+    result = clustering.cluster_user(user_id, **options)
+    for key, value in result.items():
+        click.echo(f"{key:<14}{value}")
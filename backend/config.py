@@ -1,5 +1,6 @@
 # config.py
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -12,11 +13,140 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_ECHO = False  # Log SQL queries in development
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', 30)),  # seconds to wait for a free connection
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),  # replace connections older than this
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    }
+    # Server-side PREPARE/EXECUTE for the search queries - turn off behind a transaction-mode pooler
+    SEARCH_PREPARED_STATEMENTS = os.getenv('SEARCH_PREPARED_STATEMENTS', 'true').lower() == 'true'
     
     # Supabase - for auth verification
     SUPABASE_URL = os.getenv('SUPABASE_URL')
     SUPABASE_JWT_SECRET = os.getenv('SUPABASE_JWT_SECRET')  # Found in Supabase dashboard
     
+    # Auth cache - verified tokens and profile snapshots, never kept past the token's exp
+    AUTH_CACHE_TTL = int(os.getenv('AUTH_CACHE_TTL', 300))  # seconds
+    AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', 10000))
+    
+    # Embeddings
+    EMBEDDING_PROVIDER = os.getenv('EMBEDDING_PROVIDER', 'voyage')  # voyage, local (CPU model) or hashing (tests)
+    EMBEDDING_DIMENSION = int(os.getenv('EMBEDDING_DIMENSION', 1024))  # size of the Vector columns; the provider must match
+    EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'voyage-large-2-instruct')
+    EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', 2048))  # in-process LRU entries
+    EMBEDDING_CACHE_MAX_ROWS = int(os.getenv('EMBEDDING_CACHE_MAX_ROWS', 200000))  # persistent table cap
+    
+    EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', 128))  # provider limit on inputs per request
+    EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv('EMBEDDING_BATCH_MAX_TOKENS', 120000))  # provider limit on tokens per request
+    
+    # Local embedding provider - an ONNX export (model.onnx + tokenizer.json) or a sentence-transformers directory
+    EMBEDDING_LOCAL_MODEL_PATH = os.getenv('EMBEDDING_LOCAL_MODEL_PATH')
+    EMBEDDING_LOCAL_THREADS = int(os.getenv('EMBEDDING_LOCAL_THREADS', os.cpu_count() or 1))
+    EMBEDDING_LOCAL_BATCH_SIZE = int(os.getenv('EMBEDDING_LOCAL_BATCH_SIZE', 32))  # texts per inference call
+    EMBEDDING_LOCAL_QUERY_PREFIX = os.getenv('EMBEDDING_LOCAL_QUERY_PREFIX', '')  # e.g. 'query: ' for e5 models
+    EMBEDDING_LOCAL_DOCUMENT_PREFIX = os.getenv('EMBEDDING_LOCAL_DOCUMENT_PREFIX', '')  # e.g. 'passage: '
+
+    # Embedding dispatcher - concurrent callers share batched provider requests, paced to the account's rate limits
+    EMBEDDING_DISPATCH_ENABLED = os.getenv('EMBEDDING_DISPATCH_ENABLED', 'true').lower() == 'true'
+    EMBEDDING_DISPATCH_WINDOW_MS = float(os.getenv('EMBEDDING_DISPATCH_WINDOW_MS', 5))  # how long a batch waits for company
+    EMBEDDING_DISPATCH_CONCURRENCY = int(os.getenv('EMBEDDING_DISPATCH_CONCURRENCY', 4))  # provider requests in flight
+    EMBEDDING_DISPATCH_TIMEOUT = float(os.getenv('EMBEDDING_DISPATCH_TIMEOUT', 120))  # seconds a caller waits for its vectors
+    EMBEDDING_REQUESTS_PER_MINUTE = int(os.getenv('EMBEDDING_REQUESTS_PER_MINUTE', 2000))  # 0 = no pacing
+    EMBEDDING_TOKENS_PER_MINUTE = int(os.getenv('EMBEDDING_TOKENS_PER_MINUTE', 3000000))  # 0 = no pacing
+    EMBEDDING_MAX_RETRIES = int(os.getenv('EMBEDDING_MAX_RETRIES', 5))  # on rate limits / overload
+    EMBEDDING_BACKOFF_BASE = float(os.getenv('EMBEDDING_BACKOFF_BASE', 0.5))  # seconds, doubled per retry
+    
+    # Embedding pipeline - writes commit with a NULL embedding and a background worker fills it in
+    EMBEDDING_ASYNC = os.getenv('EMBEDDING_ASYNC', 'true').lower() == 'true'
+    EMBEDDING_WORKER_ENABLED = os.getenv('EMBEDDING_WORKER_ENABLED', 'true').lower() == 'true'  # in-process worker thread
+    EMBEDDING_JOB_BATCH_SIZE = int(os.getenv('EMBEDDING_JOB_BATCH_SIZE', 64))
+    EMBEDDING_JOB_MAX_ATTEMPTS = int(os.getenv('EMBEDDING_JOB_MAX_ATTEMPTS', 5))
+    EMBEDDING_JOB_POLL_INTERVAL = float(os.getenv('EMBEDDING_JOB_POLL_INTERVAL', 5.0))  # seconds
+    EMBEDDING_JOB_LOCK_TIMEOUT = int(os.getenv('EMBEDDING_JOB_LOCK_TIMEOUT', 300))  # reclaim stuck jobs after N seconds
+    
+    # Vector search - ANN index build parameters (picked up by `flask db migrate` / `flask vectors build-index`)
+    VECTOR_INDEX_METHOD = os.getenv('VECTOR_INDEX_METHOD', 'hnsw')  # hnsw or ivfflat
+    HNSW_M = int(os.getenv('HNSW_M', 16))
+    HNSW_EF_CONSTRUCTION = int(os.getenv('HNSW_EF_CONSTRUCTION', 64))
+    IVFFLAT_LISTS = int(os.getenv('IVFFLAT_LISTS', 100))
+    
+    # Vector storage - 'full' indexes the float32 column; 'half' / 'binary' add a generated halfvec / bit
+    # column, build the ANN index on that instead and rerank VECTOR_RERANK_FACTOR x limit candidates at full precision
+    VECTOR_STORAGE = os.getenv('VECTOR_STORAGE', 'full')
+    VECTOR_RERANK_FACTOR = int(os.getenv('VECTOR_RERANK_FACTOR', 4))
+    
+    # Vector search - query-time recall/latency knobs (overridable per search request)
+    HNSW_EF_SEARCH = int(os.getenv('HNSW_EF_SEARCH', 40))
+    IVFFLAT_PROBES = int(os.getenv('IVFFLAT_PROBES', 10))
+    VECTOR_ITERATIVE_SCAN = os.getenv('VECTOR_ITERATIVE_SCAN', 'relaxed_order')  # relaxed_order / strict_order / off, pgvector >= 0.8 (empty to skip on older versions)
+    
+    # Vector search backend - 'pgvector' queries the database, 'memory' keeps each active user's
+    # embeddings in a NumPy matrix (memory-mapped from VECTOR_INDEX_CACHE_DIR, LRU-evicted)
+    SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'pgvector')
+    VECTOR_INDEX_CACHE_DIR = os.getenv('VECTOR_INDEX_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'remember-vector-index'))
+    VECTOR_INDEX_MAX_USERS = int(os.getenv('VECTOR_INDEX_MAX_USERS', 64))
+    
+    # Related memories - nearest neighbours stored per memory, maintained as embeddings change
+    RELATED_MEMORIES_K = int(os.getenv('RELATED_MEMORIES_K', 10))
+    
+    # Hybrid search - reciprocal rank fusion of the vector and full-text rankings
+    SEARCH_RRF_K = int(os.getenv('SEARCH_RRF_K', 60))
+    SEARCH_CANDIDATES = int(os.getenv('SEARCH_CANDIDATES', 50))  # per ranking, before fusion
+    
+    # Semantic answer cache for /insights/analyze
+    ANALYSIS_CACHE_ENABLED = os.getenv('ANALYSIS_CACHE_ENABLED', 'true').lower() == 'true'
+    ANALYSIS_CACHE_THRESHOLD = float(os.getenv('ANALYSIS_CACHE_THRESHOLD', 0.97))  # min cosine similarity between questions
+    ANALYSIS_CACHE_TTL = int(os.getenv('ANALYSIS_CACHE_TTL', 7 * 24 * 3600))  # seconds
+    ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv('ANALYSIS_CACHE_MAX_ENTRIES', 50))  # per user
+    
+    # Analysis context - memories packed into the Claude prompt for /insights/analyze
+    CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 6000))  # tokens for the memory block
+    CONTEXT_CANDIDATES = int(os.getenv('CONTEXT_CANDIDATES', 40))  # nearest memories fetched before selection
+    CONTEXT_MAX_MEMORIES = int(os.getenv('CONTEXT_MAX_MEMORIES', 15))
+    CONTEXT_MIN_SIMILARITY = float(os.getenv('CONTEXT_MIN_SIMILARITY', 0.25))  # drop the tail below this
+    CONTEXT_MMR_LAMBDA = float(os.getenv('CONTEXT_MMR_LAMBDA', 0.7))  # 1 = pure relevance, 0 = pure diversity
+    CONTEXT_MAX_MEMORY_TOKENS = int(os.getenv('CONTEXT_MAX_MEMORY_TOKENS', 600))  # longer memories are truncated
+    
+    # Analysis sessions - multi-turn /insights/sessions conversations over a pinned memory context
+    ANALYSIS_SESSION_TTL = int(os.getenv('ANALYSIS_SESSION_TTL', 3600))  # seconds since the last turn
+    ANALYSIS_SESSION_MAX_TURNS = int(os.getenv('ANALYSIS_SESSION_MAX_TURNS', 20))
+    
+    # Theme clustering - `flask insights cluster` groups each user's memories into themes (AIInsight rows)
+    CLUSTER_METHOD = os.getenv('CLUSTER_METHOD', 'kmeans')  # kmeans or agglomerative
+    CLUSTER_GRANULARITY = float(os.getenv('CLUSTER_GRANULARITY', 1.0))  # k-means: scales k = sqrt(memories / 2)
+    CLUSTER_MAX_CLUSTERS = int(os.getenv('CLUSTER_MAX_CLUSTERS', 12))
+    CLUSTER_MERGE_THRESHOLD = float(os.getenv('CLUSTER_MERGE_THRESHOLD', 0.6))  # agglomerative: stop below this similarity
+    CLUSTER_AGGLOMERATIVE_MAX = int(os.getenv('CLUSTER_AGGLOMERATIVE_MAX', 3000))  # larger journals fall back to k-means
+    CLUSTER_MIN_MEMORIES = int(os.getenv('CLUSTER_MIN_MEMORIES', 10))  # users with fewer embedded memories are skipped
+    CLUSTER_MIN_SIZE = int(os.getenv('CLUSTER_MIN_SIZE', 3))  # smaller clusters aren't saved as themes
+    CLUSTER_SAMPLE_MEMORIES = int(os.getenv('CLUSTER_SAMPLE_MEMORIES', 5))  # most central memories shown to Claude for the title
+    CLUSTER_TITLE_MODEL = os.getenv('CLUSTER_TITLE_MODEL', 'claude-haiku-4-5-20251001')
+    
+    # Memory version history - edits are stored as deltas against the previous version, with a
+    # full snapshot at least every N versions so reconstructing any version applies at most N - 1 deltas
+    MEMORY_VERSION_SNAPSHOT_EVERY = int(os.getenv('MEMORY_VERSION_SNAPSHOT_EVERY', 10))
+    
+    # Bulk import
+    BULK_IMPORT_MAX_ROWS = int(os.getenv('BULK_IMPORT_MAX_ROWS', 10000))
+    
+    # Metrics - Server-Timing headers and Prometheus /metrics
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_SAMPLE_RATE = float(os.getenv('METRICS_SAMPLE_RATE', 0.1))  # fraction of requests timed
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')  # if set, /metrics requires 'Authorization: Bearer <token>'
+    
+    # Anthropic client - one pooled httpx client per process, built on the first Claude call
+    ANTHROPIC_MAX_CONNECTIONS = int(os.getenv('ANTHROPIC_MAX_CONNECTIONS', 100))
+    ANTHROPIC_MAX_KEEPALIVE = int(os.getenv('ANTHROPIC_MAX_KEEPALIVE', 20))  # idle connections kept open
+    
+    # Gevent server (async_server.py) - concurrent requests per process
+    SERVER_CONCURRENCY = int(os.getenv('SERVER_CONCURRENCY', 1000))
+    
+    # Warm-up - when serving (not for CLI commands), pre-open DB and provider connections before accepting traffic
+    WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', 'false').lower() == 'true'
+    WARMUP_DB_CONNECTIONS = int(os.getenv('WARMUP_DB_CONNECTIONS', 5))
+    
     # App config
     ENV = os.getenv('FLASK_ENV', 'development')
     DEBUG = ENV == 'development'
\ No newline at end of file
@@ -1,39 +1,182 @@
 # middleware/auth_middleware.py
 from functools import wraps
 from flask import request, jsonify
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from sqlalchemy import event
+import hashlib
+import threading
+import time
+import uuid
 import jwt
 import os
 
+from config import Config
+from models import UserProfile
+from services import metrics
+
+
+@dataclass(frozen=True)
+class ProfileSnapshot:
+    """Detached, read-only copy of a UserProfile that can be shared across requests"""
+    id: uuid.UUID
+    display_name: str
+    account_type: str
+    timezone: str
+    encryption_public_key: str
+    created_at: datetime
+    updated_at: datetime
+
+    @classmethod
+    def from_profile(cls, profile):
+        return cls(
+            id=profile.id,
+            display_name=profile.display_name,
+            account_type=profile.account_type,
+            timezone=profile.timezone,
+            encryption_public_key=profile.encryption_public_key,
+            created_at=profile.created_at,
+            updated_at=profile.updated_at
+        )
+
+    def to_dict(self):
+        return {
+            'id': str(self.id),
+            'display_name': self.display_name,
+            'account_type': self.account_type,
+            'created_at': self.created_at.isoformat()
+        }
+
+
+class AuthCache:
+    """Bounded TTL cache of verified tokens -> (claims, profile snapshot).
+
+    Entries expire after AUTH_CACHE_TTL or at the token's own `exp`, whichever is sooner,
+    and are dropped when the user's profile is updated or deleted in this process.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()   # token hash -> (expires_at, claims, snapshot)
+        self._by_user = {}              # user id -> {token hashes}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    @staticmethod
+    def key_for(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry[1], entry[2]
+            if entry:
+                self._drop(key)
+            self.stats['misses'] += 1
+            return None
+
+    def put(self, key, claims, snapshot):
+        expires_at = time.time() + self.ttl
+        if claims.get('exp'):
+            expires_at = min(expires_at, claims['exp'])
+
+        with self._lock:
+            self._entries[key] = (expires_at, claims, snapshot)
+            self._entries.move_to_end(key)
+            self._by_user.setdefault(snapshot.id, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._drop(next(iter(self._entries)))
+                self.stats['evictions'] += 1
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in self._by_user.pop(user_id, set()):
+                self._entries.pop(key, None)
+                self.stats['invalidations'] += 1
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats, size=len(self._entries), max_size=self.max_size)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        return stats
+
+    def _drop(self, key):
+        _, _, snapshot = self._entries.pop(key)
+        keys = self._by_user.get(snapshot.id)
+        if keys:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[snapshot.id]
+
+
+auth_cache = AuthCache(Config.AUTH_CACHE_SIZE, Config.AUTH_CACHE_TTL)
+
+
+@event.listens_for(UserProfile, 'after_update')
+@event.listens_for(UserProfile, 'after_delete')
+def _invalidate_profile(mapper, connection, target):
+    auth_cache.invalidate_user(target.id)
+
+
+def get_auth_cache_stats():
+    """Hit/miss counters for the auth cache (this process only)"""
+    return auth_cache.get_stats()
+
+
+def _authenticate(token):
+    """(current_user, None) for a valid token, else (None, error response)"""
+    # Already verified this token recently - skip jwt.decode and the profile query
+    key = AuthCache.key_for(token)
+    cached = auth_cache.get(key)
+    if cached:
+        return cached[1], None
+
+    try:
+        payload = jwt.decode(
+            token,
+            os.getenv('SUPABASE_JWT_SECRET'),
+            algorithms=['HS256'],
+            audience='authenticated'
+        )
+
+        user_id = payload.get('sub')
+
+        profile = UserProfile.query.get(user_id)
+
+        if not profile:
+            return None, (jsonify({'error': 'User not found'}), 404)
+
+        current_user = ProfileSnapshot.from_profile(profile)
+        auth_cache.put(key, payload, current_user)
+
+        return current_user, None
+
+    except jwt.ExpiredSignatureError:
+        return None, (jsonify({'error': 'Token expired'}), 401)
+    except jwt.InvalidTokenError:
+        return None, (jsonify({'error': 'Invalid token'}), 401)
+
+
 def require_auth(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         auth_header = request.headers.get('Authorization')
         if not auth_header or not auth_header.startswith('Bearer '):
             return jsonify({'error': 'Missing or invalid authorization'}), 401
-        
+
         token = auth_header.split(' ')[1]
-        
-        try:
-            payload = jwt.decode(
-                token,
-                os.getenv('SUPABASE_JWT_SECRET'),
-                algorithms=['HS256'],
-                audience='authenticated'
-            )
-            
-            user_id = payload.get('sub')
-            
-            from models import UserProfile
-            current_user = UserProfile.query.get(user_id)
-            
-            if not current_user:
-                return jsonify({'error': 'User not found'}), 404
-            
-            return f(current_user, *args, **kwargs)
-            
-        except jwt.ExpiredSignatureError:
-            return jsonify({'error': 'Token expired'}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({'error': 'Invalid token'}), 401
-    
-    return decorated_function
\ No newline at end of file
+
+        with metrics.span('auth'):
+            current_user, error = _authenticate(token)
+        if error:
+            return error
+
+        return f(current_user, *args, **kwargs)
+
+    return decorated_function
@@ -1,15 +1,42 @@
 # models/__init__.py
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
-from sqlalchemy.dialects.postgresql import UUID, JSONB, ARRAY
+from sqlalchemy.dialects.postgresql import UUID, JSONB, ARRAY, TSVECTOR
 import uuid
 from flask_sqlalchemy import SQLAlchemy
-from pgvector.sqlalchemy import Vector
+from pgvector.sqlalchemy import Vector, HALFVEC, BIT
+
+from config import Config
 
 
 db = SQLAlchemy()
 
 
+# Column (and operator class) the memories ANN index is built on, per VECTOR_STORAGE mode
+VECTOR_STORAGE_COLUMNS = {
+    'full': ('embedding', 'vector_cosine_ops'),
+    'half': ('embedding_half', 'halfvec_cosine_ops'),
+    'binary': ('embedding_bits', 'bit_hamming_ops'),
+}
+
+
+def vector_index(table, column, opclass='vector_cosine_ops'):
+    """ANN index on a vector column, built with the method and parameters from Config"""
+    method = Config.VECTOR_INDEX_METHOD
+    if method == 'ivfflat':
+        params = {'lists': Config.IVFFLAT_LISTS}
+    else:
+        params = {'m': Config.HNSW_M, 'ef_construction': Config.HNSW_EF_CONSTRUCTION}
+    
+    return db.Index(
+        f'ix_{table}_{column}_{method}',
+        column,
+        postgresql_using=method,
+        postgresql_with=params,
+        postgresql_ops={column: opclass}
+    )
+
+
 class UserProfile(db.Model):
     __tablename__ = 'user_profiles'
     
@@ -18,6 +45,8 @@ class UserProfile(db.Model):
     account_type = db.Column(db.String(50), default='client')
     timezone = db.Column(db.String(50), default='UTC')
     encryption_public_key = db.Column(db.Text)
+    # Bumped on any memory create/update/delete/embedding (see services/memory_set.py)
+    memory_set_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -61,8 +90,19 @@ class Memory(db.Model):
     body_sensations = db.Column(JSONB)
 
     # vector embedding for RAG
-    embedding = db.Column(Vector(1024), nullable=True)  # voyage-large-2-instruct is 1024 dimensions
-
+    embedding = db.Column(Vector(Config.EMBEDDING_DIMENSION), nullable=True)  # must match the embedding provider's output
+    embedding_status = db.Column(db.String(20), default='pending')  # pending, ready, failed, empty
+    embedding_model = db.Column(db.String(100))  # model that produced `embedding`, for re-embedding after a switch
+    
+    # Opt-in compact copies generated from `embedding` (VECTOR_STORAGE). The ANN index moves to the
+    # compact column and `embedding` is only read to rerank candidates at full precision.
+    if Config.VECTOR_STORAGE == 'half':
+        embedding_half = db.Column(HALFVEC(Config.EMBEDDING_DIMENSION), db.Computed(f'embedding::halfvec({Config.EMBEDDING_DIMENSION})', persisted=True))
+    elif Config.VECTOR_STORAGE == 'binary':
+        embedding_bits = db.Column(BIT(Config.EMBEDDING_DIMENSION), db.Computed(f'binary_quantize(embedding)::bit({Config.EMBEDDING_DIMENSION})', persisted=True))
+    
+    # full-text index for lexical/hybrid search (embeddings are computed from the same text)
+    content_tsv = db.Column(TSVECTOR, db.Computed("to_tsvector('english', encrypted_content)", persisted=True))
 
     # Status
     visibility = db.Column(db.String(20), default='private')
@@ -90,6 +130,8 @@ class Memory(db.Model):
             'emotional_valence BETWEEN -5 AND 5',
             name='valid_valence'
         ),
+        vector_index('memories', *VECTOR_STORAGE_COLUMNS[Config.VECTOR_STORAGE]),
+        db.Index('ix_memories_content_tsv', 'content_tsv', postgresql_using='gin'),
     )
     
     def __repr__(self):
@@ -112,6 +154,7 @@ class Memory(db.Model):
             'is_sealed': self.is_sealed,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat(),
+            'embedding_status': self.embedding_status,
             'tags': [tag.to_dict() for tag in self.tags]
         }
         
@@ -122,6 +165,46 @@ class Memory(db.Model):
         return data
 
 
+# Chronological listing order, NULL year/age last. Keyset pagination compares on these
+# expressions, so the index below serves both the ORDER BY and the cursor predicate.
+MEMORY_CHRONOLOGY = (
+    db.func.coalesce(Memory.year, -1),
+    db.func.coalesce(Memory.age, -1),
+    Memory.id,
+)
+
+db.Index(
+    'ix_memories_user_chronology',
+    Memory.user_id,
+    *[column.desc() for column in MEMORY_CHRONOLOGY]
+)
+
+
+class EmbeddingJob(db.Model):
+    __tablename__ = 'embedding_jobs'
+    
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    # One job per memory - re-enqueueing an edited memory resets the existing job
+    memory_id = db.Column(UUID(as_uuid=True), db.ForeignKey('memories.id', ondelete='CASCADE'), nullable=False, unique=True)
+    
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, processing, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    
+    available_at = db.Column(db.DateTime, default=datetime.utcnow)  # retry backoff
+    locked_at = db.Column(db.DateTime)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_embedding_jobs_claim', 'status', 'available_at'),
+    )
+    
+    def __repr__(self):
+        return f'<EmbeddingJob {self.memory_id} {self.status}>'
+
+
 class MemoryVersion(db.Model):
     __tablename__ = 'memory_versions'
     
@@ -129,7 +212,10 @@ class MemoryVersion(db.Model):
     memory_id = db.Column(UUID(as_uuid=True), db.ForeignKey('memories.id', ondelete='CASCADE'), nullable=False)
     
     version_number = db.Column(db.Integer, nullable=False)
-    encrypted_content = db.Column(db.Text, nullable=False)
+    # Either a full snapshot (encrypted_content) or an edit script against the previous
+    # version (content_delta) - see services/memory_versions.py
+    encrypted_content = db.Column(db.Text)
+    content_delta = db.Column(JSONB)
     encryption_key_id = db.Column(db.String(100), nullable=False)
     change_note = db.Column(db.Text)
     
@@ -140,8 +226,16 @@ class MemoryVersion(db.Model):
     
     __table_args__ = (
         db.UniqueConstraint('memory_id', 'version_number', name='unique_memory_version'),
+        db.CheckConstraint(
+            '(encrypted_content IS NULL) <> (content_delta IS NULL)',
+            name='version_snapshot_or_delta'
+        ),
     )
     
+    @property
+    def is_snapshot(self):
+        return self.encrypted_content is not None
+    
     def __repr__(self):
         return f'<MemoryVersion {self.memory_id} v{self.version_number}>'
 
@@ -206,6 +300,22 @@ class MemoryPerspective(db.Model):
     )
 
 
+class MemoryNeighbor(db.Model):
+    """One edge of the related-memories graph - see services/related_memories.py"""
+    __tablename__ = 'memory_neighbors'
+    
+    memory_id = db.Column(UUID(as_uuid=True), db.ForeignKey('memories.id', ondelete='CASCADE'), primary_key=True)
+    neighbor_id = db.Column(UUID(as_uuid=True), db.ForeignKey('memories.id', ondelete='CASCADE'), primary_key=True)
+    similarity = db.Column(db.Float, nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_memory_neighbors_neighbor', 'neighbor_id'),  # reverse lookups and the delete cascade
+    )
+    
+    def __repr__(self):
+        return f'<MemoryNeighbor {self.memory_id} -> {self.neighbor_id}>'
+
+
 class AIInsight(db.Model):
     __tablename__ = 'ai_insights'
     
@@ -218,6 +328,11 @@ class AIInsight(db.Model):
     
     related_memory_ids = db.Column(ARRAY(UUID(as_uuid=True)), default=[])
     
+    # Semantic answer cache entries (insight_type 'analysis_cache')
+    query_embedding = db.Column(Vector(Config.EMBEDDING_DIMENSION))
+    memory_set_version = db.Column(db.Integer)
+    details = db.Column(JSONB)
+    
     user_rating = db.Column(db.Integer)
     is_helpful = db.Column(db.Boolean)
     user_notes = db.Column(db.Text)
@@ -225,6 +340,10 @@ class AIInsight(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     dismissed_at = db.Column(db.DateTime)
     
+    __table_args__ = (
+        db.Index('ix_ai_insights_user_type', 'user_id', 'insight_type'),
+    )
+    
     def to_dict(self):
         return {
             'id': str(self.id),
@@ -236,6 +355,46 @@ class AIInsight(db.Model):
         }
 
 
+class AnalysisSession(db.Model):
+    __tablename__ = 'analysis_sessions'
+    
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('user_profiles.id', ondelete='CASCADE'), nullable=False, index=True)
+    
+    title = db.Column(db.String(255), nullable=False)
+    
+    # Memory block pinned on the first turn and sent byte-for-byte on every follow-up,
+    # so the prompt prefix stays identical and Claude can serve it from the prompt cache
+    context = db.Column(db.Text, nullable=False)
+    memory_ids = db.Column(ARRAY(UUID(as_uuid=True)), default=[])
+    memory_set_version = db.Column(db.Integer)
+    
+    messages = db.Column(JSONB, nullable=False, default=list)  # [{'role': ..., 'content': ...}, ...]
+    usage = db.Column(JSONB, nullable=False, default=dict)  # running token totals
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    def to_dict(self, include_messages=False):
+        data = {
+            'id': str(self.id),
+            'title': self.title,
+            'memories_analyzed': len(self.memory_ids or []),
+            'memory_set_version': self.memory_set_version,
+            'turns': sum(1 for message in self.messages or [] if message['role'] == 'user'),
+            'usage': self.usage or {},
+            'created_at': self.created_at.isoformat(),
+            'expires_at': self.expires_at.isoformat()
+        }
+        if include_messages:
+            data['messages'] = self.messages or []
+        return data
+    
+    def __repr__(self):
+        return f'<AnalysisSession {self.id}>'
+
+
 class AuditLog(db.Model):
     __tablename__ = 'audit_logs'
     
@@ -253,4 +412,34 @@ class AuditLog(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     def __repr__(self):
-        return f'<AuditLog {self.action} on {self.resource_type}>'
\ No newline at end of file
+        return f'<AuditLog {self.action} on {self.resource_type}>'
+
+
+class EmbeddingCache(db.Model):
+    __tablename__ = 'embedding_cache'
+    
+    # Keyed on (model, input_type, sha256 of the text) - the text itself is never stored
+    model = db.Column(db.String(100), primary_key=True)
+    input_type = db.Column(db.String(20), primary_key=True)
+    content_hash = db.Column(db.String(64), primary_key=True)
+    
+    embedding = db.Column(Vector(Config.EMBEDDING_DIMENSION), nullable=False)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f'<EmbeddingCache {self.model}/{self.input_type} {self.content_hash[:12]}>'
+
+
+class JobCheckpoint(db.Model):
+    __tablename__ = 'job_checkpoints'
+    
+    # Progress marker for resumable batch jobs (e.g. embedding backfills)
+    name = db.Column(db.String(200), primary_key=True)
+    position = db.Column(db.String(100))
+    details = db.Column(JSONB)
+    
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<JobCheckpoint {self.name} at {self.position}>'
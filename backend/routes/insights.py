@@ -1,20 +1,134 @@
-from flask import Blueprint, request, jsonify
-from anthropic import Anthropic
+from flask import Blueprint, request, jsonify, Response, stream_with_context, current_app
 from middleware.auth_middleware import require_auth
 from services.embedding_service import get_query_embedding
-from sqlalchemy import text
-from models import db
-import os
+from services.retrieval import search_similar, search_lexical, search_hybrid
+from services.memory_set import current_version
+from services.context_builder import build_context, MEMORY_SEPARATOR
+from services import answer_cache, llm, metrics
+from services.clustering import INSIGHT_TYPE as THEME_INSIGHT_TYPE
+from models import db, AnalysisSession, AIInsight
+from datetime import datetime, timedelta
+import json
 
 bp = Blueprint('insights', __name__)
-client = Anthropic(api_key=os.getenv('ANTHROPIC_API_KEY'))
 
+SEARCH_MODES = ('vector', 'lexical', 'hybrid')
+
+
+
+SYSTEM_PROMPT = """You are a compassionate, insightful therapist analyzing personal memories.
+                                Your role:
+                                - Identify patterns, themes, and connections across memories
+                                - Note emotional progressions and changes over time
+                                - Highlight potential areas for growth or healing
+                                - Be empathetic, constructive, and non-judgmental
+                                - Avoid clinical diagnoses or labels
+
+                                Provide thoughtful analysis that helps the person understand themselves better."""
+
+
+def _retrieve_memories(current_user, query_embedding):
+    """Return (rows, formatted memory texts, context stats) for the question, within the token budget"""
+    print("Searching for relevant memories...")
+    context = build_context(current_user.id, query_embedding)
+    print(f"Context: {context.stats['selected']}/{context.stats['candidates']} memories, ~{context.stats['estimated_tokens']} tokens")
+    return context.results, context.texts, context.stats
+
+
+def _memory_context(relevant_memories):
+    context = MEMORY_SEPARATOR.join(relevant_memories)
+    return f"""Relevant memories (retrieved via semantic search):
+
+{context}"""
+
+
+def _analysis_request(relevant_memories, user_question, context=None, history=()):
+    """Keyword arguments for client.messages.create / client.messages.stream.
+    
+    A session passes its pinned `context` and earlier `history`; the last user turn is marked
+    as a cache breakpoint too, so the next follow-up reads the whole conversation from cache.
+    """
+    return dict(
+        model="claude-sonnet-4-5-20250929",
+        max_tokens=2048,
+        system=[
+            {
+                "type": "text",
+                "text": SYSTEM_PROMPT
+            },
+            {
+                "type": "text",
+                "text": context if context is not None else _memory_context(relevant_memories),
+                "cache_control": {"type": "ephemeral"}
+            }
+        ],
+        messages=[
+            *history,
+            {"role": "user", "content": [
+                {"type": "text", "text": user_question, "cache_control": {"type": "ephemeral"}}
+            ] if history else user_question}
+        ]
+    )
+
+
+def _usage_dict(usage):
+    cache_read = getattr(usage, 'cache_read_input_tokens', 0) or 0
+    cache_creation = getattr(usage, 'cache_creation_input_tokens', 0) or 0
+    metrics.record_tokens(
+        'anthropic',
+        input=usage.input_tokens,
+        output=usage.output_tokens,
+        cache_read=cache_read,
+        cache_creation=cache_creation
+    )
+    return {
+        'input_tokens': usage.input_tokens,
+        'output_tokens': usage.output_tokens,
+        'cache_read_tokens': cache_read,
+        'cache_creation_tokens': cache_creation,
+        # Every prompt token billed on this call, cached or not
+        'total_input_tokens': usage.input_tokens + cache_read + cache_creation
+    }
+
+
+def _cached_response(cached):
+    """/analyze payload for an answer cache hit - no Claude call, so no tokens"""
+    return {
+        'analysis': cached.description,
+        'memories_analyzed': cached.details['memories_analyzed'],
+        'usage': {'input_tokens': 0, 'output_tokens': 0, 'cache_read_tokens': 0, 'cache_creation_tokens': 0, 'total_input_tokens': 0},
+        'cached': True,
+        'cache_similarity': round(float(cached.similarity), 3)
+    }
+
+
+def _store_answer(current_user, user_question, query_embedding, version, analysis, results, usage):
+    try:
+        answer_cache.store(
+            current_user.id,
+            user_question,
+            query_embedding,
+            version,
+            analysis,
+            [row.id for row in results],
+            usage
+        )
+    except Exception as e:
+        # A failed cache write shouldn't fail the analysis
+        db.session.rollback()
+        print(f"Error storing cached analysis: {e}")
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 
 @bp.route('/analyze', methods=['POST'])
 @require_auth
 def analyze_memories(current_user):
-    """AI analysis using RAG - retrieves relevant memories, then generates insights"""
+    """AI analysis using RAG - retrieves relevant memories, then generates insights.
+    Repeat questions are answered from the semantic answer cache until the memories change
+    (pass refresh=true to skip it)."""
     data = request.get_json()
     user_question = data.get('question')
     
@@ -24,42 +138,16 @@ def analyze_memories(current_user):
     try:
         print(f"Generating query embedding for: {user_question}")
         query_embedding = get_query_embedding(user_question)
+        version = current_version(current_user.id)
         
-        # Convert list to string format for pgvector
-        embedding_str = '[' + ','.join(map(str, query_embedding)) + ']'
-        
-        sql = text("""
-            SELECT 
-                id,
-                encrypted_content,
-                year,
-                age,
-                grade,
-                confidence_level,
-                emotional_valence,
-                created_at,
-                1 - (embedding <=> CAST(:query_embedding AS vector)) AS similarity
-            FROM memories
-            WHERE user_id = :user_id
-                AND embedding IS NOT NULL
-            ORDER BY embedding <=> CAST(:query_embedding AS vector)
-            LIMIT 15
-        """)
-        
-        print(f"Searching for relevant memories...")
-        results = db.session.execute(sql, {
-            'query_embedding': embedding_str,
-            'user_id': str(current_user.id)
-        })
+        # Near-identical question and no memory changes since - reuse the earlier answer
+        if not data.get('refresh'):
+            cached = answer_cache.lookup(current_user.id, query_embedding, version)
+            if cached:
+                print(f"Answer cache hit (similarity {cached.similarity:.3f})")
+                return jsonify(_cached_response(cached))
         
-        relevant_memories = []
-        for row in results:
-            similarity_pct = int(row.similarity * 100)
-            memory_text = f"""Memory from {row.year or 'unknown year'} (Age {row.age or 'unknown'}):
-{row.encrypted_content}
-
-Metadata: Confidence {row.confidence_level}/10, Emotional valence {row.emotional_valence}, Relevance {similarity_pct}%"""
-            relevant_memories.append(memory_text)
+        results, relevant_memories, context_stats = _retrieve_memories(current_user, query_embedding)
         
         if not relevant_memories:
             return jsonify({
@@ -69,49 +157,25 @@ Metadata: Confidence {row.confidence_level}/10, Emotional valence {row.emotional
         
         print(f"Found {len(relevant_memories)} relevant memories")
         
-        context = "\n\n---\n\n".join(relevant_memories)
+        # Give the pooled connection back while waiting on Claude - under the gevent server many
+        # requests wait at once, and the pool shouldn't be the limit
+        db.session.close()
         
-        print(f"Sending to Claude for analysis...")
-        response = client.messages.create(
-            model="claude-sonnet-4-5-20250929",
-            max_tokens=2048,
-            system=[
-                {
-                    "type": "text",
-                    "text": """You are a compassionate, insightful therapist analyzing personal memories.
-                                Your role:
-                                - Identify patterns, themes, and connections across memories
-                                - Note emotional progressions and changes over time
-                                - Highlight potential areas for growth or healing
-                                - Be empathetic, constructive, and non-judgmental
-                                - Avoid clinical diagnoses or labels
-
-                                Provide thoughtful analysis that helps the person understand themselves better."""
-                },
-                {
-                    "type": "text",
-                    "text": f"""Relevant memories (retrieved via semantic search):
-
-{context}""",
-                    "cache_control": {"type": "ephemeral"}
-                }
-            ],
-            messages=[
-                {"role": "user", "content": user_question}
-            ]
-        )
+        print("Sending to Claude for analysis...")
+        with metrics.span('llm'):
+            response = llm.get_client().messages.create(**_analysis_request(relevant_memories, user_question))
         
         print(f"Analysis complete. Tokens used: {response.usage.input_tokens} input, {response.usage.output_tokens} output")
         
+        usage = _usage_dict(response.usage)
+        _store_answer(current_user, user_question, query_embedding, version, response.content[0].text, results, usage)
+        
         return jsonify({
             'analysis': response.content[0].text,
             'memories_analyzed': len(relevant_memories),
-            'usage': {
-                'input_tokens': response.usage.input_tokens,
-                'output_tokens': response.usage.output_tokens,
-                'cache_read_tokens': getattr(response.usage, 'cache_read_input_tokens', 0),
-                'cache_creation_tokens': getattr(response.usage, 'cache_creation_input_tokens', 0)
-            }
+            'usage': usage,
+            'context': context_stats,
+            'cached': False
         })
         
     except Exception as e:
@@ -121,45 +185,325 @@ Metadata: Confidence {row.confidence_level}/10, Emotional valence {row.emotional
         return jsonify({'error': str(e)}), 500
 
 
+@bp.route('/analyze/stream', methods=['POST'])
+@require_auth
+def analyze_memories_stream(current_user):
+    """Streaming variant of /analyze as server-sent events.
+    
+    Sends a `retrieval` event as soon as the memories are found, then one `token` event per
+    text delta from Claude, then `usage` and `done`. If the client disconnects, the upstream
+    Anthropic stream is closed so generation stops.
+    """
+    data = request.get_json()
+    user_question = data.get('question')
+    
+    if not user_question:
+        return jsonify({'error': 'Question required'}), 400
+    
+    cached = None
+    try:
+        query_embedding = get_query_embedding(user_question)
+        version = current_version(current_user.id)
+        
+        if not data.get('refresh'):
+            cached = answer_cache.lookup(current_user.id, query_embedding, version)
+        
+        results, relevant_memories, context_stats = ([], [], None) if cached else _retrieve_memories(current_user, query_embedding)
+    except Exception as e:
+        print(f"Error in analyze_memories_stream: {e}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        # Don't hold a pooled connection for the whole generation - only the final cache write needs one
+        db.session.close()
+    
+    retrieval = {
+        'memories_analyzed': len(relevant_memories),
+        'context': context_stats,
+        'memories': [{
+            'id': str(row.id),
+            'year': row.year,
+            'age': row.age,
+            'similarity': round(float(row.similarity), 3)
+        } for row in results]
+    }
+    
+    def generate():
+        if cached:
+            payload = _cached_response(cached)
+            yield _sse('retrieval', {'memories_analyzed': payload['memories_analyzed'], 'memories': [], 'cached': True})
+            yield _sse('token', {'text': payload['analysis']})
+            yield _sse('usage', payload['usage'])
+            yield _sse('done', {'cached': True})
+            return
+        
+        yield _sse('retrieval', retrieval)
+        
+        if not relevant_memories:
+            yield _sse('done', {'analysis': 'No memories found. Please add some memories first.'})
+            return
+        
+        try:
+            # Leaving this block - including via GeneratorExit on client disconnect - closes the upstream response
+            with metrics.span('llm'), llm.get_client().messages.stream(**_analysis_request(relevant_memories, user_question)) as stream:
+                for text in stream.text_stream:
+                    yield _sse('token', {'text': text})
+                message = stream.get_final_message()
+        except Exception as e:
+            print(f"Error in analyze_memories_stream: {e}")
+            yield _sse('error', {'error': str(e)})
+            return
+        
+        usage = _usage_dict(message.usage)
+        yield _sse('usage', usage)
+        yield _sse('done', {'cached': False})
+        
+        analysis = ''.join(block.text for block in message.content if block.type == 'text')
+        _store_answer(current_user, user_question, query_embedding, version, analysis, results, usage)
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+def _add_usage(total, usage):
+    return {key: (total or {}).get(key, 0) + value for key, value in usage.items()}
+
+
+def _load_session(current_user, session_id, lock=False):
+    """The user's live session, or None (expired sessions are deleted on sight)"""
+    query = AnalysisSession.query.filter_by(id=session_id, user_id=current_user.id)
+    if lock:
+        query = query.with_for_update()  # one turn at a time per session
+    session = query.first()
+    
+    if session and session.expires_at <= datetime.utcnow():
+        db.session.delete(session)
+        db.session.commit()
+        return None
+    return session
+
+
+@bp.route('/sessions', methods=['POST'])
+@require_auth
+def create_analysis_session(current_user):
+    """Start a multi-turn analysis.
+    
+    The first question retrieves memories as /analyze does, then pins that context - in a
+    fixed chronological order - for every follow-up, so later turns are prompt-cache reads.
+    """
+    data = request.get_json()
+    user_question = data.get('question')
+    
+    if not user_question:
+        return jsonify({'error': 'Question required'}), 400
+    
+    try:
+        AnalysisSession.query.filter(
+            AnalysisSession.user_id == current_user.id,
+            AnalysisSession.expires_at <= datetime.utcnow()
+        ).delete(synchronize_session=False)
+        
+        query_embedding = get_query_embedding(user_question)
+        version = current_version(current_user.id)
+        results, relevant_memories, context_stats = _retrieve_memories(current_user, query_embedding)
+        
+        if not relevant_memories:
+            return jsonify({
+                'analysis': 'No memories found. Please add some memories first.',
+                'memories_analyzed': 0
+            })
+        
+        # Same memories -> same bytes, whatever order retrieval returned them in
+        pinned = sorted(
+            zip(results, relevant_memories),
+            key=lambda pair: (pair[0].year or -1, pair[0].age or -1, str(pair[0].id))
+        )
+        context = _memory_context([memory_text for _, memory_text in pinned])
+        
+        # Commits the expired-session cleanup and releases the connection during the Claude call
+        db.session.commit()
+        
+        with metrics.span('llm'):
+            response = llm.get_client().messages.create(**_analysis_request(None, user_question, context=context))
+        analysis = response.content[0].text
+        usage = _usage_dict(response.usage)
+        
+        session = AnalysisSession(
+            user_id=current_user.id,
+            title=user_question[:255],
+            context=context,
+            memory_ids=[row.id for row, _ in pinned],
+            memory_set_version=version,
+            messages=[
+                {'role': 'user', 'content': user_question},
+                {'role': 'assistant', 'content': analysis}
+            ],
+            usage=usage,
+            expires_at=datetime.utcnow() + timedelta(seconds=current_app.config['ANALYSIS_SESSION_TTL'])
+        )
+        db.session.add(session)
+        db.session.commit()
+        
+        return jsonify(dict(
+            session.to_dict(),
+            session_id=str(session.id),
+            analysis=analysis,
+            context=context_stats,
+            usage=usage
+        )), 201
+        
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error in create_analysis_session: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/sessions/<uuid:session_id>/messages', methods=['POST'])
+@require_auth
+def continue_analysis_session(current_user, session_id):
+    """Ask a follow-up in a session. No retrieval - the pinned context and history are resent
+    unchanged, and usage.cache_read_tokens shows how much of that came from the prompt cache."""
+    data = request.get_json()
+    user_question = data.get('question')
+    
+    if not user_question:
+        return jsonify({'error': 'Question required'}), 400
+    
+    try:
+        session = _load_session(current_user, session_id)
+        if not session:
+            return jsonify({'error': 'Session not found or expired'}), 404
+        
+        turns = sum(1 for message in session.messages if message['role'] == 'user')
+        if turns >= current_app.config['ANALYSIS_SESSION_MAX_TURNS']:
+            return jsonify({'error': 'Session turn limit reached - start a new session'}), 409
+        
+        context, history = session.context, list(session.messages)
+        db.session.close()  # no connection held during the Claude call
+        
+        with metrics.span('llm'):
+            response = llm.get_client().messages.create(**_analysis_request(
+                None, user_question, context=context, history=history
+            ))
+        analysis = response.content[0].text
+        usage = _usage_dict(response.usage)
+        
+        # Another turn may have landed meanwhile - only append to the history we answered from
+        session = _load_session(current_user, session_id, lock=True)
+        if not session:
+            return jsonify({'error': 'Session not found or expired'}), 404
+        if len(session.messages) != len(history):
+            db.session.rollback()
+            return jsonify({'error': 'Session was updated by another request - retry'}), 409
+        
+        # Reassign (not append) so SQLAlchemy sees the JSONB change
+        session.messages = session.messages + [
+            {'role': 'user', 'content': user_question},
+            {'role': 'assistant', 'content': analysis}
+        ]
+        session.usage = _add_usage(session.usage, usage)
+        session.expires_at = datetime.utcnow() + timedelta(seconds=current_app.config['ANALYSIS_SESSION_TTL'])
+        db.session.commit()
+        
+        return jsonify(dict(
+            session.to_dict(),
+            session_id=str(session.id),
+            analysis=analysis,
+            usage=usage
+        ))
+        
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error in continue_analysis_session: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/sessions/<uuid:session_id>', methods=['GET'])
+@require_auth
+def get_analysis_session(current_user, session_id):
+    """A session's history and token totals"""
+    session = _load_session(current_user, session_id)
+    if not session:
+        return jsonify({'error': 'Session not found or expired'}), 404
+    
+    return jsonify(dict(
+        session.to_dict(include_messages=True),
+        memories_changed=session.memory_set_version != current_version(current_user.id)
+    ))
+
+
+@bp.route('/sessions/<uuid:session_id>', methods=['DELETE'])
+@require_auth
+def delete_analysis_session(current_user, session_id):
+    session = AnalysisSession.query.filter_by(id=session_id, user_id=current_user.id).first()
+    if not session:
+        return jsonify({'error': 'Session not found'}), 404
+    
+    db.session.delete(session)
+    db.session.commit()
+    
+    return jsonify({'message': 'Session deleted'}), 200
+
+
+@bp.route('/themes', methods=['GET'])
+@require_auth
+def get_themes(current_user):
+    """Recurring themes across the user's memories, precomputed by `flask insights cluster`.
+    
+    No Claude call - each theme was titled once when it was built. `stale` is true when
+    memories changed since, until the next clustering run.
+    """
+    themes = AIInsight.query.filter(
+        AIInsight.user_id == current_user.id,
+        AIInsight.insight_type == THEME_INSIGHT_TYPE,
+        AIInsight.dismissed_at.is_(None)
+    ).all()
+    version = current_version(current_user.id)
+    themes.sort(key=lambda t: -(t.details or {}).get('size', 0))
+    
+    return jsonify({
+        'themes': [dict(t.to_dict(), details=t.details) for t in themes],
+        'stale': any(t.memory_set_version != version for t in themes)
+    })
+
+
 @bp.route('/search', methods=['POST'])
 @require_auth
 def search_memories(current_user):
-    """Semantic search - find memories by meaning, not just keywords"""
+    """Search memories.
+    
+    mode: 'vector' (default) finds memories by meaning, 'lexical' by exact words (full-text,
+    no embedding call), 'hybrid' fuses both rankings. Optional ef_search (HNSW) / probes
+    (IVFFlat) trade latency for recall on this request.
+    """
     data = request.get_json()
     query = data.get('query')
     limit = data.get('limit', 10)
+    mode = data.get('mode', 'vector')
     
     if not query:
         return jsonify({'error': 'Query required'}), 400
+    if mode not in SEARCH_MODES:
+        return jsonify({'error': f"mode must be one of {', '.join(SEARCH_MODES)}"}), 400
+    
+    ann_settings = {}
+    for name in ('ef_search', 'probes'):
+        value = data.get(name)
+        if value is not None:
+            try:
+                ann_settings[name] = int(value)
+            except (TypeError, ValueError):
+                return jsonify({'error': f'{name} must be an integer'}), 400
     
     try:
-        query_embedding = get_query_embedding(query)
-        
-        embedding_str = '[' + ','.join(map(str, query_embedding)) + ']'
-        
-        sql = text("""
-            SELECT 
-                id,
-                encrypted_content,
-                year,
-                age,
-                grade,
-                confidence_level,
-                emotional_valence,
-                created_at,
-                1 - (embedding <=> CAST(:query_embedding AS vector)) AS similarity
-            FROM memories
-            WHERE user_id = :user_id
-                AND embedding IS NOT NULL
-            ORDER BY embedding <=> CAST(:query_embedding AS vector)
-            LIMIT :limit
-        """)
-        
-        results = db.session.execute(sql, {
-            'query_embedding': embedding_str,
-            'user_id': str(current_user.id),
-            'limit': limit
-        })
+        if mode == 'lexical':
+            results = search_lexical(current_user.id, query, limit=limit)
+        elif mode == 'hybrid':
+            results = search_hybrid(current_user.id, query, get_query_embedding(query), limit=limit, **ann_settings)
+        else:
+            results = search_similar(current_user.id, get_query_embedding(query), limit=limit, **ann_settings)
         
         memories = []
         for row in results:
@@ -172,11 +516,13 @@ def search_memories(current_user):
                 'confidence_level': row.confidence_level,
                 'emotional_valence': row.emotional_valence,
                 'created_at': row.created_at.isoformat(),
-                'similarity': round(float(row.similarity), 3)
+                'similarity': round(float(row.similarity), 3) if row.similarity is not None else None,
+                'score': round(float(row.score), 5) if 'score' in row._fields else None
             })
         
         return jsonify({
             'query': query,
+            'mode': mode,
             'memories': memories,
             'count': len(memories)
         })
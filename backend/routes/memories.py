@@ -1,11 +1,20 @@
 # routes/memories.py
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
 #from models import MemoryVersion, Tag, AuditLog
-from models import db, Memory, MemoryVersion, AuditLog
+from models import db, Memory, MemoryVersion, MemoryNeighbor, MEMORY_CHRONOLOGY
 from middleware.auth_middleware import require_auth
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import insert, tuple_
+from sqlalchemy.orm import selectinload
 from datetime import datetime
-from services.embedding_service import get_embedding
+import base64
+import json
+import uuid
+from services.embedding_service import EMBEDDING_MODEL, get_embeddings_batch, embedding_chunks
+from services.embedding_jobs import schedule_embedding, enqueue_embeddings, notify_worker, wait_for_embeddings
+from services.memory_set import bump_version
+from services import related_memories, vector_index
+from services.export import export_ndjson
+from services.memory_versions import version_state, record_version, replay, version_content
 
 
 
@@ -16,45 +25,67 @@ bp = Blueprint('memories', __name__)
 @bp.route('/', methods=['GET'])
 @require_auth
 def get_memories(current_user):
-    """Get all memories for current user"""
+    """Get all memories for current user.
+    
+    Pass ?cursor= (empty for the first page, then next_cursor) for keyset pagination, which
+    costs the same on every page. ?page= keeps the old offset mode. ?include_total=true|false
+    toggles the COUNT(*) (on by default in page mode only).
+    """
     # Parse query params
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 20, type=int)
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = max(1, min(request.args.get('per_page', 20, type=int), 100))
     year = request.args.get('year', type=int)
+    cursor = request.args.get('cursor')
+    include_total = request.args.get('include_total', 'false' if cursor is not None else 'true').lower() == 'true'
     
-    # Build query using SQLAlchemy
-    query = Memory.query.filter_by(user_id=current_user.id)
+    # Build query using SQLAlchemy - tags load in one batched query instead of one per memory
+    query = Memory.query.filter_by(user_id=current_user.id).options(selectinload(Memory.tags))
     
     if year:
         query = query.filter_by(year=year)
     
-    # Order by chronology
-    query = query.order_by(
-        Memory.year.desc().nullslast(),
-        Memory.age.desc().nullslast()
-    )
+    total = query.order_by(None).count() if include_total else None
+    
+    # Order by chronology (matches ix_memories_user_chronology)
+    query = query.order_by(*[column.desc() for column in MEMORY_CHRONOLOGY])
+    
+    if cursor is not None:
+        if cursor:
+            try:
+                position = _decode_cursor(cursor)
+            except ValueError:
+                return jsonify({'error': 'Invalid cursor'}), 400
+            query = query.filter(tuple_(*MEMORY_CHRONOLOGY) < position)
+        
+        memories = query.limit(per_page + 1).all()
+        has_more = len(memories) > per_page
+        memories = memories[:per_page]
+        
+        return jsonify({
+            'memories': [m.to_dict() for m in memories],
+            'next_cursor': _encode_cursor(memories[-1]) if has_more else None,
+            'has_more': has_more,
+            'total': total
+        })
     
     # Paginate
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    pagination = query.paginate(page=page, per_page=per_page, error_out=False, count=False)
     
     return jsonify({
         'memories': [m.to_dict() for m in pagination.items],
-        'total': pagination.total,
+        'total': total,
         'page': pagination.page,
-        'pages': pagination.pages
+        'pages': (total + per_page - 1) // per_page if total is not None else None
     })
 
 
 @bp.route('/', methods=['POST'])
 @require_auth
 def create_memory(current_user):
-    """Create new memory with embedding"""
+    """Create new memory - the embedding is generated in the background unless EMBEDDING_ASYNC is off"""
     data = request.get_json()
     
     try:
-        # Generate embedding for the content
-        embedding = get_embedding(data['encrypted_content'])
-        
         memory = Memory(
             user_id=current_user.id,
             encrypted_content=data['encrypted_content'],
@@ -64,12 +95,19 @@ def create_memory(current_user):
             grade=data.get('grade'),
             confidence_level=data.get('confidence_level'),
             emotional_valence=data.get('emotional_valence'),
-            visibility=data.get('visibility', 'private'),
-            embedding=embedding  # Store the vector
+            visibility=data.get('visibility', 'private')
         )
         
         db.session.add(memory)
+        schedule_embedding(memory)
+        if memory.embedding is not None:
+            db.session.flush()
+            related_memories.update_neighbors([memory.id])
+        version = bump_version(current_user.id)
+        embedding = memory.embedding
         db.session.commit()
+        notify_worker()
+        vector_index.sync_memory(current_user.id, version, memory.id, embedding)
         
         return jsonify({
             'message': 'Memory created',
@@ -84,22 +122,93 @@ def create_memory(current_user):
 
 
 
+@bp.route('/bulk', methods=['POST'])
+@require_auth
+def bulk_import_memories(current_user):
+    """Import many memories at once from a JSON array or NDJSON body.
+    
+    Rows are validated up front, embedded in provider-sized batches and inserted with one
+    multi-row INSERT and one commit per batch. Invalid or failing rows are reported per row
+    without rejecting the rest (207 when anything failed).
+    """
+    rows, results = _parse_bulk_body()
+    
+    if rows is None:
+        return jsonify({'error': 'Expected a JSON array, {"memories": [...]} or NDJSON'}), 400
+    if not rows and not results:
+        return jsonify({'error': 'No memories provided'}), 400
+    if len(rows) + len(results) > current_app.config['BULK_IMPORT_MAX_ROWS']:
+        return jsonify({'error': f"At most {current_app.config['BULK_IMPORT_MAX_ROWS']} memories per request"}), 413
+    
+    valid = []
+    for index, row in rows:
+        errors = _validate_memory_row(row)
+        if errors:
+            results.append({'index': index, 'status': 'invalid', 'errors': errors})
+        else:
+            valid.append((index, row))
+    
+    for chunk in embedding_chunks(valid, text_of=lambda item: item[1]['encrypted_content']):
+        results.extend(_import_chunk(current_user, chunk))
+    
+    notify_worker()
+    
+    results.sort(key=lambda r: r['index'])
+    created = sum(1 for r in results if r['status'] == 'created')
+    
+    return jsonify({
+        'created': created,
+        'failed': len(results) - created,
+        'results': results
+    }), 201 if created == len(results) else 207
+
+
+@bp.route('/export', methods=['GET'])
+@require_auth
+def export_memories(current_user):
+    """Stream the whole journal - memories, versions, tags and perspectives - as NDJSON.
+    
+    ?embeddings=true adds each memory's vector (base64 float32), ?compression=gzip returns
+    a .ndjson.gz stream. Rows come from server-side cursors, so any journal size streams
+    in constant memory; see services/export.py for the record format.
+    """
+    include_embeddings = request.args.get('embeddings', 'false').lower() == 'true'
+    compression = request.args.get('compression')
+    if compression not in (None, 'gzip'):
+        return jsonify({'error': "compression must be 'gzip' (or omitted)"}), 400
+    
+    filename = f"remember-export-{datetime.utcnow():%Y%m%d}.ndjson" + ('.gz' if compression else '')
+    return Response(
+        stream_with_context(export_ndjson(current_user.id, include_embeddings=include_embeddings, compress=compression == 'gzip')),
+        mimetype='application/gzip' if compression else 'application/x-ndjson',
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'Cache-Control': 'no-store',
+            'X-Accel-Buffering': 'no'  # let proxies pass chunks through as they're produced
+        }
+    )
+
+
 @bp.route('/<uuid:memory_id>', methods=['PUT'])
 @require_auth
 def update_memory(current_user, memory_id):
-    """Update existing memory"""
+    """Update existing memory - any change to content, key or ratings is recorded as a new version"""
+    # Locked so concurrent edits append versions one after the other
     memory = Memory.query.filter_by(
         id=memory_id,
         user_id=current_user.id
-    ).first_or_404()
+    ).with_for_update().first_or_404()
     
     data = request.get_json()
+    previous = version_state(memory)
     
     # Update fields
-    if 'encrypted_content' in data:
+    if 'encrypted_content' in data and data['encrypted_content'] != memory.encrypted_content:
         memory.encrypted_content = data['encrypted_content']
         # Regenerate embedding if content changed
-        memory.embedding = get_embedding(data['encrypted_content'])
+        schedule_embedding(memory)
+        db.session.flush()
+        related_memories.update_neighbors([memory.id])
     
     # For nullable fields, always update even if None
     memory.year = data.get('year')
@@ -111,9 +220,16 @@ def update_memory(current_user, memory_id):
     if 'emotional_valence' in data:
         memory.emotional_valence = data['emotional_valence']
     
+    if version_state(memory) != previous:
+        record_version(memory, previous, change_note=data.get('change_note'))
+    
     memory.updated_at = datetime.utcnow()
+    version = bump_version(current_user.id)
+    embedding = memory.embedding
     
     db.session.commit()
+    notify_worker()
+    vector_index.sync_memory(current_user.id, version, memory.id, embedding)
     
     return jsonify({
         'message': 'Memory updated',
@@ -124,24 +240,123 @@ def update_memory(current_user, memory_id):
 @bp.route('/<uuid:memory_id>/timeline', methods=['GET'])
 @require_auth
 def get_memory_timeline(current_user, memory_id):
-    """Get version history for a memory"""
+    """Get version history for a memory.
+    
+    ?version=N adds that version's content, rebuilt from its nearest snapshot (at most
+    MEMORY_VERSION_SNAPSHOT_EVERY rows). ?include_content=true adds every version's content
+    in one forward pass over the history.
+    """
     memory = Memory.query.filter_by(
         id=memory_id,
         user_id=current_user.id
     ).first_or_404()
     
-    versions = MemoryVersion.query.filter_by(
-        memory_id=memory.id
+    version_number = request.args.get('version', type=int)
+    include_content = request.args.get('include_content', 'false').lower() == 'true'
+    
+    # Content columns only when they're needed - a long history is mostly delta rows
+    columns = [
+        MemoryVersion.version_number, MemoryVersion.change_note, MemoryVersion.encryption_key_id,
+        MemoryVersion.confidence_level, MemoryVersion.emotional_valence, MemoryVersion.created_at,
+        MemoryVersion.encrypted_content.isnot(None).label('is_snapshot')
+    ]
+    if include_content:
+        columns += [MemoryVersion.encrypted_content, MemoryVersion.content_delta]
+    
+    versions = db.session.query(*columns).filter(
+        MemoryVersion.memory_id == memory.id
     ).order_by(MemoryVersion.version_number.asc()).all()
     
-    return jsonify({
+    history = [{
+        'version_number': v.version_number,
+        'change_note': v.change_note,
+        'encryption_key_id': v.encryption_key_id,
+        'confidence_level': v.confidence_level,
+        'emotional_valence': v.emotional_valence,
+        'is_snapshot': v.is_snapshot,
+        'created_at': v.created_at.isoformat()
+    } for v in versions]
+    
+    if include_content:
+        for entry, content in zip(history, replay(versions)):
+            entry['encrypted_content'] = content
+    
+    response = {
         'memory_id': str(memory.id),
         'current': memory.to_dict(),
-        'versions': [{
-            'version_number': v.version_number,
-            'change_note': v.change_note,
-            'created_at': v.created_at.isoformat()
-        } for v in versions]
+        'versions': history
+    }
+    
+    if version_number is not None:
+        content = version_content(memory.id, version_number)
+        if content is None:
+            return jsonify({'error': f'Version {version_number} not found'}), 404
+        response['version'] = dict(
+            next(entry for entry in history if entry['version_number'] == version_number),
+            encrypted_content=content
+        )
+    
+    return jsonify(response)
+
+
+@bp.route('/<uuid:memory_id>/related', methods=['GET'])
+@require_auth
+def get_related_memories(current_user, memory_id):
+    """Nearest memories by meaning, read from the precomputed neighbour graph (?limit=, up to
+    RELATED_MEMORIES_K). A memory embedded before the graph existed gets its list built here."""
+    memory = Memory.query.filter_by(
+        id=memory_id,
+        user_id=current_user.id
+    ).first_or_404()
+    
+    limit = max(1, min(request.args.get('limit', current_app.config['RELATED_MEMORIES_K'], type=int),
+                       current_app.config['RELATED_MEMORIES_K']))
+    
+    def load():
+        return db.session.query(Memory, MemoryNeighbor.similarity).join(
+            MemoryNeighbor, MemoryNeighbor.neighbor_id == Memory.id
+        ).filter(
+            MemoryNeighbor.memory_id == memory.id
+        ).options(selectinload(Memory.tags)).order_by(
+            MemoryNeighbor.similarity.desc(), MemoryNeighbor.neighbor_id
+        ).limit(limit).all()
+    
+    related = load()
+    # An empty list is only worth rebuilding if there is something it could contain - a user
+    # with a single embedded memory would otherwise rewrite it on every request
+    if not related and memory.embedding_status == 'ready' and db.session.query(
+        Memory.query.filter(
+            Memory.user_id == current_user.id,
+            Memory.id != memory.id,
+            Memory.embedding.isnot(None)
+        ).exists()
+    ).scalar():
+        related_memories.refresh([memory.id])
+        db.session.commit()
+        related = load()
+    
+    return jsonify({
+        'memory_id': str(memory.id),
+        'embedding_status': memory.embedding_status,
+        'related': [dict(m.to_dict(), similarity=round(similarity, 4)) for m, similarity in related]
+    })
+
+
+@bp.route('/<uuid:memory_id>/embedding', methods=['GET'])
+@require_auth
+def get_embedding_status(current_user, memory_id):
+    """Poll a memory's embedding status; ?wait=N blocks up to N seconds while it is pending"""
+    memory = Memory.query.filter_by(
+        id=memory_id,
+        user_id=current_user.id
+    ).first_or_404()
+    
+    wait = min(request.args.get('wait', 0, type=float), 30)
+    statuses = wait_for_embeddings([memory.id], timeout=wait)
+    
+    return jsonify({
+        'memory_id': str(memory.id),
+        'embedding_status': statuses.get(str(memory.id))
     })
 
 
@@ -158,9 +373,147 @@ def delete_memory(current_user, memory_id):
         user_id=current_user.id
     ).first_or_404()
     
+    affected = related_memories.referencing([memory.id])
     db.session.delete(memory)
+    db.session.flush()
+    related_memories.refresh(affected)
+    version = bump_version(current_user.id)
     db.session.commit()
+    vector_index.apply_change(current_user.id, version, removals=[memory_id])
     
     return jsonify({
         'message': 'Memory deleted'
-    })
\ No newline at end of file
+    })
+
+
+def _encode_cursor(memory):
+    position = [memory.year if memory.year is not None else -1, memory.age if memory.age is not None else -1, str(memory.id)]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor):
+    try:
+        year, age, memory_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return int(year), int(age), uuid.UUID(memory_id)
+    except (TypeError, ValueError, json.JSONDecodeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def _parse_bulk_body():
+    """Return ([(index, row)], [results for unparseable lines]), or (None, []) for a bad body"""
+    if request.mimetype in ('application/x-ndjson', 'application/ndjson', 'application/jsonl'):
+        rows, errors = [], []
+        lines = [line for line in request.get_data(as_text=True).splitlines() if line.strip()]
+        for index, line in enumerate(lines):
+            try:
+                rows.append((index, json.loads(line)))
+            except ValueError as e:
+                errors.append({'index': index, 'status': 'invalid', 'errors': [f'Invalid JSON: {e}']})
+        return rows, errors
+    
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('memories')
+    if not isinstance(data, list):
+        return None, []
+    
+    return list(enumerate(data)), []
+
+
+def _validate_memory_row(row):
+    """Check a row against the Memory column limits and check constraints"""
+    if not isinstance(row, dict):
+        return ['Row must be an object']
+    
+    errors = []
+    
+    for field in ('encrypted_content', 'encryption_key_id'):
+        if not isinstance(row.get(field), str) or not row[field].strip():
+            errors.append(f'{field} is required')
+    if isinstance(row.get('encryption_key_id'), str) and len(row['encryption_key_id']) > 100:
+        errors.append('encryption_key_id must be at most 100 characters')
+    
+    for field in ('year', 'age', 'grade', 'confidence_level', 'emotional_valence'):
+        value = row.get(field)
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool)):
+            errors.append(f'{field} must be an integer')
+    
+    # valid_chronology
+    if row.get('year') is None and row.get('age') is None and row.get('grade') is None:
+        errors.append('One of year, age or grade is required')
+    
+    # valid_confidence
+    confidence = row.get('confidence_level')
+    if isinstance(confidence, int) and not 1 <= confidence <= 10:
+        errors.append('confidence_level must be between 1 and 10')
+    
+    # valid_valence
+    valence = row.get('emotional_valence')
+    if isinstance(valence, int) and not -5 <= valence <= 5:
+        errors.append('emotional_valence must be between -5 and 5')
+    
+    visibility = row.get('visibility', 'private')
+    if not isinstance(visibility, str) or len(visibility) > 20:
+        errors.append('visibility must be a string of at most 20 characters')
+    
+    return errors
+
+
+def _import_chunk(current_user, chunk):
+    """Embed and insert one chunk of validated rows in a single transaction"""
+    try:
+        embeddings = get_embeddings_batch([row['encrypted_content'] for _, row in chunk])
+    except Exception as e:
+        # Still import the rows; the embedding worker retries them
+        print(f"Bulk import embedding failed, queueing {len(chunk)} rows: {e}")
+        embeddings = [None] * len(chunk)
+    
+    records = [{
+        'id': uuid.uuid4(),
+        'user_id': current_user.id,
+        'encrypted_content': row['encrypted_content'],
+        'encryption_key_id': row['encryption_key_id'],
+        'year': row.get('year'),
+        'age': row.get('age'),
+        'grade': row.get('grade'),
+        'confidence_level': row.get('confidence_level'),
+        'emotional_valence': row.get('emotional_valence'),
+        'visibility': row.get('visibility', 'private'),
+        'embedding': embedding,
+        'embedding_status': 'ready' if embedding is not None else 'pending',
+        'embedding_model': EMBEDDING_MODEL if embedding is not None else None
+    } for (_, row), embedding in zip(chunk, embeddings)]
+    
+    def created(index, record):
+        return {'index': index, 'status': 'created', 'id': str(record['id']), 'embedding_status': record['embedding_status']}
+    
+    try:
+        db.session.execute(insert(Memory), records)
+        enqueue_embeddings([r['id'] for r in records if r['embedding'] is None])
+        related_memories.update_neighbors([r['id'] for r in records if r['embedding'] is not None])
+        version = bump_version(current_user.id)
+        db.session.commit()
+        vector_index.apply_change(current_user.id, version, upserts={
+            r['id']: r['embedding'] for r in records if r['embedding'] is not None
+        })
+        return [created(index, record) for (index, _), record in zip(chunk, records)]
+    except Exception as e:
+        db.session.rollback()
+        print(f"Bulk insert of {len(records)} rows failed, retrying row by row: {e}")
+    
+    # Isolate the bad rows so the rest of the chunk still lands
+    results = []
+    for (index, _), record in zip(chunk, records):
+        try:
+            db.session.execute(insert(Memory), [record])
+            enqueue_embeddings([record['id']] if record['embedding'] is None else [])
+            related_memories.update_neighbors([record['id']] if record['embedding'] is not None else [])
+            version = bump_version(current_user.id)
+            db.session.commit()
+            vector_index.sync_memory(current_user.id, version, record['id'], record['embedding'])
+            results.append(created(index, record))
+        except Exception as e:
+            db.session.rollback()
+            results.append({'index': index, 'status': 'failed', 'errors': [str(e)]})
+    
+    return results
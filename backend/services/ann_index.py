@@ -0,0 +1,287 @@
+# services/ann_index.py
+import time
+from collections import namedtuple
+
+from flask import current_app
+from sqlalchemy import text
+
+from config import Config
+from models import db, VECTOR_STORAGE_COLUMNS
+from services.retrieval import search_similar, with_query_embedding
+
+
+METHODS = ('hnsw', 'ivfflat')
+
+Sample = namedtuple('Sample', 'user_id embedding')
+
+
+EXACT_DISTANCE = "embedding <=> CAST(:query_embedding AS vector)"
+
+# Expressions that quantize memories.embedding on the fly, for reports that must work in any storage mode
+QUANTIZED_DISTANCE = {
+    'half': f"embedding::halfvec({Config.EMBEDDING_DIMENSION}) <=> CAST(:query_embedding AS halfvec({Config.EMBEDDING_DIMENSION}))",
+    'binary': "binary_quantize(embedding) <~> binary_quantize(CAST(:query_embedding AS vector))",
+}
+
+
+def index_name(method, table='memories', column=None):
+    # Matches models.vector_index so `flask db migrate` sees the same index
+    column = column or VECTOR_STORAGE_COLUMNS[current_app.config['VECTOR_STORAGE']][0]
+    return f'ix_{table}_{column}_{method}'
+
+
+def build_index(method, m=None, ef_construction=None, lists=None, maintenance_work_mem=None, echo=print):
+    """(Re)build the ANN index on the VECTOR_STORAGE column without blocking writes"""
+    column, opclass = VECTOR_STORAGE_COLUMNS[current_app.config['VECTOR_STORAGE']]
+    if method == 'ivfflat':
+        params = {'lists': int(lists or current_app.config['IVFFLAT_LISTS'])}
+    else:
+        params = {
+            'm': int(m or current_app.config['HNSW_M']),
+            'ef_construction': int(ef_construction or current_app.config['HNSW_EF_CONSTRUCTION'])
+        }
+    with_clause = ', '.join(f'{key} = {value}' for key, value in params.items())
+
+    # CONCURRENTLY can't run inside a transaction block
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        if maintenance_work_mem:
+            conn.execute(text("SELECT set_config('maintenance_work_mem', :value, false)"), {'value': maintenance_work_mem})
+
+        for existing in METHODS:
+            for existing_column, _ in VECTOR_STORAGE_COLUMNS.values():
+                conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {index_name(existing, column=existing_column)}'))
+
+        echo(f"Building {index_name(method)} WITH ({with_clause})...")
+        started = time.monotonic()
+        conn.execute(text(f"""
+            CREATE INDEX CONCURRENTLY {index_name(method)}
+            ON memories USING {method} ({column} {opclass})
+            WITH ({with_clause})
+        """))
+        echo(f"Index built in {time.monotonic() - started:.1f}s")
+
+    return params
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)] if ordered else 0.0
+
+
+def _timed_search(row, k, **settings):
+    started = time.perf_counter()
+    results = search_similar(row.user_id, row.embedding, limit=k, backend='pgvector', **settings)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    db.session.rollback()  # drops the SET LOCALs
+    return [r.id for r in results], elapsed_ms
+
+
+def _timed_exact(sample, k):
+    """Exact full-precision top-k - plain SQL, so no prepared statement's cached plan can skip the
+    seq-scan setting, and never the quantized column whatever VECTOR_STORAGE is"""
+    started = time.perf_counter()
+    ids = _exact_ids(sample, k, EXACT_DISTANCE)
+    return ids, (time.perf_counter() - started) * 1000
+
+
+def _sample_queries(queries):
+    """Random embedded memories to use as queries, scoped to their owners"""
+    rows = db.session.execute(text("""
+        SELECT user_id, embedding::text AS embedding
+        FROM memories
+        WHERE embedding IS NOT NULL
+        ORDER BY random()
+        LIMIT :queries
+    """), {'queries': queries}).fetchall()
+    db.session.rollback()
+
+    return [Sample(row.user_id, [float(x) for x in row.embedding.strip('[]').split(',')]) for row in rows]
+
+
+def recall_report(k=10, queries=50, ef_search_values=(10, 20, 40, 80, 160), probes_values=(1, 5, 10, 20, 50), method=None):
+    """Compare ANN results against exact search for sampled memories on the live data.
+
+    Each sampled memory's own embedding is used as the query, scoped to its owner like the
+    search endpoints. Returns one row per setting with recall@k and latency percentiles.
+    """
+    method = method or current_app.config['VECTOR_INDEX_METHOD']
+
+    samples = _sample_queries(queries)
+    if not samples:
+        return []
+
+    exact_ids, exact_latency = [], []
+    for sample in samples:
+        ids, elapsed = _timed_exact(sample, k)
+        exact_ids.append(ids)
+        exact_latency.append(elapsed)
+
+    report = [{
+        'setting': 'exact',
+        'recall': 1.0,
+        'p50_ms': round(_percentile(exact_latency, 50), 2),
+        'p95_ms': round(_percentile(exact_latency, 95), 2)
+    }]
+
+    if method == 'ivfflat':
+        settings = [('probes', value) for value in probes_values]
+    else:
+        settings = [('ef_search', value) for value in ef_search_values]
+
+    for name, value in settings:
+        recalls, latency = [], []
+        for sample, expected in zip(samples, exact_ids):
+            ids, elapsed = _timed_search(sample, k, **{name: value})
+            recalls.append(len(expected & set(ids)) / len(expected) if expected else 1.0)
+            latency.append(elapsed)
+
+        report.append({
+            'setting': f'{name}={value}',
+            'recall': round(sum(recalls) / len(recalls), 4),
+            'p50_ms': round(_percentile(latency, 50), 2),
+            'p95_ms': round(_percentile(latency, 95), 2)
+        })
+
+    return report
+
+
+def memory_backend_report(k=10, queries=50):
+    """Check the in-process vector index against exact pgvector search.
+
+    Returns overlap@k, the largest similarity disagreement and latency for both backends.
+    """
+    samples = _sample_queries(queries)
+    if not samples:
+        return None
+
+    overlaps, max_diff = [], 0.0
+    exact_latency, memory_latency = [], []
+
+    for sample in samples:
+        exact_ids, elapsed = _timed_exact(sample, k)
+        exact_latency.append(elapsed)
+
+        started = time.perf_counter()
+        hits = search_similar(sample.user_id, sample.embedding, limit=k, backend='memory')
+        memory_latency.append((time.perf_counter() - started) * 1000)
+
+        exact = db.session.execute(with_query_embedding(text("""
+            SELECT id, 1 - (embedding <=> CAST(:query_embedding AS vector)) AS similarity
+            FROM memories WHERE id = ANY(CAST(:ids AS uuid[]))
+        """)), {
+            'query_embedding': sample.embedding,
+            'ids': [str(hit.id) for hit in hits]
+        })
+        exact_similarity = {str(row.id): row.similarity for row in exact}
+        db.session.rollback()
+
+        for hit in hits:
+            max_diff = max(max_diff, abs(hit.similarity - exact_similarity.get(str(hit.id), hit.similarity)))
+
+        expected = {str(memory_id) for memory_id in exact_ids}
+        overlaps.append(len(expected & {str(hit.id) for hit in hits}) / len(expected) if expected else 1.0)
+
+    return {
+        'queries': len(samples),
+        'overlap': round(sum(overlaps) / len(overlaps), 4),
+        'max_similarity_diff': round(max_diff, 6),
+        'pgvector_p50_ms': round(_percentile(exact_latency, 50), 2),
+        'pgvector_p95_ms': round(_percentile(exact_latency, 95), 2),
+        'memory_p50_ms': round(_percentile(memory_latency, 50), 2),
+        'memory_p95_ms': round(_percentile(memory_latency, 95), 2)
+    }
+
+
+def _exact_ids(sample, k, order_by, pool=None):
+    """Top-k ids by `order_by`, optionally reranked exactly from the top `pool` by that order"""
+    if pool:
+        sql = f"""
+            SELECT id FROM (
+                SELECT id, embedding FROM memories
+                WHERE user_id = :user_id AND embedding IS NOT NULL
+                ORDER BY {order_by}
+                LIMIT :pool
+            ) candidates
+            ORDER BY {EXACT_DISTANCE}
+            LIMIT :k
+        """
+    else:
+        sql = f"""
+            SELECT id FROM memories
+            WHERE user_id = :user_id AND embedding IS NOT NULL
+            ORDER BY {order_by}
+            LIMIT :k
+        """
+
+    # Sequential scans only, so the numbers measure quantization error rather than index error
+    db.session.execute(text("SELECT set_config('enable_indexscan', 'off', true)"))
+    rows = db.session.execute(with_query_embedding(text(sql)), {
+        'query_embedding': sample.embedding,
+        'user_id': str(sample.user_id),
+        'k': k,
+        'pool': pool
+    }).fetchall()
+    db.session.rollback()
+    return {row.id for row in rows}
+
+
+def quantization_report(k=10, queries=50, rerank_factor=None):
+    """Storage cost and recall impact of halfvec / binary quantization on the live data.
+
+    Sizes are measured with pg_column_size on the quantized expressions, so the report works
+    before VECTOR_STORAGE is switched. Recall@k is against exact float32 search, both for the
+    quantized order alone and after reranking k * rerank_factor candidates at full precision.
+    """
+    rerank_factor = rerank_factor or current_app.config['VECTOR_RERANK_FACTOR']
+
+    sizes = db.session.execute(text(f"""
+        SELECT
+            count(*) AS rows,
+            coalesce(avg(pg_column_size(embedding)), 0) AS full_bytes,
+            coalesce(avg(pg_column_size(embedding::halfvec({Config.EMBEDDING_DIMENSION}))), 0) AS half_bytes,
+            coalesce(avg(pg_column_size(binary_quantize(embedding))), 0) AS binary_bytes
+        FROM memories
+        WHERE embedding IS NOT NULL
+    """)).first()
+    indexes = db.session.execute(text("""
+        SELECT indexname, pg_relation_size(to_regclass(indexname)) AS bytes
+        FROM pg_indexes
+        WHERE tablename = 'memories' AND indexname ~ '^ix_memories_embedding.*_(hnsw|ivfflat)$'
+        ORDER BY indexname
+    """)).fetchall()
+    db.session.rollback()
+
+    samples = _sample_queries(queries)
+    exact = [_exact_ids(sample, k, EXACT_DISTANCE) for sample in samples]
+
+    def recall(found):
+        values = [len(expected & ids) / len(expected) if expected else 1.0 for expected, ids in zip(exact, found)]
+        return round(sum(values) / len(values), 4) if values else None
+
+    modes = [{
+        'storage': 'full',
+        'bytes_per_vector': round(float(sizes.full_bytes), 1),
+        'total_mb': round(float(sizes.full_bytes) * sizes.rows / 2**20, 2),
+        'savings': 0.0,
+        'recall': 1.0 if samples else None,
+        'recall_reranked': 1.0 if samples else None
+    }]
+    for storage, order_by in QUANTIZED_DISTANCE.items():
+        per_vector = float(getattr(sizes, f'{storage}_bytes'))
+        modes.append({
+            'storage': storage,
+            'bytes_per_vector': round(per_vector, 1),
+            'total_mb': round(per_vector * sizes.rows / 2**20, 2),
+            'savings': round(1 - per_vector / float(sizes.full_bytes), 4) if sizes.full_bytes else 0.0,
+            'recall': recall([_exact_ids(sample, k, order_by) for sample in samples]),
+            'recall_reranked': recall([_exact_ids(sample, k, order_by, pool=k * rerank_factor) for sample in samples])
+        })
+
+    return {
+        'rows': sizes.rows,
+        'queries': len(samples),
+        'k': k,
+        'rerank_factor': rerank_factor,
+        'modes': modes,
+        'indexes': [{'name': row.indexname, 'mb': round(row.bytes / 2**20, 2)} for row in indexes]
+    }
@@ -0,0 +1,80 @@
+# services/answer_cache.py
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select, text
+
+from models import db, AIInsight
+from services.retrieval import with_query_embedding
+
+
+INSIGHT_TYPE = 'analysis_cache'
+
+
+def lookup(user_id, query_embedding, version):
+    """Most similar cached analysis for this memory set version, if it clears the threshold"""
+    if not current_app.config['ANALYSIS_CACHE_ENABLED']:
+        return None
+
+    row = db.session.execute(with_query_embedding(text("""
+        SELECT
+            id,
+            description,
+            related_memory_ids,
+            details,
+            1 - distance AS similarity
+        FROM (
+            SELECT id, description, related_memory_ids, details,
+                   query_embedding <=> CAST(:query_embedding AS vector) AS distance
+            FROM ai_insights
+            WHERE user_id = CAST(:user_id AS uuid)
+                AND insight_type = :insight_type
+                AND memory_set_version = :version
+                AND dismissed_at IS NULL
+                AND created_at > :since
+            ORDER BY distance
+            LIMIT 1
+        ) nearest
+    """)), {
+        'query_embedding': query_embedding,
+        'user_id': str(user_id),
+        'insight_type': INSIGHT_TYPE,
+        'version': version,
+        'since': datetime.utcnow() - timedelta(seconds=current_app.config['ANALYSIS_CACHE_TTL'])
+    }).first()
+
+    if row and row.similarity >= current_app.config['ANALYSIS_CACHE_THRESHOLD']:
+        return row
+    return None
+
+
+def store(user_id, question, query_embedding, version, analysis, memory_ids, usage):
+    """Save an analysis and drop entries from older memory set versions"""
+    if not current_app.config['ANALYSIS_CACHE_ENABLED']:
+        return
+
+    AIInsight.query.filter(
+        AIInsight.user_id == user_id,
+        AIInsight.insight_type == INSIGHT_TYPE,
+        AIInsight.memory_set_version != version
+    ).delete(synchronize_session=False)
+
+    db.session.add(AIInsight(
+        user_id=user_id,
+        insight_type=INSIGHT_TYPE,
+        title=question[:255],
+        description=analysis,
+        related_memory_ids=list(memory_ids),
+        query_embedding=query_embedding,
+        memory_set_version=version,
+        details={'question': question, 'usage': usage, 'memories_analyzed': len(memory_ids)}
+    ))
+
+    # Keep only the newest entries for this version
+    stale = select(AIInsight.id).where(
+        AIInsight.user_id == user_id,
+        AIInsight.insight_type == INSIGHT_TYPE
+    ).order_by(AIInsight.created_at.desc()).offset(current_app.config['ANALYSIS_CACHE_MAX_ENTRIES'])
+    AIInsight.query.filter(AIInsight.id.in_(stale)).delete(synchronize_session=False)
+
+    db.session.commit()
@@ -0,0 +1,289 @@
+# services/clustering.py
+"""Offline theme discovery: cluster a user's memory embeddings and save each theme as an
+AIInsight (insight_type 'theme_cluster').
+
+All embeddings are loaded into one float32 matrix of unit rows, so cosine similarity is a
+matrix product. k-means is spherical (centroids renormalized each step) with k-means++
+seeding; agglomerative is centroid linkage that merges until no two clusters are more
+similar than CLUSTER_MERGE_THRESHOLD. Either way the LLM is called once per new theme for
+a title, on the few memories nearest its centroid - a theme whose members barely changed
+since the last run keeps its title without a call.
+"""
+import json
+import math
+import time
+
+import numpy as np
+from flask import current_app
+
+from models import db, AIInsight, Memory
+from services import llm, metrics
+from services.context_builder import truncate
+from services.memory_set import current_version
+
+
+INSIGHT_TYPE = 'theme_cluster'
+METHODS = ('kmeans', 'agglomerative')
+
+# Jaccard overlap with a previous theme above which its title is reused
+REUSE_TITLE_OVERLAP = 0.8
+
+TITLE_PROMPT = """These are personal memories that an embedding model grouped together as one theme.
+
+{memories}
+
+Name the theme they share. Reply with JSON only: {{"title": "<2-6 words>", "summary": "<one sentence, second person>"}}"""
+
+
+def normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def kmeans(matrix, k, restarts=4, iterations=50, seed=0):
+    """Spherical k-means with k-means++ seeding, best of `restarts` runs by total similarity
+    to the assigned centroids. Returns (labels, unit centroids)."""
+    best = None
+    for run in range(restarts):
+        labels, centroids = _kmeans_run(matrix, k, iterations, seed + run)
+        score = float(np.einsum('ij,ij->', matrix, centroids[labels]))
+        if best is None or score > best[0]:
+            best = (score, labels, centroids)
+    return best[1], best[2]
+
+
+def _kmeans_run(matrix, k, iterations, seed):
+    rng = np.random.default_rng(seed)
+    n = len(matrix)
+    k = min(k, n)
+
+    # k-means++: each next seed drawn with probability proportional to its cosine distance
+    # from the nearest seed so far
+    centroids = np.empty((k, matrix.shape[1]), dtype=matrix.dtype)
+    centroids[0] = matrix[rng.integers(n)]
+    nearest = 1 - matrix @ centroids[0]
+    for i in range(1, k):
+        weights = np.clip(nearest, 0, None).astype(np.float64)
+        total = weights.sum()
+        pick = rng.choice(n, p=weights / total) if total > 0 else rng.integers(n)
+        centroids[i] = matrix[pick]
+        nearest = np.minimum(nearest, 1 - matrix @ centroids[i])
+
+    labels = np.full(n, -1)
+    for _ in range(iterations):
+        new_labels = np.argmax(matrix @ centroids.T, axis=1)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, matrix)
+        empty = ~sums.any(axis=1)
+        if empty.any():
+            # Re-seed empty clusters on the points furthest from their centroid
+            fit = np.einsum('ij,ij->i', matrix, centroids[labels])
+            sums[empty] = matrix[np.argsort(fit)[:empty.sum()]]
+        centroids = normalize(sums)
+
+    return labels, centroids
+
+
+def agglomerative(matrix, threshold):
+    """Centroid-linkage agglomerative clustering on cosine similarity. Returns (labels, unit centroids)."""
+    n = len(matrix)
+    sums = matrix.astype(np.float64)
+    units = matrix.copy()  # unit centroid per cluster, indexed by its first member
+    active = np.ones(n, dtype=bool)
+    parent = np.arange(n)
+
+    similarity = matrix @ matrix.T
+    np.fill_diagonal(similarity, -np.inf)
+    best = similarity.argmax(axis=1)
+    best_value = similarity[np.arange(n), best]
+
+    while active.sum() > 1:
+        a = int(np.argmax(np.where(active, best_value, -np.inf)))
+        if best_value[a] < threshold:
+            break
+        b = int(best[a])
+
+        # b joins a; a's row and column become the merged centroid's similarities
+        sums[a] += sums[b]
+        parent[parent == b] = a
+        active[b] = False
+        similarity[b, :] = similarity[:, b] = -np.inf
+
+        units[a] = sums[a] / np.linalg.norm(sums[a])
+        row = np.where(active, units @ units[a], -np.inf)
+        row[a] = -np.inf
+        similarity[a, :] = row
+        similarity[:, a] = row
+
+        # Only rows whose best partner was a or b can have lost it; the rest can only gain a
+        stale = active & ((best == a) | (best == b))
+        stale[a] = True
+        for i in np.flatnonzero(stale):
+            best[i] = similarity[i].argmax()
+            best_value[i] = similarity[i, best[i]]
+        gained = active & (similarity[:, a] > best_value)
+        best[gained] = a
+        best_value[gained] = similarity[gained, a]
+        best_value[~active] = -np.inf
+
+    roots, labels = np.unique(parent, return_inverse=True)
+    return labels, units[roots]
+
+
+def cluster_count(n, granularity):
+    """k for k-means: about sqrt(n / 2), scaled by granularity and capped at CLUSTER_MAX_CLUSTERS"""
+    k = round(granularity * math.sqrt(n / 2))
+    return max(2, min(k, current_app.config['CLUSTER_MAX_CLUSTERS'], n))
+
+
+def _load(user_id):
+    rows = db.session.query(
+        Memory.id, Memory.embedding, Memory.encrypted_content, Memory.year, Memory.age, Memory.emotional_valence
+    ).filter(
+        Memory.user_id == user_id,
+        Memory.embedding.isnot(None)
+    ).order_by(Memory.id).all()
+    if not rows:
+        return rows, None
+    return rows, normalize(np.asarray([row.embedding for row in rows], dtype=np.float32))
+
+
+def _title(rows):
+    """One Claude call: a short title and summary for the memories nearest a centroid"""
+    max_tokens = current_app.config['CONTEXT_MAX_MEMORY_TOKENS']
+    memories = '\n\n---\n\n'.join(
+        f"{row.year or 'Unknown year'}: {truncate(row.encrypted_content, max_tokens)[0]}" for row in rows
+    )
+    with metrics.span('llm'):
+        response = llm.get_client().messages.create(
+            model=current_app.config['CLUSTER_TITLE_MODEL'],
+            max_tokens=200,
+            messages=[{'role': 'user', 'content': TITLE_PROMPT.format(memories=memories)}]
+        )
+    metrics.record_tokens('anthropic', input=response.usage.input_tokens, output=response.usage.output_tokens)
+
+    text = response.content[0].text.strip()
+    try:
+        parsed = json.loads(text[text.index('{'):text.rindex('}') + 1])
+        return str(parsed['title']).strip()[:255], str(parsed.get('summary') or '').strip(), response.usage
+    except (ValueError, KeyError, TypeError):
+        # Not JSON after all - use the first line as the title
+        return text.splitlines()[0].strip('"# ')[:255] or 'Untitled theme', '', response.usage
+
+
+def cluster_user(user_id, method=None, clusters=None, granularity=None, force=False):
+    """Cluster one user's memories and replace their theme insights.
+
+    Returns a summary dict, with 'skipped' set when there is nothing to do: too few embedded
+    memories, or themes already built from the current memory set version (unless force).
+    """
+    config = current_app.config
+    method = method or config['CLUSTER_METHOD']
+    version = current_version(user_id)
+
+    previous = AIInsight.query.filter_by(user_id=user_id, insight_type=INSIGHT_TYPE).all()
+    if previous and not force and all(p.memory_set_version == version for p in previous):
+        return {'user_id': str(user_id), 'skipped': 'up to date'}
+
+    rows, matrix = _load(user_id)
+    if len(rows) < config['CLUSTER_MIN_MEMORIES']:
+        return {'user_id': str(user_id), 'skipped': f'{len(rows)} embedded memories'}
+
+    started = time.perf_counter()
+    if method == 'agglomerative' and len(rows) <= config['CLUSTER_AGGLOMERATIVE_MAX']:
+        labels, centroids = agglomerative(matrix, config['CLUSTER_MERGE_THRESHOLD'])
+    else:
+        method = 'kmeans'  # agglomerative is quadratic in memory; large journals use k-means
+        k = clusters or cluster_count(len(rows), granularity or config['CLUSTER_GRANULARITY'])
+        labels, centroids = kmeans(matrix, k)
+    cluster_seconds = time.perf_counter() - started
+
+    previous_titles = [
+        ({str(mid) for mid in p.related_memory_ids or []}, p.title, p.description) for p in previous
+    ]
+
+    themes, llm_calls = [], 0
+    usage = {'input_tokens': 0, 'output_tokens': 0}
+    for label in range(len(centroids)):
+        members = np.flatnonzero(labels == label)
+        if len(members) < config['CLUSTER_MIN_SIZE']:
+            continue  # too small to call a theme
+
+        fit = matrix[members] @ centroids[label]
+        order = members[np.argsort(-fit)]  # most central first
+        member_ids = [str(rows[i].id) for i in order]
+
+        reused = next((
+            (title, description) for ids, title, description in previous_titles
+            if len(ids & set(member_ids)) / len(ids | set(member_ids)) >= REUSE_TITLE_OVERLAP
+        ), None)
+        if reused:
+            title, description = reused
+        else:
+            title, description, call_usage = _title([rows[i] for i in order[:config['CLUSTER_SAMPLE_MEMORIES']]])
+            llm_calls += 1
+            usage['input_tokens'] += call_usage.input_tokens
+            usage['output_tokens'] += call_usage.output_tokens
+
+        years = [rows[i].year for i in members if rows[i].year is not None]
+        valences = [rows[i].emotional_valence for i in members if rows[i].emotional_valence is not None]
+        themes.append(AIInsight(
+            user_id=user_id,
+            insight_type=INSIGHT_TYPE,
+            title=title,
+            description=description or f'{len(members)} memories',
+            related_memory_ids=member_ids,
+            query_embedding=centroids[label].tolist(),
+            memory_set_version=version,
+            details={
+                'method': method,
+                'size': len(members),
+                'cohesion': round(float(fit.mean()), 4),  # mean cosine similarity to the centroid
+                'year_range': [min(years), max(years)] if years else None,
+                'mean_valence': round(sum(valences) / len(valences), 2) if valences else None
+            }
+        ))
+
+    # Largest themes first
+    themes.sort(key=lambda t: -t.details['size'])
+    AIInsight.query.filter_by(user_id=user_id, insight_type=INSIGHT_TYPE).delete(synchronize_session=False)
+    db.session.add_all(themes)
+    db.session.commit()
+
+    return {
+        'user_id': str(user_id),
+        'method': method,
+        'memories': len(rows),
+        'clusters': len(centroids),
+        'themes': len(themes),
+        'llm_calls': llm_calls,
+        'usage': usage,
+        'cluster_ms': round(cluster_seconds * 1000, 1)
+    }
+
+
+def cluster_all(method=None, clusters=None, granularity=None, force=False, echo=print):
+    """Run cluster_user for every user with enough embedded memories"""
+    user_ids = [row.user_id for row in db.session.query(Memory.user_id).filter(
+        Memory.embedding.isnot(None)
+    ).group_by(Memory.user_id).having(
+        db.func.count() >= current_app.config['CLUSTER_MIN_MEMORIES']
+    ).all()]
+
+    for i, user_id in enumerate(user_ids):
+        try:
+            result = cluster_user(user_id, method=method, clusters=clusters, granularity=granularity, force=force)
+        except Exception as e:
+            db.session.rollback()
+            echo(f"  {i + 1}/{len(user_ids)} {user_id}: failed - {e}")
+            continue
+        if result.get('skipped'):
+            echo(f"  {i + 1}/{len(user_ids)} {user_id}: skipped ({result['skipped']})")
+        else:
+            echo(f"  {i + 1}/{len(user_ids)} {user_id}: {result['themes']} themes from {result['memories']} memories "
+                 f"({result['method']}, {result['llm_calls']} titles generated)")
+    return len(user_ids)
@@ -0,0 +1,117 @@
+# services/context_builder.py
+from collections import namedtuple
+
+import numpy as np
+from flask import current_app
+
+from services.retrieval import search_similar
+
+
+# Rough English average for Claude's tokenizer; only used to pack the budget - the exact
+# count comes back in the response usage
+CHARS_PER_TOKEN = 4
+
+MEMORY_SEPARATOR = "\n\n---\n\n"
+
+AnalysisContext = namedtuple('AnalysisContext', 'results texts stats')
+
+
+def estimate_tokens(text):
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def truncate(content, max_tokens):
+    """Cut content to about max_tokens, on a word boundary"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(content) <= max_chars:
+        return content, False
+    words = content[:max_chars].rsplit(None, 1)
+    cut = words[0] if words else content[:max_chars]  # nothing but whitespace - hard cut
+    return cut + ' [...]', True
+
+
+def format_memory(row, content):
+    similarity_pct = int(row.similarity * 100)
+    return f"""Memory from {row.year or 'unknown year'} (Age {row.age or 'unknown'}):
+{content}
+
+Metadata: Confidence {row.confidence_level}/10, Emotional valence {row.emotional_valence}, Relevance {similarity_pct}%"""
+
+
+def mmr_order(embeddings, similarities, lam):
+    """Indexes in maximal marginal relevance order.
+
+    Each step picks the candidate maximising lam * relevance - (1 - lam) * (max similarity to
+    anything already picked), so near-duplicate memories stop crowding out other topics.
+    """
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    pairwise = vectors @ vectors.T
+    relevance = np.asarray(similarities, dtype=np.float32)
+
+    order = []
+    redundancy = np.zeros(len(relevance), dtype=np.float32)
+    remaining = np.ones(len(relevance), dtype=bool)
+    for _ in range(len(relevance)):
+        scores = np.where(remaining, lam * relevance - (1 - lam) * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        order.append(best)
+        remaining[best] = False
+        redundancy = np.maximum(redundancy, pairwise[best])
+    return order
+
+
+def build_context(user_id, query_embedding, token_budget=None):
+    """Pick and format the memories for an analysis prompt within a token budget.
+
+    Over-fetches CONTEXT_CANDIDATES neighbours (with their stored embeddings), drops those below
+    CONTEXT_MIN_SIMILARITY (the best match is always kept), orders the rest by MMR and packs them
+    until CONTEXT_MAX_MEMORIES or the budget is reached, truncating long ones. The chosen memories
+    are returned most similar first.
+    """
+    config = current_app.config
+    token_budget = token_budget or config['CONTEXT_TOKEN_BUDGET']
+
+    candidates = search_similar(user_id, query_embedding, limit=config['CONTEXT_CANDIDATES'], include_embedding=True)
+    stats = {
+        'candidates': len(candidates),
+        'below_similarity': 0,
+        'over_budget': 0,
+        'truncated': 0,
+        'selected': 0,
+        'token_budget': token_budget,
+        'estimated_tokens': 0
+    }
+    if not candidates:
+        return AnalysisContext([], [], stats)
+
+    relevant = [row for i, row in enumerate(candidates) if i == 0 or row.similarity >= config['CONTEXT_MIN_SIMILARITY']]
+    stats['below_similarity'] = len(candidates) - len(relevant)
+
+    order = mmr_order(
+        [row.embedding for row in relevant],
+        [row.similarity for row in relevant],
+        config['CONTEXT_MMR_LAMBDA']
+    )
+
+    picked, used = [], 0
+    separator_tokens = estimate_tokens(MEMORY_SEPARATOR)
+    for i in order:
+        if len(picked) >= config['CONTEXT_MAX_MEMORIES']:
+            break
+        row = relevant[i]
+        content, was_truncated = truncate(row.encrypted_content, config['CONTEXT_MAX_MEMORY_TOKENS'])
+        memory_text = format_memory(row, content)
+        cost = estimate_tokens(memory_text) + (separator_tokens if picked else 0)
+        if used + cost > token_budget and picked:
+            stats['over_budget'] += 1
+            continue  # a shorter memory further down may still fit
+        picked.append((i, memory_text))
+        used += cost
+        stats['truncated'] += was_truncated
+
+    picked.sort(key=lambda item: item[0])  # back to similarity order
+    stats['selected'] = len(picked)
+    stats['estimated_tokens'] = used
+
+    return AnalysisContext([relevant[i] for i, _ in picked], [memory_text for _, memory_text in picked], stats)
@@ -0,0 +1,155 @@
+# services/embedding_backfill.py
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from sqlalchemy import select, text, and_, or_, true
+
+from models import db, Memory, JobCheckpoint
+from services.embedding_service import EMBEDDING_MODEL, get_embeddings_batch
+from services.memory_set import bump_version_for_memories
+
+
+MODES = ('missing', 'stale', 'all')
+
+
+def checkpoint_name(mode):
+    return f'embedding-backfill:{mode}:{EMBEDDING_MODEL}'
+
+
+def _selection(mode):
+    """WHERE clause for the rows a backfill mode should (re-)embed"""
+    # Blank memories keep a NULL embedding for good - selecting them again would never converge
+    not_empty = Memory.embedding_status.is_distinct_from('empty')
+    if mode == 'missing':
+        return and_(Memory.embedding.is_(None), not_empty)
+    if mode == 'stale':
+        # Missing vectors plus anything embedded by a different model
+        return and_(or_(Memory.embedding.is_(None), Memory.embedding_model.is_distinct_from(EMBEDDING_MODEL)), not_empty)
+    return true()
+
+
+def _load_checkpoint(name):
+    checkpoint = db.session.get(JobCheckpoint, name)
+    return checkpoint.position if checkpoint else None
+
+
+def _save_checkpoint(name, position, details):
+    checkpoint = db.session.get(JobCheckpoint, name) or JobCheckpoint(name=name)
+    checkpoint.position = position
+    checkpoint.details = details
+    db.session.add(checkpoint)
+    db.session.commit()
+
+
+def _embed_batch(app, batch):
+    """Embed one batch and write the vectors on its own connection. Runs on a pool thread."""
+    with app.app_context():
+        to_embed = [(mid, content) for mid, content in batch if content and content.strip()]
+        empty = [mid for mid, content in batch if not (content and content.strip())]
+
+        vectors = get_embeddings_batch([content for _, content in to_embed]) if to_embed else []
+
+        with db.engine.begin() as conn:
+            written = []
+            if to_embed:
+                # Skip rows edited since we read them - their own embedding job covers the new content
+                written = [str(row.id) for row in conn.execute(text("""
+                    UPDATE memories m
+                    SET embedding = CAST(v.embedding AS vector), embedding_status = 'ready', embedding_model = :model
+                    FROM unnest(CAST(:ids AS uuid[]), CAST(:contents AS text[]), CAST(:embeddings AS text[])) AS v(id, content, embedding)
+                    WHERE m.id = v.id AND m.encrypted_content = v.content
+                    RETURNING m.id
+                """), {
+                    'ids': [mid for mid, _ in to_embed],
+                    'contents': [content for _, content in to_embed],
+                    'embeddings': ['[' + ','.join(map(str, vector)) + ']' for vector in vectors],
+                    'model': EMBEDDING_MODEL
+                })]
+                bump_version_for_memories(written, connection=conn)
+            if empty:
+                written += [str(row.id) for row in conn.execute(text("""
+                    UPDATE memories SET embedding_status = 'empty'
+                    WHERE id = ANY(CAST(:ids AS uuid[])) AND coalesce(btrim(encrypted_content), '') = ''
+                    RETURNING id
+                """), {'ids': empty})]
+            if written:
+                # Queued jobs for these rows would only embed the same content again
+                conn.execute(text("""
+                    DELETE FROM embedding_jobs WHERE memory_id = ANY(CAST(:ids AS uuid[]))
+                """), {'ids': written})
+
+        return len(batch)
+
+
+def run_backfill(app, mode='missing', batch_size=64, concurrency=4, restart=False, limit=None, echo=print):
+    """Stream matching memories in id order and embed them in parallel batches.
+
+    Progress is checkpointed as the highest id below which every batch has been written,
+    so a crashed run resumes without redoing (or skipping) work. Returns the number of rows written.
+    """
+    name = checkpoint_name(mode)
+    after_id = None if restart else _load_checkpoint(name)
+    if after_id:
+        echo(f"Resuming {mode} backfill after {after_id}")
+
+    query = select(Memory.id, Memory.encrypted_content).where(_selection(mode)).order_by(Memory.id)
+    if after_id:
+        query = query.where(Memory.id > uuid.UUID(after_id))
+    if limit:
+        query = query.limit(limit)
+
+    done = 0
+    started = time.monotonic()
+    last_report = started
+    in_flight = {}   # future -> (sequence, last id in batch)
+    finished = {}    # sequence -> last id, for batches that completed out of order
+    next_to_commit = 0
+
+    def advance_checkpoint():
+        nonlocal next_to_commit
+        position = None
+        while next_to_commit in finished:
+            position = finished.pop(next_to_commit)
+            next_to_commit += 1
+        if position:
+            _save_checkpoint(name, position, {'rows': done, 'model': EMBEDDING_MODEL})
+
+    def collect(return_when):
+        nonlocal done
+        completed, _ = wait(in_flight, return_when=return_when)
+        for future in completed:
+            sequence, last_id = in_flight.pop(future)
+            done += future.result()  # re-raises: stop here and resume from the checkpoint later
+            finished[sequence] = last_id
+        advance_checkpoint()
+
+    # Server-side cursor on a dedicated connection; writes happen on pool connections
+    with db.engine.connect() as conn, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(query)
+
+        sequence = 0
+        for partition in result.partitions(batch_size):
+            batch = [(str(row.id), row.encrypted_content) for row in partition]
+
+            # Bounded concurrency: never more than `concurrency` batches in flight
+            while len(in_flight) >= concurrency:
+                collect(FIRST_COMPLETED)
+
+            in_flight[pool.submit(_embed_batch, app, batch)] = (sequence, batch[-1][0])
+            sequence += 1
+
+            now = time.monotonic()
+            if now - last_report >= 10:
+                echo(f"{done} rows embedded ({done / (now - started):.1f} rows/s)")
+                last_report = now
+
+        while in_flight:
+            collect(FIRST_COMPLETED)
+
+    elapsed = time.monotonic() - started
+    echo(f"Backfill complete: {done} rows in {elapsed:.1f}s ({done / elapsed if elapsed else 0:.1f} rows/s)")
+
+    # A finished run starts from scratch next time
+    _save_checkpoint(name, None, {'rows': done, 'model': EMBEDDING_MODEL, 'completed': True})
+    return done
@@ -0,0 +1,255 @@
+# services/embedding_jobs.py
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+
+from models import db, Memory, EmbeddingJob
+from services.embedding_service import EMBEDDING_MODEL, get_embedding, get_embeddings_batch
+from services.memory_set import bump_version_for_memories
+from services import related_memories, vector_index
+
+
+_wakeup = threading.Event()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def schedule_embedding(memory):
+    """(Re)generate the memory's embedding - inline, or via the job queue when EMBEDDING_ASYNC is on.
+
+    Runs inside the caller's transaction so the queued job commits (or rolls back) with the write.
+    Call notify_worker() after the commit.
+    """
+    if not current_app.config['EMBEDDING_ASYNC']:
+        memory.embedding = get_embedding(memory.encrypted_content)
+        memory.embedding_status = 'ready' if memory.embedding is not None else 'empty'
+        memory.embedding_model = EMBEDDING_MODEL if memory.embedding is not None else None
+        return
+
+    memory.embedding = None
+    memory.embedding_status = 'pending'
+    memory.embedding_model = None
+    db.session.flush()  # assigns memory.id for new rows
+
+    enqueue_embeddings([memory.id])
+
+
+def enqueue_embeddings(memory_ids):
+    """Queue (or reset) embedding jobs for already-flushed memories in the current transaction"""
+    if not memory_ids:
+        return
+
+    now = datetime.utcnow()
+    stmt = insert(EmbeddingJob).values([{
+        'memory_id': memory_id,
+        'status': 'pending',
+        'attempts': 0,
+        'available_at': now
+    } for memory_id in memory_ids])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['memory_id'],
+        set_={'status': 'pending', 'attempts': 0, 'last_error': None, 'available_at': now, 'updated_at': now}
+    )
+    db.session.execute(stmt)
+
+
+def notify_worker():
+    """Wake the in-process worker so freshly committed jobs don't wait for the next poll"""
+    _wakeup.set()
+
+
+def claim_jobs(limit):
+    """Lock up to `limit` runnable jobs. Jobs stuck in 'processing' past the lock timeout are reclaimed."""
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=current_app.config['EMBEDDING_JOB_LOCK_TIMEOUT'])
+
+    rows = db.session.execute(text("""
+        UPDATE embedding_jobs
+        SET status = 'processing', locked_at = :now, attempts = attempts + 1, updated_at = :now
+        WHERE id IN (
+            SELECT id FROM embedding_jobs
+            WHERE (status = 'pending' AND available_at <= :now)
+                OR (status = 'processing' AND locked_at < :stale_before)
+            ORDER BY available_at
+            LIMIT :limit
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, memory_id, attempts
+    """), {'now': now, 'stale_before': stale_before, 'limit': limit}).fetchall()
+
+    db.session.commit()
+    return rows
+
+
+def process_pending_jobs(batch_size=None):
+    """Claim one batch of jobs, embed them with a single batched call and store the vectors.
+    If the batched call fails, each text is retried on its own and only the failing jobs are
+    put back. Returns the number of jobs claimed."""
+    jobs = claim_jobs(batch_size or current_app.config['EMBEDDING_JOB_BATCH_SIZE'])
+    if not jobs:
+        return 0
+
+    memory_ids = [str(job.memory_id) for job in jobs]
+    contents, owners = {}, {}
+    for row in db.session.execute(text("""
+        SELECT id, user_id, encrypted_content FROM memories WHERE id = ANY(CAST(:ids AS uuid[]))
+    """), {'ids': memory_ids}):
+        contents[str(row.id)] = row.encrypted_content
+        owners[str(row.id)] = str(row.user_id)
+
+    # Deleted memories cascade their jobs away; blank content has nothing to embed
+    to_embed = [(mid, contents[mid]) for mid in memory_ids if contents.get(mid, '').strip()]
+    empty = [mid for mid in memory_ids if mid in contents and not contents[mid].strip()]
+
+    errors = {}
+    try:
+        vectors = get_embeddings_batch([content for _, content in to_embed]) if to_embed else []
+    except Exception as e:
+        db.session.rollback()
+        print(f"Embedding batch of {len(to_embed)} failed: {e}")
+        if len(to_embed) > 1:
+            # One bad text fails the whole request - retry one by one so only its job spends an attempt
+            to_embed, vectors, errors = _embed_individually(to_embed)
+        else:
+            to_embed, vectors, errors = [], [], {to_embed[0][0]: e}
+
+    written, versions = set(), {}
+    if to_embed:
+        # Only write the vector if the content is still what we embedded; a newer edit re-queued the job
+        written = {str(row.id) for row in db.session.execute(text("""
+            UPDATE memories m
+            SET embedding = CAST(v.embedding AS vector), embedding_status = 'ready', embedding_model = :model
+            FROM unnest(CAST(:ids AS uuid[]), CAST(:contents AS text[]), CAST(:embeddings AS text[])) AS v(id, content, embedding)
+            WHERE m.id = v.id AND m.encrypted_content = v.content
+            RETURNING m.id
+        """), {
+            'ids': [mid for mid, _ in to_embed],
+            'contents': [content for _, content in to_embed],
+            'embeddings': ['[' + ','.join(map(str, vector)) + ']' for vector in vectors],
+            'model': EMBEDDING_MODEL
+        })}
+        versions = bump_version_for_memories(written)
+        related_memories.update_neighbors(sorted(written))
+
+    if empty:
+        db.session.execute(text("""
+            UPDATE memories SET embedding_status = 'empty' WHERE id = ANY(CAST(:ids AS uuid[]))
+        """), {'ids': empty})
+
+    # A job re-queued by an edit while we worked is back to 'pending' and survives this delete
+    db.session.execute(text("""
+        DELETE FROM embedding_jobs WHERE id = ANY(CAST(:ids AS uuid[])) AND status = 'processing'
+    """), {'ids': [str(job.id) for job in jobs if str(job.memory_id) not in errors]})
+
+    db.session.commit()
+
+    for job in jobs:
+        if str(job.memory_id) in errors:
+            _record_failure([job], errors[str(job.memory_id)])
+
+    # Keep any cached in-process indexes current without a reload
+    for user_id, version in versions.items():
+        vector_index.apply_change(user_id, version, upserts={
+            mid: vector for (mid, _), vector in zip(to_embed, vectors)
+            if mid in written and owners[mid] == user_id
+        })
+
+    return len(jobs)
+
+
+def _embed_individually(items):
+    """Embed (memory id, content) pairs one request each. Returns (embedded items, their vectors,
+    {memory id: error} for the rest)."""
+    embedded, vectors, errors = [], [], {}
+    for mid, content in items:
+        try:
+            vectors.append(get_embeddings_batch([content])[0])
+            embedded.append((mid, content))
+        except Exception as e:
+            print(f"Embedding memory {mid} failed: {e}")
+            errors[mid] = e
+    return embedded, vectors, errors
+
+
+def _record_failure(jobs, error):
+    """Put failed jobs back with exponential backoff, or give up after EMBEDDING_JOB_MAX_ATTEMPTS"""
+    max_attempts = current_app.config['EMBEDDING_JOB_MAX_ATTEMPTS']
+    now = datetime.utcnow()
+
+    retry = [job for job in jobs if job.attempts < max_attempts]
+    failed = [str(job.memory_id) for job in jobs if job.attempts >= max_attempts]
+
+    if retry:
+        db.session.execute(text("""
+            UPDATE embedding_jobs
+            SET status = 'pending', last_error = :error, available_at = :available_at, updated_at = :now
+            WHERE id = CAST(:id AS uuid) AND status = 'processing'
+        """), [{
+            'id': str(job.id),
+            'error': str(error),
+            'available_at': now + timedelta(seconds=min(5 * 2 ** job.attempts, 600)),
+            'now': now
+        } for job in retry])
+
+    if failed:
+        db.session.execute(text("""
+            UPDATE embedding_jobs SET status = 'failed', last_error = :error, updated_at = :now
+            WHERE memory_id = ANY(CAST(:ids AS uuid[]))
+        """), {'ids': failed, 'error': str(error), 'now': now})
+        db.session.execute(text("""
+            UPDATE memories SET embedding_status = 'failed' WHERE id = ANY(CAST(:ids AS uuid[]))
+        """), {'ids': failed})
+
+    db.session.commit()
+
+
+def wait_for_embeddings(memory_ids, timeout=0):
+    """Poll until none of the memories are pending (or the timeout passes). Returns {id: status}."""
+    deadline = time.monotonic() + timeout
+
+    while True:
+        statuses = {
+            str(mid): status
+            for mid, status in db.session.query(Memory.id, Memory.embedding_status)
+                .filter(Memory.id.in_(memory_ids)).all()
+        }
+        if 'pending' not in statuses.values() or time.monotonic() >= deadline:
+            return statuses
+
+        db.session.rollback()  # don't hold a transaction open while sleeping
+        time.sleep(0.25)
+
+
+def run_worker(app, stop_event=None):
+    """Drain the job queue until stop_event is set, sleeping between polls when idle"""
+    poll_interval = app.config['EMBEDDING_JOB_POLL_INTERVAL']
+
+    while not (stop_event and stop_event.is_set()):
+        with app.app_context():
+            try:
+                processed = process_pending_jobs()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Embedding worker error: {e}")
+                processed = 0
+
+        if not processed:
+            _wakeup.wait(poll_interval)
+            _wakeup.clear()
+
+
+def start_embedding_worker(app):
+    """Start the in-process worker thread once per process"""
+    global _worker
+
+    if _worker is not None and _worker.is_alive():
+        return
+
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=run_worker, args=(app,), name='embedding-worker', daemon=True)
+            _worker.start()
@@ -0,0 +1,214 @@
+# services/embedding_providers.py
+"""Embedding backends, selected with EMBEDDING_PROVIDER.
+
+Every provider reports the `model_id` stored in memories.embedding_model and cache keys
+(so switching provider never mixes vectors) and the `dimension` it produces, which has to
+match EMBEDDING_DIMENSION - the size of the Vector columns.
+"""
+import hashlib
+import math
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+
+EmbedResult = namedtuple('EmbedResult', 'embeddings total_tokens')
+
+
+def local_model_id(path):
+    return f"local:{os.path.basename(os.path.normpath(path))}"
+
+
+class EmbeddingProvider:
+    name = None
+    model_id = None
+    dimension = None
+
+    def embed(self, texts, input_type):
+        """Embed a batch of texts. input_type is 'document' or 'query'. Returns an EmbedResult."""
+        raise NotImplementedError
+
+    def is_retryable(self, error):
+        """Whether an embed() failure is a rate limit / overload worth backing off and retrying"""
+        return False
+
+    def check_dimension(self, expected):
+        if self.dimension != expected:
+            raise ValueError(
+                f"Embedding provider '{self.name}' ({self.model_id}) produces {self.dimension}-dimension vectors "
+                f"but EMBEDDING_DIMENSION is {expected} - the vector columns would reject them"
+            )
+
+
+class VoyageProvider(EmbeddingProvider):
+    name = 'voyage'
+
+    # Output sizes of the Voyage models this app has used; others need EMBEDDING_DIMENSION to be right
+    DIMENSIONS = {
+        'voyage-large-2-instruct': 1024,
+        'voyage-large-2': 1536,
+        'voyage-3': 1024,
+        'voyage-3-large': 1024,
+        'voyage-3-lite': 512,
+    }
+
+    def __init__(self, model, api_key=None, base_url=None, dimension=None):
+        import voyageai
+        from voyageai import error
+
+        # base_url can point at a local fake server for testing (e.g. bench/fake_providers.py)
+        if base_url:
+            voyageai.api_base = base_url
+        self.client = voyageai.Client(api_key=api_key)
+        self.model_id = model
+        self.dimension = self.DIMENSIONS.get(model, dimension)
+        self.retryable = tuple(
+            getattr(error, name) for name in ('RateLimitError', 'ServiceUnavailableError', 'TryAgain')
+            if hasattr(error, name)
+        )
+
+    def embed(self, texts, input_type):
+        result = self.client.embed(texts, model=self.model_id, input_type=input_type)
+        return EmbedResult(result.embeddings, getattr(result, 'total_tokens', 0))
+
+    def is_retryable(self, error):
+        return isinstance(error, self.retryable)
+
+
+class LocalProvider(EmbeddingProvider):
+    """A sentence-embedding model run on this machine's CPU.
+
+    `path` is either an ONNX export (model.onnx + tokenizer.json, run with onnxruntime) or
+    a sentence-transformers model directory. Batches are split across a thread pool; both
+    runtimes release the GIL during inference, so threads use separate cores.
+    """
+    name = 'local'
+
+    def __init__(self, path, threads=None, batch_size=32, query_prefix='', document_prefix='', max_length=512):
+        self.path = path
+        self.batch_size = batch_size
+        self.prefixes = {'query': query_prefix, 'document': document_prefix}
+        self.max_length = max_length
+        self.pool = ThreadPoolExecutor(max_workers=threads or os.cpu_count(), thread_name_prefix='local-embed')
+        self.model_id = local_model_id(path)
+
+        if os.path.exists(os.path.join(path, 'model.onnx')):
+            self._load_onnx()
+        else:
+            self._load_sentence_transformers()
+
+    def _load_onnx(self):
+        import numpy as np
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = 1  # parallelism comes from the pool, one batch per thread
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(self.path, 'model.onnx'), options, providers=['CPUExecutionProvider']
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(os.path.join(self.path, 'tokenizer.json'))
+        self.tokenizer.enable_truncation(self.max_length)
+        self.tokenizer.enable_padding()
+        self._np = np
+        self._run = self._run_onnx
+        self.dimension = len(self._run_onnx(['dimension probe'])[0])
+
+    def _run_onnx(self, texts):
+        np = self._np
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+
+        feeds = {'input_ids': input_ids, 'attention_mask': attention_mask}
+        if 'token_type_ids' in self.input_names:
+            feeds['token_type_ids'] = np.zeros_like(input_ids)
+        hidden = self.session.run(None, feeds)[0]
+
+        # Mean pooling over real tokens, then unit length
+        mask = attention_mask[..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+        return pooled.tolist()
+
+    def _load_sentence_transformers(self):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(self.path, device='cpu')
+        self.model.max_seq_length = self.max_length
+        self._run = lambda texts: self.model.encode(texts, batch_size=len(texts), normalize_embeddings=True).tolist()
+        self.dimension = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts, input_type):
+        prefix = self.prefixes.get(input_type, '')
+        texts = [prefix + t for t in texts]
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+
+        embeddings = []
+        for batch in self.pool.map(self._run, batches):
+            embeddings.extend(batch)
+        return EmbedResult(embeddings, sum(len(t) // 4 + 1 for t in texts))
+
+
+class HashingProvider(EmbeddingProvider):
+    """Deterministic bag-of-words feature hashing - no model, no network. For tests and
+    local development: texts sharing words are similar, nothing more."""
+    name = 'hashing'
+
+    def __init__(self, dimension):
+        self.dimension = dimension
+        self.model_id = f'hashing-{dimension}'
+
+    def _vector(self, text):
+        vector = [0.0] * self.dimension
+        for word in text.lower().split():
+            digest = hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], 'little') % self.dimension
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector))
+        if not norm:
+            vector[0], norm = 1.0, 1.0
+        return [v / norm for v in vector]
+
+    def embed(self, texts, input_type):
+        return EmbedResult([self._vector(t) for t in texts], sum(len(t.split()) for t in texts))
+
+
+def provider_model_id(config):
+    """The model_id create_provider(config) will report, known without importing any SDK or model"""
+    name = config.EMBEDDING_PROVIDER
+    if name == 'local' and config.EMBEDDING_LOCAL_MODEL_PATH:
+        return local_model_id(config.EMBEDDING_LOCAL_MODEL_PATH)
+    if name == 'hashing':
+        return f'hashing-{config.EMBEDDING_DIMENSION}'
+    return config.EMBEDDING_MODEL
+
+
+def create_provider(config):
+    """Build the provider named by EMBEDDING_PROVIDER and check its dimension"""
+    name = config.EMBEDDING_PROVIDER
+    if name == 'voyage':
+        provider = VoyageProvider(
+            config.EMBEDDING_MODEL,
+            api_key=os.getenv('VOYAGE_API_KEY'),
+            base_url=os.getenv('VOYAGE_BASE_URL'),
+            dimension=config.EMBEDDING_DIMENSION
+        )
+    elif name == 'local':
+        if not config.EMBEDDING_LOCAL_MODEL_PATH:
+            raise ValueError("EMBEDDING_PROVIDER=local needs EMBEDDING_LOCAL_MODEL_PATH")
+        provider = LocalProvider(
+            config.EMBEDDING_LOCAL_MODEL_PATH,
+            threads=config.EMBEDDING_LOCAL_THREADS,
+            batch_size=config.EMBEDDING_LOCAL_BATCH_SIZE,
+            query_prefix=config.EMBEDDING_LOCAL_QUERY_PREFIX,
+            document_prefix=config.EMBEDDING_LOCAL_DOCUMENT_PREFIX
+        )
+    elif name == 'hashing':
+        provider = HashingProvider(config.EMBEDDING_DIMENSION)
+    else:
+        raise ValueError(f"Unknown EMBEDDING_PROVIDER '{name}' (voyage, local or hashing)")
+
+    provider.check_dimension(config.EMBEDDING_DIMENSION)
+    return provider
@@ -1,47 +1,520 @@
-import voyageai
-import os
+import hashlib
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from flask import has_app_context
+from sqlalchemy import text as sql_text
+
+from config import Config
+from models import db
+from services import metrics
+from services.embedding_providers import create_provider, provider_model_id
+
+# What memories.embedding_model and the cache keys record - differs per provider
+EMBEDDING_MODEL = provider_model_id(Config)
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_provider():
+    """The configured embedding provider, built on first use so the SDK import and client
+    (or local model load) stay out of worker boot and CLI commands that never embed"""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = create_provider(Config)
+    return _provider
+
+
+class EmbeddingCache:
+    """Two-tier embedding cache: in-process LRU in front of the embedding_cache table.
+
+    Entries are keyed on (model, input_type, sha256(text)), so a model change never
+    returns stale vectors - invalidate() just reclaims the space.
+    """
+
+    PRUNE_EVERY = 500  # persistent inserts between size-cap checks
+
+    def __init__(self, max_size, max_rows):
+        self.max_size = max_size
+        self.max_rows = max_rows
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._inserts_since_prune = 0
+        self.stats = {
+            'memory_hits': 0,
+            'db_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'db_errors': 0
+        }
+
+    @staticmethod
+    def make_key(model, input_type, text):
+        return (model, input_type, hashlib.sha256(text.encode('utf-8')).hexdigest())
+
+    def get_many(self, keys):
+        """Return {key: embedding} for every key found in either tier"""
+        found = {}
+        missing = []
+
+        with self._lock:
+            for key in keys:
+                if key in self._lru:
+                    self._lru.move_to_end(key)
+                    found[key] = self._lru[key]
+                    self.stats['memory_hits'] += 1
+                else:
+                    missing.append(key)
+
+        if missing:
+            for key, embedding in self._db_lookup(missing).items():
+                found[key] = embedding
+                self._remember(key, embedding)
+                self.stats['db_hits'] += 1
+
+        self.stats['misses'] += len(set(keys) - set(found))
+        return found
+
+    def put_many(self, entries):
+        """Store {key: embedding} in both tiers"""
+        for key, embedding in entries.items():
+            self._remember(key, embedding)
+        self._db_store(entries)
+
+    def invalidate(self, model=None):
+        """Drop entries for `model`, or for every model except the configured one"""
+        def is_stale(key_model):
+            return key_model == model if model else key_model != EMBEDDING_MODEL
+
+        with self._lock:
+            for key in [k for k in self._lru if is_stale(k[0])]:
+                del self._lru[key]
+
+        if model:
+            sql = sql_text("DELETE FROM embedding_cache WHERE model = :model")
+            params = {'model': model}
+        else:
+            sql = sql_text("DELETE FROM embedding_cache WHERE model <> :model")
+            params = {'model': EMBEDDING_MODEL}
+
+        with db.engine.begin() as conn:
+            return conn.execute(sql, params).rowcount
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats, memory_size=len(self._lru), max_size=self.max_size)
+        lookups = stats['memory_hits'] + stats['db_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['db_hits']) / lookups, 3) if lookups else 0.0
+        return stats
+
+    def _remember(self, key, embedding):
+        with self._lock:
+            self._lru[key] = embedding
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_size:
+                self._lru.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def _db_lookup(self, keys):
+        # The persistent tier needs an app context (for the engine); skip it otherwise
+        if not has_app_context():
+            return {}
+
+        by_group = {}
+        for model, input_type, content_hash in keys:
+            by_group.setdefault((model, input_type), []).append(content_hash)
+
+        found = {}
+        try:
+            with db.engine.connect() as conn:
+                for (model, input_type), hashes in by_group.items():
+                    rows = conn.execute(sql_text("""
+                        SELECT content_hash, embedding::text AS embedding
+                        FROM embedding_cache
+                        WHERE model = :model
+                            AND input_type = :input_type
+                            AND content_hash = ANY(:hashes)
+                    """), {'model': model, 'input_type': input_type, 'hashes': hashes})
+                    for row in rows:
+                        found[(model, input_type, row.content_hash)] = _parse_vector(row.embedding)
+        except Exception as e:
+            self.stats['db_errors'] += 1
+            print(f"Embedding cache lookup failed: {e}")
+
+        return found
+
+    def _db_store(self, entries):
+        if not entries or not has_app_context():
+            return
+
+        rows = [{
+            'model': model,
+            'input_type': input_type,
+            'content_hash': content_hash,
+            'embedding': '[' + ','.join(map(str, embedding)) + ']'
+        } for (model, input_type, content_hash), embedding in entries.items()]
+
+        try:
+            # Separate connection so cache writes never join (or roll back with) the request transaction
+            with db.engine.begin() as conn:
+                conn.execute(sql_text("""
+                    INSERT INTO embedding_cache (model, input_type, content_hash, embedding, created_at)
+                    VALUES (:model, :input_type, :content_hash, CAST(:embedding AS vector), now())
+                    ON CONFLICT DO NOTHING
+                """), rows)
+
+                self._inserts_since_prune += len(rows)
+                if self._inserts_since_prune >= self.PRUNE_EVERY:
+                    self._inserts_since_prune = 0
+                    self._db_prune(conn)
+        except Exception as e:
+            self.stats['db_errors'] += 1
+            print(f"Embedding cache store failed: {e}")
+
+    def _db_prune(self, conn):
+        """Evict the oldest persistent entries once the table exceeds max_rows"""
+        result = conn.execute(sql_text("""
+            DELETE FROM embedding_cache
+            WHERE created_at < (
+                SELECT created_at FROM embedding_cache
+                ORDER BY created_at DESC
+                OFFSET :max_rows LIMIT 1
+            )
+        """), {'max_rows': self.max_rows})
+        self.stats['evictions'] += result.rowcount
+
+
+def _parse_vector(value):
+    return [float(x) for x in value.strip('[]').split(',')]
+
+
+cache = EmbeddingCache(Config.EMBEDDING_CACHE_SIZE, Config.EMBEDDING_CACHE_MAX_ROWS)
+
+
+class TokenBucket:
+    """Pacing for a per-minute provider limit. take() reserves capacity and sleeps off any
+    debt, so concurrent senders queue up in order instead of all retrying at once."""
+
+    BURST_SECONDS = 10  # capacity that can be spent at once after an idle period
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60
+        self.capacity = self.rate * self.BURST_SECONDS
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, amount):
+        amount = min(amount, self.capacity)  # an oversized request waits for a full bucket, not forever
+        with self._lock:
+            now = time.monotonic()
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+            self.updated = now
+            self.level -= amount
+            wait = -self.level / self.rate if self.level < 0 else 0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class EmbeddingDispatcher:
+    """Shares provider requests between concurrent callers.
+
+    Texts submitted within EMBEDDING_DISPATCH_WINDOW_MS of each other go out as one batched
+    request (per input_type), a text that is already pending or in flight is attached to that
+    request instead of being sent again, and every request passes the request/token buckets.
+    Rate-limit errors pause all senders with exponential backoff before retrying. Callers
+    block on futures, so their signatures stay synchronous.
+    """
+
+    BACKOFF_MAX = 30.0  # seconds
+
+    def __init__(self, get_provider, window, concurrency, requests_per_minute, tokens_per_minute, max_retries, backoff_base, timeout):
+        self.get_provider = get_provider
+        self.window = window
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.concurrency = concurrency
+        self._pending = {}  # key -> (text, input_type), waiting for the next batch
+        self._inflight = {}  # key -> Future, from submission until the vector arrives
+        self._cond = threading.Condition()
+        self._resume_at = 0.0  # monotonic time before which nobody sends (rate-limit backoff)
+        self._thread = None
+        self._pool = None
+        self.stats = {
+            'calls': 0,
+            'inputs': 0,
+            'coalesced': 0,
+            'requests': 0,
+            'rate_limited': 0,
+            'paced_seconds': 0.0,
+            'errors': 0
+        }
+
+    def embed(self, items, input_type):
+        """items is {cache key: text}; blocks until each has a vector and returns {key: embedding}"""
+        futures = {}
+        with self._cond:
+            self._ensure_started()
+            for key, text in items.items():
+                future = self._inflight.get(key)
+                if future is None:
+                    future = self._inflight[key] = Future()
+                    self._pending[key] = (text, input_type)
+                    self.stats['inputs'] += 1
+                else:
+                    self.stats['coalesced'] += 1
+                futures[key] = future
+            self.stats['calls'] += 1
+            self._cond.notify_all()
+
+        deadline = time.monotonic() + self.timeout
+        try:
+            return {key: future.result(timeout=max(0.0, deadline - time.monotonic())) for key, future in futures.items()}
+        except FutureTimeoutError:
+            # Stop handing the stuck futures to new callers; a late result is dropped in _resolve
+            error = TimeoutError(f"No embedding within {self.timeout:.0f}s")
+            with self._cond:
+                for key, future in futures.items():
+                    if self._inflight.get(key) is future:
+                        del self._inflight[key]
+                        self._pending.pop(key, None)
+            for future in futures.values():
+                self._settle(future, error=error)
+            raise error
+
+    def get_stats(self):
+        with self._cond:
+            stats = dict(self.stats, pending=len(self._pending), in_flight=len(self._inflight))
+        stats['inputs_per_request'] = round(stats['inputs'] / stats['requests'], 2) if stats['requests'] else 0.0
+        return stats
+
+    def _ensure_started(self):
+        # Started lazily (and again after a fork) so preloading servers don't share the thread
+        if self._thread is None or not self._thread.is_alive():
+            self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='embed-request')
+            self._thread = threading.Thread(target=self._run, name='embed-dispatcher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            pending = {}
+            try:
+                self._dispatch_batch(pending)
+            except Exception as e:
+                # Whatever didn't reach a sender fails now instead of leaving its callers waiting
+                print(f"Embedding dispatcher error: {e}")
+                self._resolve(list(pending.items()), error=e)
+
+    def _dispatch_batch(self, pending):
+        """Wait for work, move it into `pending` and submit it in chunks; keys are removed from
+        `pending` as their chunk is handed to the pool"""
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+
+            # Give concurrent callers the window to join, unless a full batch is already waiting
+            deadline = time.monotonic() + self.window
+            while len(self._pending) < Config.EMBEDDING_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            pending.update(self._pending)
+            self._pending = {}
+
+        by_type = {}
+        for key, (text, input_type) in pending.items():
+            by_type.setdefault(input_type, []).append((key, text))
+        for input_type, items in by_type.items():
+            for chunk in embedding_chunks(items, text_of=lambda item: item[1]):
+                self._pool.submit(self._send, chunk, input_type)
+                for key, _ in chunk:
+                    del pending[key]
+
+    def _send(self, chunk, input_type):
+        embeddings, error = None, None
+        try:
+            result = self._call([text for _, text in chunk], input_type)
+            embeddings = result.embeddings
+            if len(embeddings) != len(chunk):
+                raise ValueError(f"Provider returned {len(embeddings)} embeddings for {len(chunk)} inputs")
+            metrics.record_tokens(self.get_provider().name, input=result.total_tokens)
+        except Exception as e:
+            self.stats['errors'] += 1
+            error = e
+        finally:
+            # Every future in the chunk gets a vector or an exception, whatever happened above
+            if error is None and embeddings is None:
+                error = RuntimeError("Embedding request aborted")
+            self._resolve(chunk, embeddings=embeddings, error=error)
+
+    def _call(self, texts, input_type):
+        provider = self.get_provider()
+        tokens = sum(len(t) // 4 + 1 for t in texts)  # same rough estimate as embedding_chunks
+        for attempt in range(self.max_retries + 1):
+            self._pace(tokens)
+            try:
+                self.stats['requests'] += 1
+                return provider.embed(texts, input_type)
+            except Exception as e:
+                if attempt == self.max_retries or not provider.is_retryable(e):
+                    raise
+                self.stats['rate_limited'] += 1
+                delay = min(self.BACKOFF_MAX, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.0)
+                with self._cond:
+                    self._resume_at = max(self._resume_at, time.monotonic() + delay)
+
+    def _pace(self, tokens):
+        waited = max(0.0, self._resume_at - time.monotonic())
+        if waited:
+            time.sleep(waited)
+        if self.request_bucket:
+            waited += self.request_bucket.take(1)
+        if self.token_bucket:
+            waited += self.token_bucket.take(tokens)
+        self.stats['paced_seconds'] += waited
+
+    def _resolve(self, chunk, embeddings=None, error=None):
+        with self._cond:
+            # A key can be gone already if its caller timed out
+            futures = [self._inflight.pop(key, None) for key, _ in chunk]
+        for i, future in enumerate(futures):
+            if future is not None:
+                self._settle(future, embeddings[i] if error is None else None, error)
+
+    @staticmethod
+    def _settle(future, embedding=None, error=None):
+        if future.done():
+            return
+        try:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(embedding)
+        except InvalidStateError:
+            pass  # settled by another thread in between
+
+
+dispatcher = EmbeddingDispatcher(
+    get_provider,
+    window=Config.EMBEDDING_DISPATCH_WINDOW_MS / 1000,
+    concurrency=Config.EMBEDDING_DISPATCH_CONCURRENCY,
+    requests_per_minute=Config.EMBEDDING_REQUESTS_PER_MINUTE,
+    tokens_per_minute=Config.EMBEDDING_TOKENS_PER_MINUTE,
+    max_retries=Config.EMBEDDING_MAX_RETRIES,
+    backoff_base=Config.EMBEDDING_BACKOFF_BASE,
+    timeout=Config.EMBEDDING_DISPATCH_TIMEOUT
+)
+
+
+def _embed_direct(missing: dict, input_type: str) -> dict:
+    """Send {key: text} straight to the provider from this thread (EMBEDDING_DISPATCH_ENABLED off)"""
+    provider = get_provider()
+    fresh = {}
+    for chunk in embedding_chunks(list(missing.items()), text_of=lambda item: item[1]):
+        result = provider.embed([t for _, t in chunk], input_type)
+        metrics.record_tokens(provider.name, input=result.total_tokens)
+        fresh.update(zip([key for key, _ in chunk], result.embeddings))
+    return fresh
+
+
+def _embed_cached(texts: list[str], input_type: str) -> list[list[float]]:
+    """Embed texts, only sending cache misses to the provider. Results keep the input order."""
+    keys = [EmbeddingCache.make_key(EMBEDDING_MODEL, input_type, t) for t in texts]
+    found = cache.get_many(keys)
+
+    # Deduplicate misses so repeated texts in one batch cost a single input
+    missing = {}
+    for key, t in zip(keys, texts):
+        if key not in found and key not in missing:
+            missing[key] = t
+
+    if missing:
+        with metrics.span('embed'):
+            if Config.EMBEDDING_DISPATCH_ENABLED:
+                fresh = dispatcher.embed(missing, input_type)
+            else:
+                fresh = _embed_direct(missing, input_type)
+        cache.put_many(fresh)
+        found.update(fresh)
+
+    return [found[key] for key in keys]
 
-vo = voyageai.Client(api_key=os.getenv('VOYAGE_API_KEY'))
 
 def get_embedding(text: str) -> list[float]:
-    """Generate embedding vector for text using Voyage AI"""
+    """Generate embedding vector for text with the configured provider"""
     if not text or not text.strip():
         return None
-    
-    result = vo.embed(
-        [text],
-        model="voyage-large-2-instruct",
-        input_type="document"
-    )
-    
-    return result.embeddings[0]
+
+    return _embed_cached([text], "document")[0]
 
 
 def get_query_embedding(text: str) -> list[float]:
     """Generate embedding for search query (uses different input_type)"""
     if not text or not text.strip():
         return None
-    
-    result = vo.embed(
-        [text],
-        model="voyage-large-2-instruct",
-        input_type="query"  # Optimized for search queries
-    )
-    
-    return result.embeddings[0]
+
+    return _embed_cached([text], "query")[0]  # Optimized for search queries
 
 
 def get_embeddings_batch(texts: list[str]) -> list[list[float]]:
     """Generate embeddings for multiple texts (more efficient)"""
     texts = [t for t in texts if t and t.strip()]
-    
+
     if not texts:
         return []
-    
-    result = vo.embed(
-        texts,
-        model="voyage-large-2-instruct",
-        input_type="document"
-    )
-    
-    return result.embeddings
\ No newline at end of file
+
+    return _embed_cached(texts, "document")
+
+
+def embedding_chunks(items, text_of=lambda item: item):
+    """Split items into chunks that fit one provider request (input count and rough token budget)"""
+    chunk, chunk_tokens = [], 0
+
+    for item in items:
+        tokens = len(text_of(item)) // 4 + 1  # rough estimate, ~4 chars per token
+        if chunk and (len(chunk) >= Config.EMBEDDING_BATCH_SIZE or chunk_tokens + tokens > Config.EMBEDDING_BATCH_MAX_TOKENS):
+            yield chunk
+            chunk, chunk_tokens = [], 0
+        chunk.append(item)
+        chunk_tokens += tokens
+
+    if chunk:
+        yield chunk
+
+
+def get_cache_stats() -> dict:
+    """Hit/miss counters for the embedding cache (this process only)"""
+    return cache.get_stats()
+
+
+def warm_up():
+    """Build the provider and send one tiny uncached request, which opens its HTTP connection
+    (on a dispatcher thread when dispatching, where later requests will reuse it)"""
+    key = EmbeddingCache.make_key(EMBEDDING_MODEL, 'query', 'warm up')
+    if Config.EMBEDDING_DISPATCH_ENABLED:
+        dispatcher.embed({key: 'warm up'}, 'query')
+    else:
+        _embed_direct({key: 'warm up'}, 'query')
+
+
+def get_dispatch_stats() -> dict:
+    """Batching, coalescing and rate-limit counters for the embedding dispatcher (this process only)"""
+    return dispatcher.get_stats()
+
+
+def invalidate_embedding_cache(model: str = None) -> int:
+    """Drop cached embeddings for `model`, or for every model other than EMBEDDING_MODEL.
+    Returns the number of persistent rows removed."""
+    return cache.invalidate(model)
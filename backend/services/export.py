@@ -0,0 +1,151 @@
+# services/export.py
+"""Full-journal export as NDJSON.
+
+One JSON object per line, each with a `type`: a `header`, then every `tag`, `memory`,
+`version` and `perspective`, then an `end` line with the counts (a missing `end` means the
+download was cut short). Each section is read through a server-side cursor in yield_per
+batches on one REPEATABLE READ connection, so memory use stays flat however large the
+journal is and every section comes from the same snapshot. Versions are written with their
+full content - delta-stored versions are rebuilt in order as they stream past.
+
+Embeddings, when included, are base64 of little-endian float32 - about a quarter of the
+size of the JSON float list.
+"""
+import base64
+import json
+import zlib
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import func, select
+
+from config import Config
+from models import db, Memory, MemoryVersion, MemoryPerspective, Tag, memory_tags, MEMORY_CHRONOLOGY
+from services.embedding_service import EMBEDDING_MODEL
+from services.memory_versions import apply_delta
+
+
+FORMAT_VERSION = 1
+YIELD_PER = 500
+FLUSH_BYTES = 64 * 1024  # lines are buffered into chunks about this size before being sent
+
+MEMORY_FIELDS = (
+    'id', 'memory_number', 'year', 'grade', 'age', 'date_precision',
+    'encrypted_content', 'encryption_key_id', 'confidence_level', 'emotional_valence',
+    'emotional_intensity', 'body_sensations', 'visibility', 'is_sealed',
+    'embedding_status', 'embedding_model', 'created_at', 'updated_at'
+)
+VERSION_FIELDS = (
+    'id', 'memory_id', 'version_number', 'encrypted_content', 'encryption_key_id',
+    'change_note', 'confidence_level', 'emotional_valence', 'created_at'
+)
+PERSPECTIVE_FIELDS = (
+    'id', 'memory_id', 'user_id', 'encrypted_content', 'encryption_key_id',
+    'confidence_level', 'emotional_valence', 'their_year', 'their_age', 'created_at', 'updated_at'
+)
+TAG_FIELDS = ('id', 'name', 'tag_type', 'color', 'created_at')
+
+
+def encode_embedding(embedding):
+    return base64.b64encode(np.asarray(embedding, dtype='<f4').tobytes()).decode('ascii')
+
+
+def decode_embedding(encoded):
+    return np.frombuffer(base64.b64decode(encoded), dtype='<f4').tolist()
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)  # UUIDs
+
+
+def _record(record_type, row, fields):
+    return {'type': record_type, **{field: getattr(row, field) for field in fields}}
+
+
+def _queries(user_id, include_embeddings):
+    tag_ids = select(func.array_agg(memory_tags.c.tag_id)).where(
+        memory_tags.c.memory_id == Memory.id
+    ).scalar_subquery()
+    memory_columns = [getattr(Memory, field) for field in MEMORY_FIELDS] + [tag_ids.label('tag_ids')]
+    if include_embeddings:
+        memory_columns.append(Memory.embedding)
+
+    user_memories = select(Memory.id).where(Memory.user_id == user_id)
+
+    return (
+        ('tag', TAG_FIELDS, select(*[getattr(Tag, f) for f in TAG_FIELDS]).where(Tag.user_id == user_id).order_by(Tag.name)),
+        ('memory', MEMORY_FIELDS, select(*memory_columns).where(Memory.user_id == user_id).order_by(
+            *[column.desc() for column in MEMORY_CHRONOLOGY]
+        )),
+        ('version', VERSION_FIELDS, select(*[getattr(MemoryVersion, f) for f in VERSION_FIELDS], MemoryVersion.content_delta).where(
+            MemoryVersion.memory_id.in_(user_memories)
+        ).order_by(MemoryVersion.memory_id, MemoryVersion.version_number)),
+        ('perspective', PERSPECTIVE_FIELDS, select(*[getattr(MemoryPerspective, f) for f in PERSPECTIVE_FIELDS]).where(
+            MemoryPerspective.memory_id.in_(user_memories)
+        ).order_by(MemoryPerspective.memory_id, MemoryPerspective.created_at)),
+    )
+
+
+def export_records(user_id, include_embeddings=False):
+    """Yield the export as dicts, one per NDJSON line"""
+    yield {
+        'type': 'header',
+        'format': 'remember-export',
+        'format_version': FORMAT_VERSION,
+        'user_id': str(user_id),
+        'exported_at': datetime.utcnow().isoformat(),
+        'embeddings': {
+            'model': EMBEDDING_MODEL,
+            'dimension': Config.EMBEDDING_DIMENSION,
+            'encoding': 'base64-float32-le'
+        } if include_embeddings else None
+    }
+
+    counts = {}
+    # Its own connection: the request session isn't held open for the whole download
+    with db.engine.connect().execution_options(isolation_level='REPEATABLE READ') as conn:
+        for record_type, fields, query in _queries(user_id, include_embeddings):
+            result = conn.execution_options(stream_results=True, yield_per=YIELD_PER).execute(query)
+            counts[record_type] = 0
+            previous = (None, None)  # (memory_id, content) of the last version, the base for a delta
+            for row in result:
+                record = _record(record_type, row, fields)
+                if record_type == 'memory':
+                    record['tag_ids'] = row.tag_ids or []
+                    if include_embeddings:
+                        record['embedding'] = encode_embedding(row.embedding) if row.embedding is not None else None
+                elif record_type == 'version':
+                    if row.encrypted_content is None:
+                        record['encrypted_content'] = apply_delta(previous[1], row.content_delta)
+                    previous = (row.memory_id, record['encrypted_content'])
+                counts[record_type] += 1
+                yield record
+
+    yield {'type': 'end', 'counts': counts}
+
+
+def export_ndjson(user_id, include_embeddings=False, compress=False):
+    """Yield the export as NDJSON bytes in ~FLUSH_BYTES chunks, gzip-compressed if asked"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits 31 = gzip container
+    buffer, size = [], 0
+
+    def flush(data):
+        return compressor.compress(data) if compressor else data
+
+    for record in export_records(user_id, include_embeddings):
+        line = json.dumps(record, default=_json_default, separators=(',', ':')).encode('utf-8') + b'\n'
+        buffer.append(line)
+        size += len(line)
+        if size >= FLUSH_BYTES:
+            chunk = flush(b''.join(buffer))
+            buffer, size = [], 0
+            if chunk:
+                yield chunk
+
+    tail = flush(b''.join(buffer))
+    if compressor:
+        tail += compressor.flush()
+    if tail:
+        yield tail
@@ -0,0 +1,44 @@
+# services/llm.py
+"""The Anthropic client, built on first use.
+
+Importing the SDK and constructing the client is a noticeable share of worker boot, and
+CLI commands never call Claude, so nothing happens until get_client(). After that one
+client - one httpx connection pool - serves every request in the process.
+"""
+import os
+import threading
+
+from config import Config
+
+
+_client = None
+_http_client = None
+_lock = threading.Lock()
+
+
+def get_client():
+    global _client, _http_client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                import httpx
+                from anthropic import Anthropic
+
+                _http_client = httpx.Client(limits=httpx.Limits(
+                    max_connections=Config.ANTHROPIC_MAX_CONNECTIONS,
+                    max_keepalive_connections=Config.ANTHROPIC_MAX_KEEPALIVE
+                ))
+                # ANTHROPIC_BASE_URL can point at a local fake server for testing
+                _client = Anthropic(
+                    api_key=os.getenv('ANTHROPIC_API_KEY'),
+                    base_url=os.getenv('ANTHROPIC_BASE_URL'),
+                    http_client=_http_client
+                )
+    return _client
+
+
+def warm_up():
+    """Open a pooled connection to the API host. The HEAD request is unauthenticated and
+    costs no tokens; whatever status comes back, the TLS connection stays in the pool."""
+    client = get_client()
+    _http_client.head(str(client.base_url), timeout=10)
@@ -0,0 +1,38 @@
+# services/memory_set.py
+from sqlalchemy import text
+
+from models import db
+
+
+# Every change to a user's memories - or to what vector search can see of them - bumps
+# user_profiles.memory_set_version. Anything derived from the whole memory set (cached
+# analyses, in-memory indexes) stores the version it was built from and is stale once it moves.
+# Raw SQL on purpose: an ORM update would also evict the user's auth cache entries.
+
+
+def bump_version(user_id, connection=None):
+    """Bump the memory set version for one user in the current transaction. Returns the new version."""
+    return (connection or db.session).execute(text("""
+        UPDATE user_profiles SET memory_set_version = memory_set_version + 1
+        WHERE id = CAST(:user_id AS uuid)
+        RETURNING memory_set_version
+    """), {'user_id': str(user_id)}).scalar()
+
+
+def bump_version_for_memories(memory_ids, connection=None):
+    """Bump the version of every user owning one of these memories. Returns {user_id: new version}."""
+    if not memory_ids:
+        return {}
+
+    rows = (connection or db.session).execute(text("""
+        UPDATE user_profiles SET memory_set_version = memory_set_version + 1
+        WHERE id IN (SELECT DISTINCT user_id FROM memories WHERE id = ANY(CAST(:ids AS uuid[])))
+        RETURNING id, memory_set_version
+    """), {'ids': [str(mid) for mid in memory_ids]})
+    return {str(row.id): row.memory_set_version for row in rows}
+
+
+def current_version(user_id):
+    return db.session.execute(text("""
+        SELECT memory_set_version FROM user_profiles WHERE id = CAST(:user_id AS uuid)
+    """), {'user_id': str(user_id)}).scalar() or 0
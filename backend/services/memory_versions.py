@@ -0,0 +1,163 @@
+# services/memory_versions.py
+"""Memory version history stored as deltas.
+
+Version 1 is the content a memory was created with (captured on its first edit), and every
+edit that changes a versioned field appends the next version. A version row holds either
+the full content (a snapshot) or an edit script against the previous version. A snapshot is
+written at least every MEMORY_VERSION_SNAPSHOT_EVERY versions - and whenever the script
+wouldn't be smaller than the content, e.g. ciphertext that changes completely on
+re-encryption - so rebuilding any version reads and applies at most N rows.
+
+An edit script is a JSON list applied left to right over the previous content: a positive
+int copies that many characters, a negative int skips that many, a string is inserted.
+"""
+import difflib
+import json
+from collections import namedtuple
+
+from flask import current_app
+from sqlalchemy import func, select
+
+from models import db, MemoryVersion
+
+
+# Fields a version records - an edit that changes none of them doesn't create a version
+VersionState = namedtuple('VersionState', 'encrypted_content encryption_key_id confidence_level emotional_valence')
+
+# Above this many character pairs the changed middle is replaced wholesale instead of diffed,
+# keeping SequenceMatcher's quadratic worst case off the request path
+MAX_DIFF_CELLS = 4_000_000
+
+
+def version_state(memory):
+    return VersionState(memory.encrypted_content, memory.encryption_key_id, memory.confidence_level, memory.emotional_valence)
+
+
+def compute_delta(old, new):
+    """Edit script turning `old` into `new`"""
+    # Most edits touch one spot - trim the common ends before diffing
+    prefix = 0
+    limit = min(len(old), len(new))
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and old[-1 - suffix] == new[-1 - suffix]:
+        suffix += 1
+
+    old_middle, new_middle = old[prefix:len(old) - suffix], new[prefix:len(new) - suffix]
+    ops = [prefix] if prefix else []
+
+    if len(old_middle) * len(new_middle) > MAX_DIFF_CELLS:
+        opcodes = [('replace', 0, len(old_middle), 0, len(new_middle))]
+    else:
+        opcodes = difflib.SequenceMatcher(None, old_middle, new_middle, autojunk=False).get_opcodes()
+
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            ops.append(i2 - i1)
+            continue
+        if i2 > i1:
+            ops.append(i1 - i2)
+        if j2 > j1:
+            ops.append(new_middle[j1:j2])
+
+    if suffix:
+        ops.append(suffix)
+    return ops
+
+
+def apply_delta(base, delta):
+    parts, position = [], 0
+    for op in delta:
+        if isinstance(op, str):
+            parts.append(op)
+        elif op > 0:
+            parts.append(base[position:position + op])
+            position += op
+        else:
+            position -= op
+    if position != len(base):
+        raise ValueError(f"Version delta covers {position} of {len(base)} characters of its base")
+    return ''.join(parts)
+
+
+def replay(rows):
+    """Content of each row in order; `rows` must start at a snapshot and be consecutive"""
+    content = None
+    for row in rows:
+        if row.encrypted_content is not None:
+            content = row.encrypted_content
+        elif content is None:
+            raise ValueError(f"Version {row.version_number} is a delta with no snapshot before it")
+        else:
+            content = apply_delta(content, row.content_delta)
+        yield content
+
+
+def record_version(memory, previous, change_note=None):
+    """Append a version for an edit of `memory` (already modified in the session).
+
+    `previous` is version_state(memory) from before the edit. Call with the memory row locked
+    (SELECT ... FOR UPDATE) so concurrent edits can't claim the same version number.
+    """
+    latest, last_snapshot = db.session.query(
+        func.max(MemoryVersion.version_number),
+        func.max(MemoryVersion.version_number).filter(MemoryVersion.encrypted_content.isnot(None))
+    ).filter(MemoryVersion.memory_id == memory.id).one()
+
+    if latest is None:
+        # First edit: the content the memory was created with becomes version 1
+        db.session.add(MemoryVersion(
+            memory_id=memory.id,
+            version_number=1,
+            encrypted_content=previous.encrypted_content,
+            encryption_key_id=previous.encryption_key_id,
+            confidence_level=previous.confidence_level,
+            emotional_valence=previous.emotional_valence,
+            created_at=memory.created_at
+        ))
+        latest = last_snapshot = 1
+
+    number = latest + 1
+    content = memory.encrypted_content
+    delta = None
+    if last_snapshot is not None and number - last_snapshot < current_app.config['MEMORY_VERSION_SNAPSHOT_EVERY']:
+        delta = compute_delta(previous.encrypted_content, content)
+        if len(json.dumps(delta)) >= len(content):
+            delta = None
+
+    version = MemoryVersion(
+        memory_id=memory.id,
+        version_number=number,
+        encrypted_content=content if delta is None else None,
+        content_delta=delta,
+        encryption_key_id=memory.encryption_key_id,
+        change_note=change_note,
+        confidence_level=memory.confidence_level,
+        emotional_valence=memory.emotional_valence
+    )
+    db.session.add(version)
+    return version
+
+
+def version_content(memory_id, version_number):
+    """Rebuild one version's content from the nearest snapshot at or before it (at most N rows).
+    Returns None if the version doesn't exist."""
+    snapshot = select(func.max(MemoryVersion.version_number)).where(
+        MemoryVersion.memory_id == memory_id,
+        MemoryVersion.version_number <= version_number,
+        MemoryVersion.encrypted_content.isnot(None)
+    ).scalar_subquery()
+
+    rows = db.session.query(
+        MemoryVersion.version_number, MemoryVersion.encrypted_content, MemoryVersion.content_delta
+    ).filter(
+        MemoryVersion.memory_id == memory_id,
+        MemoryVersion.version_number.between(snapshot, version_number)
+    ).order_by(MemoryVersion.version_number).all()
+
+    if not rows or rows[-1].version_number != version_number:
+        return None
+    for content in replay(rows):
+        pass
+    return content
@@ -0,0 +1,203 @@
+# services/metrics.py
+"""Request-scoped timing spans, exported as Server-Timing headers and Prometheus metrics.
+
+A sampled request (METRICS_SAMPLE_RATE) records how long it spent in auth, embedding calls,
+DB queries and LLM calls; unsampled requests skip the clock reads entirely. Token counters
+are always kept since they're one addition per provider call. Metrics are per process -
+Prometheus sums them across workers.
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# Seconds - covers cached auth (sub-ms) through long Claude generations
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series.setdefault(label_values, [0] * (len(BUCKETS) + 2))
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for label_values, series in sorted(self._series.items()):
+            labels = ','.join(f'{k}="{v}"' for k, v in zip(self.labels, label_values))
+            prefix = labels + ',' if labels else ''
+            for bound, count in zip(BUCKETS, series):
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {series[-1]}')
+            lines.append(f'{self.name}_sum{{{labels}}} {series[-2]:.6f}')
+            lines.append(f'{self.name}_count{{{labels}}} {series[-1]}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._series = {}
+
+    def inc(self, amount, *label_values):
+        self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        for label_values, value in sorted(self._series.items()):
+            labels = ','.join(f'{k}="{v}"' for k, v in zip(self.labels, label_values))
+            lines.append(f'{self.name}{{{labels}}} {value}')
+        return lines
+
+
+_lock = threading.Lock()
+
+request_duration = Histogram('remember_request_duration_seconds', 'HTTP request latency.', ('endpoint', 'method', 'status'))
+stage_duration = Histogram('remember_stage_duration_seconds', 'Time spent per stage within a request.', ('stage',))
+tokens = Counter('remember_tokens_total', 'Provider tokens used.', ('provider', 'kind'))
+
+
+def _sampled():
+    if has_request_context():
+        return g.get('metrics_sampled', False)
+    # Background work (embedding worker, CLI) samples each span on its own
+    try:
+        return random.random() < current_app.config['METRICS_SAMPLE_RATE']
+    except RuntimeError:
+        return False  # no app context
+
+
+def record_span(stage, seconds):
+    """Add time to a stage - repeated stages (several queries, several embed calls) accumulate"""
+    with _lock:
+        stage_duration.observe(seconds, stage)
+    if has_request_context():
+        spans = g.setdefault('metrics_spans', {})
+        total, count = spans.get(stage, (0.0, 0))
+        spans[stage] = (total + seconds, count + 1)
+
+
+@contextmanager
+def span(stage):
+    """Time the block as `stage` if this request (or background span) is sampled"""
+    if not _sampled():
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - started)
+
+
+def record_tokens(provider, **counts):
+    """e.g. record_tokens('anthropic', input=..., output=..., cache_read=...)"""
+    with _lock:
+        for kind, amount in counts.items():
+            if amount:
+                tokens.inc(amount, provider, kind)
+
+
+# DB time comes from the engine events, so every query - ORM or text() - is counted
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and g.get('metrics_sampled'):
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_query_start')
+    if starts and has_request_context() and g.get('metrics_sampled'):
+        record_span('db', time.perf_counter() - starts.pop())
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(exception_context):
+    # A failed query never reaches after_cursor_execute - drop its start so the pooled
+    # connection doesn't carry it into the next request's timings
+    if exception_context.connection is not None:
+        exception_context.connection.info.pop('metrics_query_start', None)
+
+
+def server_timing_header(spans, total):
+    parts = [
+        f'{stage};dur={seconds * 1000:.1f};desc="{count}x"' if count > 1 else f'{stage};dur={seconds * 1000:.1f}'
+        for stage, (seconds, count) in spans.items()
+    ]
+    parts.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(parts)
+
+
+def render():
+    """Prometheus text exposition of everything recorded in this process, plus cache and dispatcher gauges"""
+    # Imported here - the caches pull in the provider clients and DB models
+    from middleware.auth_middleware import get_auth_cache_stats
+    from services.embedding_service import get_cache_stats, get_dispatch_stats
+    from services.vector_index import index_cache
+
+    with _lock:
+        lines = request_duration.render() + stage_duration.render() + tokens.render()
+
+    for cache_name, stats in (
+        ('auth', get_auth_cache_stats()),
+        ('embedding', get_cache_stats()),
+        ('vector_index', index_cache.get_stats())
+    ):
+        for key, value in stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f'remember_cache{{cache="{cache_name}",stat="{key}"}} {value}')
+
+    for key, value in get_dispatch_stats().items():
+        lines.append(f'remember_embedding_dispatch{{stat="{key}"}} {value}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app):
+    """Sample requests, attach Server-Timing and register GET /metrics"""
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_sampled = random.random() < app.config['METRICS_SAMPLE_RATE']
+        if g.metrics_sampled:
+            g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def finish_request_timer(response):
+        if not g.get('metrics_sampled'):
+            return response
+
+        total = time.perf_counter() - g.metrics_started
+        with _lock:
+            request_duration.observe(total, request.endpoint or 'unmatched', request.method, response.status_code)
+        # Streamed responses only cover the time to the first byte here
+        response.headers['Server-Timing'] = server_timing_header(g.get('metrics_spans', {}), total)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        token = app.config.get('METRICS_TOKEN')
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+        return Response(render(), mimetype='text/plain; version=0.0.4')
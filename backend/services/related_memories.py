@@ -0,0 +1,131 @@
+# services/related_memories.py
+"""Precomputed related-memories graph: each memory's RELATED_MEMORIES_K nearest neighbours
+(same user, cosine) stored in memory_neighbors, so memory cards read a short list by
+primary key instead of running a vector scan each.
+
+The graph is kept current incrementally whenever embeddings change, inside the writer's
+transaction (pass `connection` when writing on a connection other than db.session):
+
+- update_neighbors(ids) after memories gain, change or lose an embedding
+- referencing(ids) before deleting memories, then refresh(those ids) after
+
+Incremental updates are exact for the changed memories and for every list that pointed at
+them. A new memory is also offered to its own neighbours' lists (kNN isn't symmetric, so a
+memory further out could occasionally miss it). `flask vectors rebuild-neighbors`
+recomputes everything from scratch.
+"""
+import time
+
+from flask import current_app
+from sqlalchemy import text
+
+from models import db
+
+
+def _ids(memory_ids):
+    return [str(mid) for mid in memory_ids]
+
+
+def referencing(memory_ids, connection=None):
+    """Memories (other than these) whose neighbour lists include one of these memories"""
+    if not memory_ids:
+        return []
+    rows = (connection or db.session).execute(text("""
+        SELECT DISTINCT memory_id FROM memory_neighbors
+        WHERE neighbor_id = ANY(CAST(:ids AS uuid[])) AND NOT memory_id = ANY(CAST(:ids AS uuid[]))
+    """), {'ids': _ids(memory_ids)})
+    return [str(row.memory_id) for row in rows]
+
+
+def refresh(memory_ids, connection=None, k=None):
+    """Recompute these memories' neighbour lists exactly (one LATERAL nearest-neighbour query each).
+    Memories without an embedding end up with an empty list. Returns the edges written."""
+    if not memory_ids:
+        return 0
+    conn = connection or db.session
+    params = {'ids': _ids(memory_ids), 'k': k or current_app.config['RELATED_MEMORIES_K']}
+
+    conn.execute(text("DELETE FROM memory_neighbors WHERE memory_id = ANY(CAST(:ids AS uuid[]))"), params)
+    return conn.execute(text("""
+        INSERT INTO memory_neighbors (memory_id, neighbor_id, similarity)
+        SELECT m.id, n.id, 1 - n.distance
+        FROM memories m
+        CROSS JOIN LATERAL (
+            SELECT o.id, o.embedding <=> m.embedding AS distance
+            FROM memories o
+            WHERE o.user_id = m.user_id
+                AND o.id <> m.id
+                AND o.embedding IS NOT NULL
+            ORDER BY distance
+            LIMIT :k
+        ) n
+        WHERE m.id = ANY(CAST(:ids AS uuid[]))
+            AND m.embedding IS NOT NULL
+    """), params).rowcount
+
+
+def update_neighbors(memory_ids, connection=None):
+    """Bring the graph up to date after these memories' embeddings changed"""
+    if not memory_ids:
+        return
+    conn = connection or db.session
+    params = {'ids': _ids(memory_ids), 'k': current_app.config['RELATED_MEMORIES_K']}
+
+    # Lists that pointed at the old vectors hold stale similarities - take the edges out and
+    # recompute those lists along with the changed memories' own
+    affected = [str(row.memory_id) for row in conn.execute(text("""
+        DELETE FROM memory_neighbors
+        WHERE neighbor_id = ANY(CAST(:ids AS uuid[])) AND NOT memory_id = ANY(CAST(:ids AS uuid[]))
+        RETURNING memory_id
+    """), params)]
+    refresh(list(memory_ids) + sorted(set(affected)), connection=conn)
+
+    # Offer each changed memory to its neighbours' lists, then trim those back to k
+    conn.execute(text("""
+        INSERT INTO memory_neighbors (memory_id, neighbor_id, similarity)
+        SELECT neighbor_id, memory_id, similarity FROM memory_neighbors
+        WHERE memory_id = ANY(CAST(:ids AS uuid[]))
+        ON CONFLICT (memory_id, neighbor_id) DO UPDATE SET similarity = EXCLUDED.similarity
+    """), params)
+    conn.execute(text("""
+        DELETE FROM memory_neighbors d
+        USING (
+            SELECT memory_id, neighbor_id,
+                   row_number() OVER (PARTITION BY memory_id ORDER BY similarity DESC, neighbor_id) AS rank
+            FROM memory_neighbors
+            WHERE memory_id IN (
+                SELECT neighbor_id FROM memory_neighbors WHERE memory_id = ANY(CAST(:ids AS uuid[]))
+            )
+        ) ranked
+        WHERE d.memory_id = ranked.memory_id
+            AND d.neighbor_id = ranked.neighbor_id
+            AND ranked.rank > :k
+    """), params)
+
+
+def rebuild(user_id=None, batch_size=200, echo=print):
+    """Recompute every neighbour list (or one user's), committing per batch of memories"""
+    k = current_app.config['RELATED_MEMORIES_K']
+    query = "SELECT id FROM memories WHERE embedding IS NOT NULL"
+    params = {}
+    if user_id:
+        query += " AND user_id = CAST(:user_id AS uuid)"
+        params['user_id'] = str(user_id)
+    ids = [str(row.id) for row in db.session.execute(text(query + " ORDER BY id"), params)]
+
+    # Lists of memories that have since lost their embedding
+    db.session.execute(text(f"""
+        DELETE FROM memory_neighbors n USING memories m
+        WHERE n.memory_id = m.id AND m.embedding IS NULL{' AND m.user_id = CAST(:user_id AS uuid)' if user_id else ''}
+    """), params)
+    db.session.commit()
+
+    started, edges = time.monotonic(), 0
+    for start in range(0, len(ids), batch_size):
+        edges += refresh(ids[start:start + batch_size], k=k)
+        db.session.commit()
+        echo(f"  {min(start + batch_size, len(ids))}/{len(ids)} memories")
+
+    elapsed = time.monotonic() - started
+    echo(f"Rebuilt {len(ids)} neighbour lists ({edges} edges, k={k}) in {elapsed:.1f}s")
+    return len(ids), edges
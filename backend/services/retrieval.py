@@ -0,0 +1,318 @@
+# services/retrieval.py
+import re
+from collections import namedtuple
+
+from flask import current_app
+from pgvector.sqlalchemy import Vector
+from sqlalchemy import bindparam, text
+
+from config import Config
+from models import db
+from services import vector_index
+
+
+MemoryHit = namedtuple('MemoryHit', [
+    'id', 'encrypted_content', 'year', 'age', 'grade',
+    'confidence_level', 'emotional_valence', 'created_at', 'similarity', 'embedding'
+], defaults=(None,))
+
+
+MAX_EF_SEARCH = 1000
+MAX_PROBES = 1000
+
+# Index-backed distance for each VECTOR_STORAGE mode. The compact ones only pick candidates;
+# the final order always comes from the full-precision `embedding`.
+COARSE_DISTANCE = {
+    'full': "embedding <=> CAST(:query_embedding AS vector)",
+    'half': f"embedding_half <=> CAST(:query_embedding AS halfvec({Config.EMBEDDING_DIMENSION}))",
+    'binary': "embedding_bits <~> binary_quantize(CAST(:query_embedding AS vector))",
+}
+
+# Postgres types of the search statements' parameters, in PREPARE order
+PARAM_TYPES = {
+    'query_embedding': 'vector',
+    'query_text': 'text',
+    'user_id': 'uuid',
+    'limit': 'int',
+    'pool': 'int',
+    'candidates': 'int',
+    'rrf_k': 'int',
+}
+
+
+def with_query_embedding(sql):
+    """Bind :query_embedding through the pgvector type, so callers pass the vector itself
+    (list or NumPy array) rather than hand-formatting it"""
+    return sql.bindparams(bindparam('query_embedding', type_=Vector(Config.EMBEDDING_DIMENSION)))
+
+
+class SearchStatement:
+    """A search query that runs as a server-side prepared statement.
+
+    The first use on a pooled connection PREPAREs it; later uses only EXECUTE, so Postgres
+    skips parsing and planning and the query vector is parsed once per search. Disable with
+    SEARCH_PREPARED_STATEMENTS=false behind a transaction-mode pooler (pgbouncer), where
+    session state doesn't follow the client.
+    """
+
+    def __init__(self, name, sql, include_embedding=False):
+        self.name = name
+        self.params = [param for param in PARAM_TYPES if re.search(rf'(?<!:):{param}\b', sql)]
+        self.include_embedding = include_embedding
+
+        body = sql
+        for position, param in enumerate(self.params, 1):
+            body = re.sub(rf'(?<!:):{param}\b', f'${position}', body)
+        self.prepare_sql = f"PREPARE {name} ({', '.join(PARAM_TYPES[p] for p in self.params)}) AS {body}"
+
+        self.sql = self._bind(text(sql))
+        self.execute_sql = self._bind(text(f"EXECUTE {name}({', '.join(':' + p for p in self.params)})"))
+
+    def _bind(self, sql):
+        if 'query_embedding' in self.params:
+            sql = with_query_embedding(sql)
+        # Let pgvector parse the embedding column into an array instead of returning its text form
+        return sql.columns(embedding=Vector(Config.EMBEDDING_DIMENSION)) if self.include_embedding else sql
+
+    def execute(self, **params):
+        params = {param: params[param] for param in self.params}
+        if not current_app.config['SEARCH_PREPARED_STATEMENTS']:
+            return db.session.execute(self.sql, params).fetchall()
+
+        connection = db.session.connection()
+        # .info lives as long as the DBAPI connection, so this tracks what that backend has prepared
+        prepared = connection.connection.info.setdefault('prepared_statements', set())
+        if self.name not in prepared:
+            connection.exec_driver_sql(self.prepare_sql)
+            prepared.add(self.name)
+        return connection.execute(self.execute_sql, params).fetchall()
+
+
+_statements = {}
+
+
+def _statement(name, build, include_embedding=False):
+    """Build each statement variant once per process"""
+    if name not in _statements:
+        _statements[name] = SearchStatement(name, build(), include_embedding)
+    return _statements[name]
+
+
+def _embedding_column(include_embedding):
+    return ',\n            embedding' if include_embedding else ''
+
+
+def _similar_sql(storage, include_embedding):
+    # The distance is computed once per row and ordered by alias, which the ANN index still serves.
+    # Quantized storage takes :pool candidates from the compact index, then orders them exactly.
+    if storage == 'full':
+        source = """memories
+            WHERE user_id = :user_id
+                AND embedding IS NOT NULL"""
+    else:
+        source = f"""(
+                SELECT id, encrypted_content, year, age, grade, confidence_level,
+                       emotional_valence, created_at, embedding
+                FROM memories
+                WHERE user_id = :user_id
+                    AND embedding IS NOT NULL
+                ORDER BY {COARSE_DISTANCE[storage]}
+                LIMIT :pool
+            ) candidates"""
+
+    return f"""
+        SELECT
+            id,
+            encrypted_content,
+            year,
+            age,
+            grade,
+            confidence_level,
+            emotional_valence,
+            created_at,
+            1 - distance AS similarity{_embedding_column(include_embedding)}
+        FROM (
+            SELECT id, encrypted_content, year, age, grade, confidence_level, emotional_valence, created_at,
+                   embedding <=> CAST(:query_embedding AS vector) AS distance{_embedding_column(include_embedding)}
+            FROM {source}
+            ORDER BY distance
+            LIMIT :limit
+        ) nearest
+        ORDER BY distance
+    """
+
+
+def apply_search_settings(ef_search=None, probes=None):
+    """Set the ANN recall knobs for the current transaction (falls back to Config defaults)"""
+    ef_search = min(max(int(ef_search or current_app.config['HNSW_EF_SEARCH']), 1), MAX_EF_SEARCH)
+    probes = min(max(int(probes or current_app.config['IVFFLAT_PROBES']), 1), MAX_PROBES)
+
+    # set_config(..., true) is SET LOCAL - it only lasts until the end of this transaction
+    db.session.execute(text("""
+        SELECT set_config('hnsw.ef_search', :ef_search, true),
+               set_config('ivfflat.probes', :probes, true)
+    """), {'ef_search': str(ef_search), 'probes': str(probes)})
+
+    iterative_scan = current_app.config.get('VECTOR_ITERATIVE_SCAN')
+    if iterative_scan:
+        db.session.execute(text("SELECT set_config('hnsw.iterative_scan', :mode, true)"), {'mode': iterative_scan})
+
+    return {'ef_search': ef_search, 'probes': probes}
+
+
+def search_similar(user_id, query_embedding, limit, ef_search=None, probes=None, backend=None, include_embedding=False):
+    """Nearest memories to the query embedding for one user, most similar first.
+    backend overrides SEARCH_BACKEND ('pgvector' or 'memory'); include_embedding adds each
+    row's stored vector (as a NumPy array) for callers that post-process the candidates."""
+    if (backend or current_app.config['SEARCH_BACKEND']) == 'memory':
+        return _search_in_memory(user_id, query_embedding, limit, include_embedding)
+
+    apply_search_settings(ef_search, probes)
+
+    storage = current_app.config['VECTOR_STORAGE']
+    statement = _statement(
+        f"search_similar_{storage}{'_with_embedding' if include_embedding else ''}",
+        lambda: _similar_sql(storage, include_embedding),
+        include_embedding
+    )
+
+    return statement.execute(
+        query_embedding=query_embedding,
+        user_id=str(user_id),
+        limit=limit,
+        pool=limit * current_app.config['VECTOR_RERANK_FACTOR']
+    )
+
+
+def _search_in_memory(user_id, query_embedding, limit, include_embedding=False):
+    """Top-k from the in-process index, then one primary-key fetch for the row data"""
+    hits = vector_index.search(user_id, query_embedding, limit)
+    if not hits:
+        return []
+
+    sql = text(f"""
+        SELECT id, encrypted_content, year, age, grade, confidence_level, emotional_valence, created_at{_embedding_column(include_embedding)}
+        FROM memories
+        WHERE id = ANY(CAST(:ids AS uuid[]))
+    """)
+    if include_embedding:
+        sql = sql.columns(embedding=Vector(Config.EMBEDDING_DIMENSION))
+    rows = db.session.execute(sql, {'ids': [memory_id for memory_id, _ in hits]})
+    by_id = {str(row.id): row for row in rows}
+
+    # A memory deleted since the index was built is simply skipped
+    return [
+        MemoryHit(*by_id[memory_id][:8], similarity, by_id[memory_id].embedding if include_embedding else None)
+        for memory_id, similarity in hits
+        if memory_id in by_id
+    ]
+
+
+LEXICAL_SQL = """
+    SELECT
+        id,
+        encrypted_content,
+        year,
+        age,
+        grade,
+        confidence_level,
+        emotional_valence,
+        created_at,
+        NULL::float AS similarity,
+        ts_rank_cd(content_tsv, query) AS score
+    FROM memories, websearch_to_tsquery('english', :query_text) AS query
+    WHERE user_id = :user_id
+        AND content_tsv @@ query
+    ORDER BY score DESC, id
+    LIMIT :limit
+"""
+
+
+def search_lexical(user_id, query_text, limit):
+    """Full-text matches for one user, best ts_rank first. No embedding call needed."""
+    return _statement('search_lexical', lambda: LEXICAL_SQL).execute(
+        query_text=query_text,
+        user_id=str(user_id),
+        limit=limit
+    )
+
+
+def _hybrid_sql(storage):
+    # Vector candidates come from the compact column when quantized (reranked exactly below)
+    return f"""
+        WITH vector_hits AS (
+            SELECT id, distance, row_number() OVER (ORDER BY distance) AS rank
+            FROM (
+                SELECT id, embedding <=> CAST(:query_embedding AS vector) AS distance
+                FROM (
+                    SELECT id, embedding
+                    FROM memories
+                    WHERE user_id = :user_id
+                        AND embedding IS NOT NULL
+                    ORDER BY {COARSE_DISTANCE[storage]}
+                    LIMIT :pool
+                ) coarse
+                ORDER BY distance
+                LIMIT :candidates
+            ) nearest
+        ),
+        lexical_hits AS (
+            SELECT id, row_number() OVER (ORDER BY score DESC, id) AS rank
+            FROM (
+                SELECT id, ts_rank_cd(content_tsv, query) AS score
+                FROM memories, websearch_to_tsquery('english', :query_text) AS query
+                WHERE user_id = :user_id
+                    AND content_tsv @@ query
+                ORDER BY score DESC, id
+                LIMIT :candidates
+            ) matches
+        ),
+        fused AS (
+            SELECT id, SUM(1.0 / (:rrf_k + rank)) AS score
+            FROM (
+                SELECT id, rank FROM vector_hits
+                UNION ALL
+                SELECT id, rank FROM lexical_hits
+            ) hits
+            GROUP BY id
+        )
+        SELECT
+            m.id,
+            m.encrypted_content,
+            m.year,
+            m.age,
+            m.grade,
+            m.confidence_level,
+            m.emotional_valence,
+            m.created_at,
+            -- Reuse the distance from the vector ranking; only lexical-only hits compute one here
+            1 - coalesce(v.distance, m.embedding <=> CAST(:query_embedding AS vector)) AS similarity,
+            fused.score
+        FROM fused
+        JOIN memories m ON m.id = fused.id
+        LEFT JOIN vector_hits v ON v.id = fused.id
+        ORDER BY fused.score DESC, m.id
+        LIMIT :limit
+    """
+
+
+def search_hybrid(user_id, query_text, query_embedding, limit, ef_search=None, probes=None):
+    """Vector and full-text rankings fused with reciprocal rank fusion, in one round trip.
+
+    Each ranking contributes 1 / (SEARCH_RRF_K + rank) for its top SEARCH_CANDIDATES hits, so
+    exact names/places/dates surface even when their embedding similarity is middling.
+    """
+    apply_search_settings(ef_search, probes)
+
+    candidates = max(current_app.config['SEARCH_CANDIDATES'], limit)
+    storage = current_app.config['VECTOR_STORAGE']
+
+    return _statement(f'search_hybrid_{storage}', lambda: _hybrid_sql(storage)).execute(
+        query_embedding=query_embedding,
+        query_text=query_text,
+        user_id=str(user_id),
+        limit=limit,
+        candidates=candidates,
+        pool=candidates if storage == 'full' else candidates * current_app.config['VECTOR_RERANK_FACTOR'],
+        rrf_k=current_app.config['SEARCH_RRF_K']
+    )
@@ -0,0 +1,231 @@
+# services/vector_index.py
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from config import Config
+from models import db, Memory
+from services.memory_set import current_version
+
+
+class UserVectorIndex:
+    """One user's embeddings as a contiguous float32 matrix of unit rows.
+
+    Immutable: updates return a new index, so searches running on another thread keep
+    a consistent view while a write swaps the cached entry.
+    """
+
+    def __init__(self, ids, matrix, version):
+        self.ids = ids
+        self.matrix = matrix
+        self.version = version
+        self.positions = {memory_id: i for i, memory_id in enumerate(ids)}
+        self.dirty = False
+
+    @staticmethod
+    def normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def search(self, query_embedding, k):
+        """Top-k (memory id, cosine similarity), most similar first"""
+        if not self.ids or k <= 0:
+            return []
+
+        scores = self.matrix @ self.normalize(query_embedding)
+        k = min(k, len(self.ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(self.ids[i], float(scores[i])) for i in top]
+
+    def updated(self, version, upserts=None, removals=None):
+        """Copy with vectors added/replaced and memories removed"""
+        upserts = upserts or {}
+        drop = {str(mid) for mid in (removals or [])} | set(upserts)
+
+        keep = [i for i, memory_id in enumerate(self.ids) if memory_id not in drop]
+        ids = [self.ids[i] for i in keep] + list(upserts)
+        parts = [self.matrix[keep]]
+        if upserts:
+            parts.append(self.normalize(list(upserts.values())))
+
+        index = UserVectorIndex(ids, np.ascontiguousarray(np.vstack(parts)), version)
+        index.dirty = True
+        return index
+
+
+class VectorIndexCache:
+    """LRU of per-user indexes, backed by .npy files that are memory-mapped on load.
+
+    Each saved matrix gets a file name of its own; a small JSON sidecar holds the version, the
+    ids and that name, and is swapped in with one rename, so readers always get ids and a matrix
+    from the same write.
+    """
+
+    def __init__(self, cache_dir, max_users):
+        self.cache_dir = cache_dir
+        self.max_users = max_users
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'file_loads': 0, 'db_loads': 0, 'incremental_updates': 0, 'evictions': 0}
+
+    def get(self, user_id):
+        """Index for the user's current memory set, loading it if missing or stale"""
+        user_id = str(user_id)
+        version = current_version(user_id)
+
+        with self._lock:
+            index = self._entries.get(user_id)
+            if index is not None and index.version == version:
+                self._entries.move_to_end(user_id)
+                self.stats['hits'] += 1
+                return index
+
+        index = self._load_file(user_id, version)
+        if index is not None:
+            with self._lock:
+                self.stats['file_loads'] += 1
+        else:
+            index = self._load_db(user_id, version)
+            with self._lock:
+                self.stats['db_loads'] += 1
+            self._save_file(user_id, index)
+
+        self._put(user_id, index)
+        return index
+
+    def apply_change(self, user_id, version, upserts=None, removals=None):
+        """Apply a committed write to a cached index without reloading it.
+
+        `version` is the memory set version the write produced; if the cached index is not
+        exactly one version behind, another change was missed and the entry is dropped instead.
+        """
+        user_id = str(user_id)
+
+        with self._lock:
+            index = self._entries.get(user_id)
+            if index is None:
+                return
+            if index.version != version - 1:
+                del self._entries[user_id]
+                return
+
+            upserts = {str(mid): vector for mid, vector in (upserts or {}).items()}
+            self._entries[user_id] = index.updated(version, upserts, removals)
+            self.stats['incremental_updates'] += 1
+
+    def sync_memory(self, user_id, version, memory_id, embedding):
+        """apply_change for one memory: a vector upserts it, None removes it"""
+        if embedding is None:
+            self.apply_change(user_id, version, removals=[memory_id])
+        else:
+            self.apply_change(user_id, version, upserts={memory_id: embedding})
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, users=len(self._entries), max_users=self.max_users)
+
+    def _put(self, user_id, index):
+        evicted = []
+        with self._lock:
+            self._entries[user_id] = index
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                evicted.append(self._entries.popitem(last=False))
+                self.stats['evictions'] += 1
+
+        # Incrementally updated indexes only live in memory; persist them on the way out
+        for evicted_user, evicted_index in evicted:
+            if evicted_index.dirty:
+                self._save_file(evicted_user, evicted_index)
+
+    def _meta_path(self, user_id):
+        return os.path.join(self.cache_dir, user_id + '.json')
+
+    def _read_meta(self, user_id):
+        try:
+            with open(self._meta_path(user_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _load_file(self, user_id, version):
+        meta = self._read_meta(user_id)
+        try:
+            if meta is None or meta['version'] != version:
+                return None
+            matrix = np.load(os.path.join(self.cache_dir, meta['matrix']), mmap_mode='r')
+        except (OSError, ValueError, KeyError):
+            return None  # e.g. the matrix was replaced between reading the sidecar and opening it
+
+        if matrix.shape[0] != len(meta['ids']):
+            return None
+        return UserVectorIndex(meta['ids'], matrix, version)
+
+    def _load_db(self, user_id, version):
+        rows = db.session.query(Memory.id, Memory.embedding).filter(
+            Memory.user_id == user_id,
+            Memory.embedding.isnot(None)
+        ).order_by(Memory.id).all()
+
+        ids = [str(row.id) for row in rows]
+        if rows:
+            matrix = UserVectorIndex.normalize(np.stack([np.asarray(row.embedding, dtype=np.float32) for row in rows]))
+        else:
+            matrix = np.zeros((0, Config.EMBEDDING_DIMENSION), dtype=np.float32)
+        return UserVectorIndex(ids, matrix, version)
+
+    def _save_file(self, user_id, index):
+        previous = self._read_meta(user_id)
+        matrix_path = meta_tmp = None
+        saved = False
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # The matrix goes to a version-stamped name no other write uses, then the sidecar
+            # naming it is written to a temp file and renamed into place
+            fd, matrix_path = tempfile.mkstemp(dir=self.cache_dir, prefix=f'{user_id}.v{index.version}.', suffix='.npy')
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.asarray(index.matrix))
+
+            fd, meta_tmp = tempfile.mkstemp(dir=self.cache_dir, prefix=user_id, suffix='.json.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'version': index.version, 'ids': index.ids, 'matrix': os.path.basename(matrix_path)}, f)
+            os.replace(meta_tmp, self._meta_path(user_id))
+            saved = True
+        except OSError as e:
+            print(f"Could not write vector index cache for {user_id}: {e}")
+            for path in (matrix_path, meta_tmp):
+                if path is not None:
+                    self._remove(path)
+
+        # The replaced matrix; indexes already mapping it keep their view until they're dropped
+        if saved and previous and previous.get('matrix'):
+            self._remove(os.path.join(self.cache_dir, previous['matrix']))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+index_cache = VectorIndexCache(Config.VECTOR_INDEX_CACHE_DIR, Config.VECTOR_INDEX_MAX_USERS)
+
+
+def search(user_id, query_embedding, k):
+    """Top-k (memory id, similarity) for the user from the in-process index"""
+    return index_cache.get(user_id).search(query_embedding, k)
+
+
+def sync_memory(user_id, version, memory_id, embedding):
+    index_cache.sync_memory(user_id, version, memory_id, embedding)
+
+
+def apply_change(user_id, version, upserts=None, removals=None):
+    index_cache.apply_change(user_id, version, upserts, removals)